@@ -1,4 +1,4 @@
-import React, { useState, useCallback } from 'react';
+import React, { useState, useCallback, useRef } from 'react';
 import { Header } from './components/Header';
 import { InputPanel } from './components/InputPanel';
 import { TestCasesPanel } from './components/TestCasesPanel';
@@ -8,7 +8,7 @@ import { ClarificationModal } from './components/ClarificationModal';
 import { DownloadModal } from './components/DownloadModal';
 import { Login } from './components/Login';
 import { TestCase, TestCaseType, User } from './types';
-import { generateTestCases, getClarificationQuestions } from './services/geminiService';
+import { generateTestCases, getClarificationQuestions, prefetchRetrieval } from './services/geminiService';
 import { sampleRequirements, sampleOpenAPISchema } from './data/sampleData';
 import CorpusManager from './components/addsource';
 
@@ -26,6 +26,8 @@ const App: React.FC = () => {
   const [isDownloadModalOpen, setIsDownloadModalOpen] = useState<boolean>(false);
   const [clarificationQuestions, setClarificationQuestions] = useState<string[]>([]);
   const [selectedTestCase, setSelectedTestCase] = useState<TestCase | null>(null);
+  // Retrieval started alongside the clarification questions, claimed when generation runs
+  const prefetchTicket = useRef<Promise<string | undefined>>();
 
   const handleFinalizeGeneration = useCallback(async (answers?: string[]) => {
     setIsClarificationModalOpen(false);
@@ -38,7 +40,9 @@ const App: React.FC = () => {
     }
 
     try {
-      const result = await generateTestCases(requirementsInput, openApiSchema, clarifications);
+      const ticket = await prefetchTicket.current;
+      prefetchTicket.current = undefined;
+      const result = await generateTestCases(requirementsInput, openApiSchema, clarifications, { ticket });
       setTestCases(result.testCases);
       setFeatureGaps(result.featureGaps);
     } catch (e) {
@@ -61,6 +65,7 @@ const App: React.FC = () => {
     setTestCases([]);
     setFeatureGaps([]);
 
+    prefetchTicket.current = prefetchRetrieval(requirementsInput);
     try {
       const questions = await getClarificationQuestions(requirementsInput, openApiSchema);
       if (questions && questions.length > 0) {
@@ -0,0 +1,96 @@
+"""
+Adaptive top_k for retrieval lanes.
+
+A fixed top_k pads narrow requirements with irrelevant chunks and truncates broad ones. With
+ADAPTIVE_TOPK on, each lane over-fetches (its max_k plus ADAPTIVE_LOOKAHEAD) and keeps only
+the chunks before the cutoff:
+
+  knee    the point where the score curve bends the most (Kneedle: the largest distance between
+          the normalized curve and the straight line from the best to the worst score), if the
+          bend is at least ADAPTIVE_KNEE_SENSITIVITY; a steady decline has no knee
+  margin  chunks scoring more than ADAPTIVE_SCORE_MARGIN worse than the best one (if set)
+
+whichever keeps fewer, clamped to the lane's [min_k, max_k]. With neither, the lane keeps its
+configured top_k: max_k only bounds how far a knee may reach, it is not a default. Absolute
+cut-offs are the lanes' `vector_distance_threshold`, applied by Vertex RAG before any of this.
+
+Vertex RAG scores are cosine distances (lower is better) unless RAG_SCORE_IS_DISTANCE=false.
+Each lane counts `adaptive.<lane>.queries`, `.fetched`, `.kept` and `.by_<method>` in metrics;
+/rag reports the chunks kept per lane in the X-Retrieval-Cutoff header.
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+CUTOFF_HEADER = "X-Retrieval-Cutoff"
+
+# --- ADAPTIVE TOP_K CONFIGURATION ---
+ADAPTIVE_TOPK = os.getenv("ADAPTIVE_TOPK", "true").lower() == "true"
+ADAPTIVE_MIN_CHUNKS = int(os.getenv("ADAPTIVE_MIN_CHUNKS", "3"))            # Default lane min_k
+ADAPTIVE_MAX_FACTOR = float(os.getenv("ADAPTIVE_MAX_FACTOR", "1.5"))        # Default lane max_k, times its top_k
+ADAPTIVE_LOOKAHEAD = int(os.getenv("ADAPTIVE_LOOKAHEAD", "5"))              # Fetched past max_k, to see a knee there
+ADAPTIVE_KNEE_SENSITIVITY = float(os.getenv("ADAPTIVE_KNEE_SENSITIVITY", "0.1"))
+ADAPTIVE_SCORE_MARGIN = float(os.getenv("ADAPTIVE_SCORE_MARGIN")) if os.getenv("ADAPTIVE_SCORE_MARGIN") else None
+RAG_SCORE_IS_DISTANCE = os.getenv("RAG_SCORE_IS_DISTANCE", "true").lower() == "true"
+
+
+def knee(relevance: List[float], sensitivity: float = ADAPTIVE_KNEE_SENSITIVITY) -> Optional[int]:
+    """How many of the ranked `relevance` values (higher is better) come before the knee, or None."""
+    n = len(relevance)
+    spread = relevance[0] - relevance[-1] if n else 0
+    if n < 3 or spread <= 1e-9:
+        return None
+    # Curve and chord both run from (0, 1) to (1, 0) once normalized
+    gaps = [(relevance[i] - relevance[-1]) / spread - (1 - i / (n - 1)) for i in range(n)]
+    i = max(range(n), key=lambda j: abs(gaps[j]))
+    if abs(gaps[i]) < sensitivity:
+        return None
+    # Below the chord the knee starts the tail; above it, it ends the plateau
+    return i if gaps[i] < 0 else i + 1
+
+
+def cutoff(scores: List[float], min_k: int, max_k: int, top_k: Optional[int] = None,
+           margin: Optional[float] = ADAPTIVE_SCORE_MARGIN, is_distance: bool = RAG_SCORE_IS_DISTANCE) -> Tuple[int, str]:
+    """
+    (chunks to keep, the rule that decided it) for ranked `scores`. Without a knee or margin cut
+    that is `top_k` (max_k if not given).
+    """
+    n = len(scores)
+    if n <= min_k:
+        return n, "all"
+    relevance = [-s for s in scores] if is_distance else list(scores)
+    k, method = n, "max"
+    knee_k = knee(relevance)
+    if knee_k is not None and knee_k < k:
+        k, method = knee_k, "knee"
+    if margin is not None:
+        margin_k = sum(1 for r in relevance if r >= relevance[0] - margin)
+        if margin_k < k:
+            k, method = margin_k, "margin"
+    if method == "max" and top_k is not None:
+        k, method = min(top_k, n), "top_k"
+    if k < min_k:
+        return min_k, "min"
+    if k > max_k:
+        return max_k, "max"
+    return k, method
+
+def apply(results: List[Dict], lane) -> List[Dict]:
+    """The leading `results` of one lane query that fall before the cutoff."""
+    k, method = cutoff([r.get("score") or 0.0 for r in results], lane.min_k, lane.max_k, lane.top_k)
+    metrics.incr(f"adaptive.{lane.name}.queries")
+    metrics.incr(f"adaptive.{lane.name}.fetched", len(results))
+    metrics.incr(f"adaptive.{lane.name}.kept", k)
+    metrics.incr(f"adaptive.{lane.name}.by_{method}")
+    print(f"Lane '{lane.name}': kept {k} of {len(results)} chunks ({method})")
+    return results[:k]
+
+
+def cutoff_header(results: List[Dict]) -> str:
+    """'regulations=4,source_code=2': the chunks kept per lane, for the X-Retrieval-Cutoff header."""
+    counts: Dict[str, int] = {}
+    for item in results:
+        lane = item.get("lane") or "unassigned"
+        counts[lane] = counts.get(lane, 0) + 1
+    return ",".join(f"{lane}={count}" for lane, count in counts.items())
@@ -0,0 +1,230 @@
+"""
+Admission control for calls to Gemini and Vertex RAG.
+
+Each upstream ("gemini", "rag") has a token bucket that paces calls below its quota, and two
+lanes with their own concurrency limit, queue depth and wait budget:
+
+  interactive  request threads (/rag): short queue, short wait, first claim on tokens
+  background   ingestion jobs: long queue, long wait, yields tokens while interactive calls wait
+
+A call whose lane queue is full, or that cannot be admitted within the lane's wait budget,
+raises AdmissionRejected instead of piling up; routes turn it into HTTP 429 with Retry-After.
+A call abandoned at its request deadline (deadline.call) gives its slot back right away rather
+than when the call finally returns.
+The lane is picked from the calling context: code running inside a job (see jobs.py) is
+background, everything else is interactive.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+import jobs
+import metrics
+from deadline import on_abandon
+
+INTERACTIVE, BACKGROUND = "interactive", "background"
+
+# --- ADMISSION CONFIGURATION ---
+UPSTREAM_LIMITS = {
+    # calls per second, burst
+    "gemini": (float(os.getenv("GEMINI_RATE_PER_SEC", "10")), int(os.getenv("GEMINI_BURST", "20"))),
+    "rag": (float(os.getenv("RAG_RATE_PER_SEC", "20")), int(os.getenv("RAG_BURST", "40"))),
+}
+LANE_LIMITS = {
+    # max concurrency, max queue depth, max seconds waiting for admission
+    INTERACTIVE: (int(os.getenv("INTERACTIVE_MAX_CONCURRENCY", "16")), int(os.getenv("INTERACTIVE_MAX_QUEUE", "32")),
+                  float(os.getenv("INTERACTIVE_MAX_WAIT", "10"))),
+    BACKGROUND: (int(os.getenv("BACKGROUND_MAX_CONCURRENCY", "4")), int(os.getenv("BACKGROUND_MAX_QUEUE", "256")),
+                 float(os.getenv("BACKGROUND_MAX_WAIT", "600"))),
+}
+POLL_SECONDS = 0.05
+
+
+class AdmissionRejected(Exception):
+    """The call was not admitted. `retry_after` is a hint in whole seconds."""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self) -> float:
+        """Takes a token if one is available and returns 0, else returns the seconds until one is."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def spend(self, amount: float):
+        """Takes `amount` tokens after the fact (e.g. LLM tokens a response reported); may overdraw the bucket."""
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+
+    def debt_seconds(self) -> float:
+        """0 while the bucket is not overdrawn, else the seconds until it refills to zero."""
+        with self._lock:
+            self._refill()
+            return max(0.0, -self._tokens / self.rate)
+
+    @property
+    def level(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class Lane:
+    def __init__(self, max_concurrency: int, max_queue: int, max_wait: float):
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+    def enter_queue(self) -> bool:
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                return False
+            self.waiting += 1
+            return True
+
+    def leave_queue(self):
+        with self._lock:
+            self.waiting -= 1
+
+
+def _releaser(lane: Lane):
+    """Releases one of the lane's slots, once, whichever of the call or its abandonment gets there first."""
+    lock = threading.Lock()
+    released = []
+
+    def release():
+        with lock:
+            if released:
+                return
+            released.append(True)
+        lane.slots.release()
+    return release
+
+
+class Upstream:
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.lanes = {lane: Lane(*LANE_LIMITS[lane]) for lane in (INTERACTIVE, BACKGROUND)}
+
+    def _retry_after(self, lane: Lane) -> int:
+        return max(1, math.ceil(lane.waiting / self.bucket.rate))
+
+    def _try_admit(self, lane_name: str) -> float:
+        """0 once a slot and a token are held, else how long to wait before trying again."""
+        lane = self.lanes[lane_name]
+        if not lane.slots.acquire(blocking=False):
+            return POLL_SECONDS
+        if lane_name == BACKGROUND and self.lanes[INTERACTIVE].waiting:
+            lane.slots.release()
+            return POLL_SECONDS
+        wait = self.bucket.try_take()
+        if wait:
+            lane.slots.release()
+        return wait
+
+    def _enter(self, lane_name: str) -> Lane:
+        lane = self.lanes[lane_name]
+        if not lane.enter_queue():
+            metrics.incr(f"admission.{self.name}.{lane_name}.rejected")
+            raise AdmissionRejected(f"{self.name} {lane_name} queue is full", self._retry_after(lane))
+        return lane
+
+    def _timed_out(self, lane_name: str, lane: Lane):
+        metrics.incr(f"admission.{self.name}.{lane_name}.rejected")
+        return AdmissionRejected(f"{self.name} {lane_name} call not admitted within {lane.max_wait:g}s",
+                                 self._retry_after(lane))
+
+    @contextmanager
+    def slot(self, lane_name: Optional[str] = None):
+        lane_name = lane_name or current_lane()
+        lane = self._enter(lane_name)
+        try:
+            deadline = time.monotonic() + lane.max_wait
+            while True:
+                wait = self._try_admit(lane_name)
+                if not wait:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._timed_out(lane_name, lane)
+                # Jobs waiting here still notice cancellation
+                if jobs.current_token().wait(min(wait, remaining)):
+                    jobs.check_cancelled()
+        finally:
+            lane.leave_queue()
+        metrics.incr(f"admission.{self.name}.{lane_name}.admitted")
+        release = _releaser(lane)
+        forget = on_abandon(release)
+        try:
+            yield
+        finally:
+            forget()
+            release()
+
+    @asynccontextmanager
+    async def slot_async(self, lane_name: str = INTERACTIVE):
+        lane = self._enter(lane_name)
+        try:
+            deadline = time.monotonic() + lane.max_wait
+            while True:
+                wait = self._try_admit(lane_name)
+                if not wait:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._timed_out(lane_name, lane)
+                await asyncio.sleep(min(wait, remaining))
+        finally:
+            lane.leave_queue()
+        metrics.incr(f"admission.{self.name}.{lane_name}.admitted")
+        try:
+            yield
+        finally:
+            lane.slots.release()
+
+
+upstreams: Dict[str, Upstream] = {name: Upstream(name, *limits) for name, limits in UPSTREAM_LIMITS.items()}
+gemini = upstreams["gemini"]
+rag = upstreams["rag"]
+
+
+def current_lane() -> str:
+    return BACKGROUND if jobs.in_job() else INTERACTIVE
+
+
+def admitted(upstream: Upstream, fn, *args, **kwargs):
+    """fn(*args, **kwargs) once `upstream` admits it in the caller's lane."""
+    with upstream.slot():
+        return fn(*args, **kwargs)
+
+
+def snapshot() -> Dict:
+    return {name: {lane_name: {"waiting": lane.waiting} for lane_name, lane in u.lanes.items()}
+            for name, u in upstreams.items()}
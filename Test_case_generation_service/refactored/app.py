@@ -1,6 +1,6 @@
 # import urllib.parse
 import hashlib
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 import threading
 from google.cloud import firestore 
 import corpus_operations as co # Import the refactored logic
@@ -8,11 +8,79 @@ from corpus_operations import FIRESTORE_COLLECTION, db # Import necessary consta
 from flask_cors import CORS
 import os
 import json
+import time
 import requests
 from jira_ops import create_jira_issue_logic
+import adaptive
+import admission
+import deadline
+import hedging
+import jobs
+import lanes
+import leases
+import metrics
+import payloads
+import prefetch_ops
+import progress
+from admission import AdmissionRejected
+import recovery_ops
+import resilience
+import refresh_ops
+import source_code_ops
+import tenants
+import testcase_ops
 
 app = Flask(__name__)
-CORS(app) # This line enables CORS for your entire application# --- API ROUTES ---
+CORS(app, expose_headers=[deadline.DEGRADED_HEADER, adaptive.CUTOFF_HEADER, "Retry-After"]) # This line enables CORS for your entire application# --- API ROUTES ---
+refresh_ops.start_refresh_scheduler()
+recovery_ops.start_stale_job_adoption()
+
+@app.before_request
+def enter_tenant():
+    """Every request runs as the tenant its API key (or trusted X-Tenant header) names; see tenants.py."""
+    if request.method != 'OPTIONS':
+        g.tenant_token = tenants.enter(tenants.resolve(request.headers))
+
+@app.teardown_request
+def leave_tenant(exc=None):
+    token = g.pop('tenant_token', None)
+    if token is not None:
+        tenants.leave(token)
+
+@app.errorhandler(tenants.UnknownTenant)
+def handle_unknown_tenant(e):
+    return jsonify({"message": str(e)}), 401
+
+def visible(doc) -> bool:
+    """The corpus document exists and belongs to the request's tenant or is shared."""
+    return doc.exists and tenants.current().sees(doc.to_dict())
+
+def shared_corpus_response(name):
+    return jsonify({"message": f"Corpus '{name}' is shared; only the default tenant can change it."}), 403
+
+@app.errorhandler(AdmissionRejected)
+def handle_admission_rejected(e):
+    """Gemini / Vertex RAG budgets are exhausted: shed the request instead of queueing it in a worker thread."""
+    response = jsonify({"message": f"Service is busy ({e}). Retry later.", "retry_after": e.retry_after})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 429
+
+def parse_chunking(data):
+    """
+    Reads optional 'chunk_size' / 'chunk_overlap' from a request body.
+    Returns (chunking dict or None when neither is given, error message or None).
+    """
+    if data.get('chunk_size') is None and data.get('chunk_overlap') is None:
+        return None, None
+    try:
+        chunking = co.chunking_for({"chunking": {
+            k: data[k] for k in ('chunk_size', 'chunk_overlap') if data.get(k) is not None
+        }})
+    except (TypeError, ValueError):
+        return None, "'chunk_size' and 'chunk_overlap' must be integers."
+    if chunking['chunk_size'] <= 0 or not 0 <= chunking['chunk_overlap'] < chunking['chunk_size']:
+        return None, "'chunk_size' must be positive and 'chunk_overlap' between 0 and 'chunk_size'."
+    return chunking, None
 
 @app.route('/create-jira-issues', methods=['POST'])
 def handle_create_issues():
@@ -40,12 +108,131 @@ def handle_create_issues():
 
 @app.route('/rag', methods=['POST'])
 def invoke_rag():
+    """
+    Retrieves regulation chunks for a requirement. An optional 'timeout_ms' (or X-Timeout-Ms header)
+    bounds the whole call; stages that run out of time are listed in the X-Degraded header.
+    With "compact": true, returns ids, scores and snippets instead of full chunks (see payloads.py);
+    with "group_by_lane": true, {"lanes": {lane: results}} instead of one list (see lanes.py).
+    """
+    data = request.get_json()
+    reqs = data.get('requirement')
+    if not reqs:
+        return jsonify({"message": "Missing 'requirement'"}), 400
+    with tenants.current().request_slot(), deadline.scope(deadline.parse_timeout_ms(request.headers, data)):
+        retrieved_docs, degraded = co.retrieve_regulations(reqs)
+    body = rag_body(retrieved_docs, data)
+    headers = {adaptive.CUTOFF_HEADER: adaptive.cutoff_header(retrieved_docs)}
+    if degraded:
+        headers[deadline.DEGRADED_HEADER] = ",".join(degraded)
+    return encoded_json(body, headers=headers)
+
+def rag_body(results, data):
+    """The /rag response for `results` in the form the request body asked for."""
+    if data.get('group_by_lane'):
+        grouped = lanes.group(results)
+        if data.get('compact'):
+            return {"lanes": {name: payloads.compact_results(items) for name, items in grouped.items()}}
+        return {"lanes": grouped}
+    return payloads.compact_results(results) if data.get('compact') else results
+
+@app.route('/chunks', methods=['GET'])
+def get_chunks():
+    """Full chunks for the ids of a compact /rag response: GET /chunks?ids=a,b,c"""
+    ids, error = payloads.parse_ids(request.args.get('ids'))
+    if error:
+        return jsonify({"message": error}), 400
+    return encoded_json(payloads.fetch_chunks(ids))
+
+def encoded_json(obj, status=200, headers=None):
+    """A JSON response serialized with orjson and compressed as the client accepts (see payloads.py)."""
+    body, encoding_headers = payloads.encode(obj, request.headers.get('Accept-Encoding', ''))
+    return Response(body, status=status, headers={**encoding_headers, **(headers or {})})
+
+NDJSON_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@app.route('/rag/stream', methods=['POST'])
+def stream_rag():
+    """
+    /rag as newline-delimited JSON events: raw-query chunks first, then each sub-query's chunks,
+    then the fused ranking, then "done" with the degraded stages (see README.md for the schema).
+    """
     data = request.get_json()
     reqs = data.get('requirement')
     if not reqs:
         return jsonify({"message": "Missing 'requirement'"}), 400
-    retrieved_docs = co.retrieve_regulations(reqs)
-    return jsonify(retrieved_docs), 200
+    seconds = deadline.parse_timeout_ms(request.headers, data)
+    tenant = tenants.current()
+    tenant.check_budget()
+    # Admitted before the response starts, so a tenant over its limit gets 429, not a cut-off stream
+    started = tenant.admit()
+
+    def generate():
+        # Runs after the request context is gone, so the tenant is entered again here
+        try:
+            with tenants.scope(tenant), deadline.scope(seconds):
+                for event in co.stream_regulations(reqs):
+                    yield json.dumps(event) + "\n"
+        finally:
+            tenant.release(started)
+
+    return Response(generate(), mimetype='application/x-ndjson', headers=NDJSON_HEADERS)
+
+@app.route('/rag/prefetch', methods=['POST'])
+def prefetch_rag():
+    """
+    Starts retrieval for a requirement in the background (e.g. while the user answers the
+    clarification questions) and returns a ticket for /generate-test-cases to claim.
+    """
+    data = request.get_json()
+    reqs = data.get('requirement')
+    if not reqs:
+        return jsonify({"message": "Missing 'requirement'"}), 400
+    return jsonify(prefetch_ops.start(reqs)), 202
+
+@app.route('/rag/prefetch/<ticket>', methods=['GET'])
+def prefetch_status(ticket):
+    status = prefetch_ops.status(ticket)
+    if status is None:
+        return jsonify({"message": "Unknown or expired ticket."}), 404
+    return jsonify(status), 200
+
+@app.route('/generate-test-cases', methods=['POST'])
+def generate_test_cases():
+    """
+    Retrieval plus structured test case generation in one call. Retrieval goes through the same
+    coalescing, caches and deadline ('timeout_ms') as /rag, or claims a /rag/prefetch 'ticket';
+    the test cases are then streamed as NDJSON while Gemini produces them (see testcase_ops.py).
+    Body: {"requirements", "open_api_schema"?, "clarifications"?, "ticket"?, "timeout_ms"?}
+    """
+    data = request.get_json()
+    requirements = data.get('requirements')
+    if not requirements:
+        return jsonify({"message": "Missing 'requirements'"}), 400
+    tenant = tenants.current()
+    tenant.check_budget()
+    # One request slot of the tenant is held from retrieval until the stream ends
+    started = tenant.admit()
+    try:
+        with deadline.scope(deadline.parse_timeout_ms(request.headers, data)):
+            if data.get('ticket'):
+                retrieved, degraded = prefetch_ops.claim(data['ticket'], requirements, data.get('clarifications'))
+            else:
+                retrieved, degraded = co.retrieve_regulations(requirements)
+    except BaseException:
+        tenant.release(started)
+        raise
+
+    def generate():
+        try:
+            with tenants.scope(tenant):
+                for event in testcase_ops.generate_test_cases_stream(requirements, retrieved, degraded,
+                                                                     data.get('open_api_schema'),
+                                                                     data.get('clarifications')):
+                    yield json.dumps(event) + "\n"
+        finally:
+            tenant.release(started)
+
+    return Response(generate(), mimetype='application/x-ndjson', headers=NDJSON_HEADERS)
 
 @app.route('/source-code', methods=['POST'])
 def create_source_code_embeddings():
@@ -55,21 +242,23 @@ def create_source_code_embeddings():
     """
     data = request.get_json()
     link = data.get('link')
+    branch = data.get('branch')              # Optional, defaults to the remote HEAD
+    sparse_paths = data.get('sparse_paths')  # Optional list of directories to check out
 
     if  not link:
         return jsonify({"message": "Missing 'link' in request."}), 400
+    if sparse_paths is not None and not (isinstance(sparse_paths, list) and all(isinstance(p, str) for p in sparse_paths)):
+        return jsonify({"message": "'sparse_paths' must be a list of paths."}), 400
 
-    doc_id = hashlib.sha256(link.encode('utf-8')).hexdigest()
+    doc_id = source_code_ops.source_doc_id(link)
     doc_ref = db.collection(FIRESTORE_COLLECTION).document(doc_id)
 
-    if doc_ref.get().exists:
-        return jsonify({"message": f"Corpus '{link}' already exists. Use PUT to update."}), 409
-
     # 1. Initial synchronous DB entry
     initial_data = {
         "name": link.split('/')[-1],
         "link": link,
         "type": 'source code', # Will be determined asynchronously
+        "tenant": tenants.current().tag,
         "pdf_links": [], 
         "rag_file_ids": [],
         "embeddings_available": False,
@@ -79,7 +268,10 @@ def create_source_code_embeddings():
         "created_at": firestore.SERVER_TIMESTAMP,
         "updated_at": firestore.SERVER_TIMESTAMP
     }
-    doc_ref.set(initial_data)
+    # Created already leased, so two instances cannot both start this job
+    lease = leases.create(doc_ref, initial_data)
+    if lease is None:
+        return jsonify({"message": f"Corpus '{link}' already exists. Use PUT to update."}), 409
     response_data = initial_data.copy() 
 
 #    Replace the Sentinel objects with a JSON-serializable placeholder (e.g., a string)
@@ -87,16 +279,14 @@ def create_source_code_embeddings():
     del response_data["updated_at"]
 
     # 2. Start the long-running task in a new thread
-    thread = threading.Thread(
-        target=co.create_source_code_embdeeings, 
-        args=(link,)
-    )
-    thread.start()
+    jobs.start_job(doc_id, "create source code", leases.run, lease,
+                   source_code_ops.create_source_code_embeddings, link, branch, sparse_paths)
 
     # 3. Return immediate response
     return jsonify({
         "message": "Corpus creation started in background.",
         "corpus_name": link,
+        "job_id": doc_id,
         "initial_status": response_data
     }), 202
 
@@ -114,25 +304,31 @@ def create_corpus():
     if not corpus_name or not link:
         return jsonify({"message": "Missing 'corpus_name' or 'link' in request."}), 400
 
+    chunking, error = parse_chunking(data)
+    if error:
+        return jsonify({"message": error}), 400
+
     doc_ref = db.collection(FIRESTORE_COLLECTION).document(corpus_name)
-    if doc_ref.get().exists:
-        return jsonify({"message": f"Corpus '{corpus_name}' already exists. Use PUT to update."}), 409
 
     # 1. Initial synchronous DB entry
     initial_data = {
         "name": corpus_name,
         "link": link,
         "type": None, # Will be determined asynchronously
+        "tenant": tenants.current().tag,
         "pdf_links": [], 
         "rag_file_ids": [],
         "embeddings_available": False,
         "processing": True,
         "gcs_uris": [],
         "md5_checksums": [],
+        "chunking": chunking or co.chunking_for(None),
         "created_at": firestore.SERVER_TIMESTAMP,
         "updated_at": firestore.SERVER_TIMESTAMP
     }
-    doc_ref.set(initial_data)
+    lease = leases.create(doc_ref, initial_data)
+    if lease is None:
+        return jsonify({"message": f"Corpus '{corpus_name}' already exists. Use PUT to update."}), 409
     response_data = initial_data.copy() 
 
 #    Replace the Sentinel objects with a JSON-serializable placeholder (e.g., a string)
@@ -140,16 +336,13 @@ def create_corpus():
     del response_data["updated_at"]
 
     # 2. Start the long-running task in a new thread
-    thread = threading.Thread(
-        target=co.create_corpus_async_task, 
-        args=(corpus_name, link)
-    )
-    thread.start()
+    jobs.start_job(corpus_name, "create corpus", leases.run, lease, co.create_corpus_async_task, corpus_name, link)
 
     # 3. Return immediate response
     return jsonify({
         "message": "Corpus creation started in background.",
         "corpus_name": corpus_name,
+        "job_id": corpus_name,
         "status_check_url": f"/corpus/{corpus_name}",
         "initial_status": response_data
     }), 202
@@ -159,38 +352,43 @@ def create_corpus():
 def update_corpus(corpus_name):
     """
     Endpoint to update an existing RAG corpus.
-    Immediate 202 response, then background processing.
+    An optional 'chunk_size' / 'chunk_overlap' in the body changes the corpus chunk settings
+    and forces a re-ingest. Immediate 202 response, then background processing.
     """
+    chunking, error = parse_chunking(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({"message": error}), 400
+
     doc_ref = db.collection(FIRESTORE_COLLECTION).document(corpus_name)
     doc = doc_ref.get()
 
-    if not doc.exists:
+    if not visible(doc):
         return jsonify({"message": f"Corpus '{corpus_name}' not found."}), 404
         
     current_data = doc.to_dict()
+    if not tenants.current().owns(current_data):
+        return shared_corpus_response(corpus_name)
     link = current_data.get('link') # Use the existing link for re-scrape/update check
 
-    if current_data.get('processing'):
-        return jsonify({"message": f"Corpus '{corpus_name}' is already being processed."}), 409
-
-    # 1. Update status synchronously
-    doc_ref.update({
-        "processing": True,
+    # 1. Update status synchronously, claiming the corpus in the same transaction
+    status_update = {
         "embeddings_available": False,
         "updated_at": firestore.SERVER_TIMESTAMP
-    })
+    }
+    if chunking:
+        status_update["chunking"] = chunking
+    lease = leases.acquire(doc_ref, status_update)
+    if lease is None:
+        return jsonify({"message": f"Corpus '{corpus_name}' is already being processed."}), 409
 
     # 2. Start the long-running task in a new thread
-    thread = threading.Thread(
-        target=co.update_corpus_async_task, 
-        args=(corpus_name, link)
-    )
-    thread.start()
+    jobs.start_job(corpus_name, "update corpus", leases.run, lease, co.update_corpus_async_task, corpus_name, link)
 
     # 3. Return immediate response
     return jsonify({
         "message": "Corpus update started in background. Check back later for final status.",
         "corpus_name": corpus_name,
+        "job_id": corpus_name,
         "status_check_url": f"/corpus/{corpus_name}",
         "updated_status": doc_ref.get().to_dict() # Return the 'processing: true' state
     }), 202
@@ -203,8 +401,11 @@ def delete_corpus_api(corpus_name):
     This operation is performed synchronously as it's generally fast enough.
     """
     doc_ref = db.collection(FIRESTORE_COLLECTION).document(corpus_name)
-    if not doc_ref.get().exists:
+    doc = doc_ref.get()
+    if not visible(doc):
         return jsonify({"message": f"Corpus '{corpus_name}' not found."}), 404
+    if not tenants.current().owns(doc.to_dict()):
+        return shared_corpus_response(corpus_name)
 
     # The deletion task is synchronous but handles multiple resource types
     success = co.delete_corpus_sync_task(corpus_name)
@@ -218,6 +419,39 @@ def delete_corpus_api(corpus_name):
             "message": f"Error deleting corpus '{corpus_name}'. Check server logs for details."
         }), 500
 
+@app.route('/source-code', methods=['PUT'])
+def update_source_code_embeddings():
+    """
+    Endpoint to refresh a source code corpus from the commits pushed since the last ingest.
+    Only shards touched by the git diff are re-uploaded. Immediate 202 response, then background processing.
+    """
+    data = request.get_json(silent=True) or {}
+    link = data.get('link')
+    if not link:
+        return jsonify({"message": "Missing 'link' in request."}), 400
+
+    doc_ref = db.collection(FIRESTORE_COLLECTION).document(source_code_ops.source_doc_id(link))
+    doc = doc_ref.get()
+    if not visible(doc):
+        return jsonify({"message": f"Source code '{link}' not found."}), 404
+
+    current_data = doc.to_dict()
+    if not tenants.current().owns(current_data):
+        return shared_corpus_response(link)
+    lease = leases.acquire(doc_ref, {"updated_at": firestore.SERVER_TIMESTAMP})
+    if lease is None:
+        return jsonify({"message": f"Source code '{link}' is already being processed."}), 409
+
+    jobs.start_job(doc_ref.id, "update source code", leases.run, lease,
+                   source_code_ops.update_source_code_embeddings, link)
+
+    return jsonify({
+        "message": "Source code update started in background.",
+        "link": link,
+        "job_id": doc_ref.id,
+        "from_commit": current_data.get('commit_sha')
+    }), 202
+
 @app.route('/source-code', methods=['DELETE'])
 def delete_source_code_corpus_api():
     """
@@ -230,12 +464,16 @@ def delete_source_code_corpus_api():
     # doc_id = urllib.parse.quote(link)
     doc_id = hashlib.sha256(link.encode('utf-8')).hexdigest()
     doc_ref = db.collection(FIRESTORE_COLLECTION).document(doc_id)
+    doc = doc_ref.get()
 
-    if not doc_ref.get().exists:
+    if not visible(doc):
         return jsonify({"message": f"Source code '{link}' not found."}), 404
+    if not tenants.current().owns(doc.to_dict()):
+        return shared_corpus_response(link)
 
     # The deletion task is synchronous but handles multiple resource types
     success = co.delete_source_code_embeddings(link)
+    source_code_ops.drop_symbol_index(link)
 
     if success:
         return jsonify({
@@ -247,6 +485,75 @@ def delete_source_code_corpus_api():
         }), 500
 
 
+@app.route('/source-code/symbols', methods=['GET'])
+def lookup_source_symbol():
+    """
+    Looks up where a symbol is defined in an ingested repository, from the local symbol index.
+    Query params: link, symbol. Returns [{path, symbol, start_line, end_line, shard, location}].
+    """
+    link = request.args.get('link')
+    symbol = request.args.get('symbol')
+    if not link or not symbol:
+        return jsonify({"error": "Missing 'link' or 'symbol' query parameter"}), 400
+    if not visible(db.collection(FIRESTORE_COLLECTION).document(source_code_ops.source_doc_id(link)).get()):
+        return jsonify({"message": f"Source code '{link}' not found."}), 404
+
+    index = source_code_ops.load_symbol_index(link)
+    if index is None:
+        return jsonify({"message": f"No symbol index for source code '{link}'."}), 404
+
+    return jsonify({"link": link, "symbol": symbol, "matches": index.lookup(symbol)}), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    In-process counters, e.g. how many /rag calls were coalesced into identical in-flight ones.
+    Only the admin tenant gets them all; other tenants get their own tenant block.
+    """
+    tenant = tenants.current()
+    if not tenant.is_admin:
+        return jsonify({"tenants": {tenant.name: tenant.snapshot()}}), 200
+    return jsonify({**metrics.snapshot(), "admission": admission.snapshot(), "hedging": hedging.snapshot(),
+                    "breakers": resilience.snapshot(), "tenants": tenants.snapshot()}), 200
+
+
+@app.route('/jobs', methods=['GET'])
+def list_running_jobs():
+    """Lists the background jobs running in this process on the request's tenant's corpora."""
+    tenant, running = tenants.current(), jobs.list_jobs()
+    if not running:
+        return jsonify([]), 200
+    docs = db.get_all([db.collection(FIRESTORE_COLLECTION).document(job["job_id"]) for job in running])
+    owned = {doc.id for doc in docs if tenant.owns(doc.to_dict() if doc.exists else None)}
+    return jsonify([job for job in running if job["job_id"] in owned]), 200
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """
+    Requests cancellation of a running job (job ids are corpus names, or the source-code document id).
+    The job stops at its next check, deletes its partial uploads and marks the corpus cancelled.
+    A job running on another instance is cancelled through its lease, at that instance's next heartbeat.
+    """
+    doc_ref = db.collection(FIRESTORE_COLLECTION).document(job_id)
+    doc = doc_ref.get()
+    if not tenants.current().owns(doc.to_dict() if doc.exists else None):
+        return jsonify({"message": f"No running job '{job_id}'."}), 404
+    if not jobs.cancel(job_id) and not leases.request_cancel(doc_ref):
+        return jsonify({"message": f"No running job '{job_id}'."}), 404
+    return jsonify({
+        "message": "Cancellation requested. The job stops at its next checkpoint.",
+        "job_id": job_id,
+        "status_check_url": f"/corpus/{job_id}"
+    }), 202
+
+
+@app.route('/corpus/<corpus_name>/cancel', methods=['POST'])
+def cancel_corpus_job(corpus_name):
+    return cancel_job(corpus_name)
+
+
 @app.route('/corpus/<corpus_name>', methods=['GET'])
 def get_corpus_status(corpus_name):
     """
@@ -255,19 +562,67 @@ def get_corpus_status(corpus_name):
     doc_ref = db.collection(FIRESTORE_COLLECTION).document(corpus_name)
     doc = doc_ref.get()
 
-    if not doc.exists:
+    if not visible(doc):
         return jsonify({"message": f"Corpus '{corpus_name}' not found."}), 404
     
     return jsonify(doc.to_dict()), 200
 
 
+@app.route('/corpus/<corpus_name>/events', methods=['GET'])
+def corpus_events(corpus_name):
+    """
+    Server-Sent Events with the progress of the corpus's ingestion job (see progress.py):
+    stage, links found, files downloaded/uploaded, bytes and ETA, pushed as they change.
+    A job not running in this instance gets the state last recorded in Firestore, once.
+    """
+    doc = db.collection(FIRESTORE_COLLECTION).document(corpus_name).get()
+    if not visible(doc):
+        return jsonify({"message": f"Corpus '{corpus_name}' not found."}), 404
+    if progress.channel(corpus_name) is None:
+        state = progress.stored_state(doc.to_dict(), corpus_name)
+        return Response(progress.format_sse(state, retry_ms=progress.SSE_REMOTE_RETRY_MS),
+                        mimetype='text/event-stream', headers=progress.SSE_HEADERS)
+
+    # Each open stream holds a worker thread; the ASGI mode serves this route on the event loop
+    if not progress.open_stream():
+        return jsonify({"message": "Too many open progress streams; retry shortly.",
+                        "retry_after": progress.SSE_REMOTE_RETRY_MS // 1000}), 503, \
+            {"Retry-After": str(progress.SSE_REMOTE_RETRY_MS // 1000)}
+
+    def stream():
+        started = time.monotonic()
+        for state in progress.subscribe(corpus_name, progress.SSE_HEARTBEAT_SECONDS):
+            yield progress.format_sse(state)
+            if time.monotonic() - started > progress.SSE_MAX_SECONDS:
+                break
+
+    response = Response(stream(), mimetype='text/event-stream', headers=progress.SSE_HEADERS)
+    response.call_on_close(progress.close_stream)  # Also on client disconnect
+    return response
+
+
+@app.route('/refresh', methods=['POST'])
+def refresh_corpuses():
+    """
+    Endpoint for Cloud Scheduler / cron to trigger one refresh pass over all corpora.
+    Change checks and any resulting updates run in the background. Admin tenant only.
+    """
+    if not tenants.current().is_admin:
+        return jsonify({"message": "Only the admin tenant can start a refresh pass."}), 403
+    thread = threading.Thread(target=refresh_ops.run_refresh_pass)
+    thread.start()
+    return jsonify({"message": "Corpus refresh pass started in background."}), 202
+
+
 @app.route('/corpus', methods=['GET'])
 def list_corpuses():
     """
-    Endpoint to list all corpuses in Firestore.
+    Endpoint to list the corpuses in Firestore that the request's tenant can see.
     """
+    tenant = tenants.current()
     try:
-        corpuses = [doc.to_dict() for doc in db.collection(FIRESTORE_COLLECTION).stream()]
+        corpuses = [data for data in (doc.to_dict() for doc in db.collection(FIRESTORE_COLLECTION).stream())
+                    if tenant.sees(data)]
         return jsonify(corpuses), 200
     except Exception as e:
         return jsonify({"message": f"Error listing corpuses: {e}"}), 500
@@ -0,0 +1,146 @@
+"""
+ASGI serving mode.
+
+/rag (and /rag/stream) is served by an async handler: the enhancement awaits the async genai
+client and the retrieval the async Vertex RAG client, both reusing one connection pool per
+process, so an instance holds hundreds of in-flight /rag requests on a single event loop
+instead of one thread each. The ingestion progress streams (GET /corpus/<name>/events) are
+native too, so an open stream does not hold a thread. Every other route is the Flask app from
+app.py, mounted through a WSGI bridge with its own thread pool, so blocking ingestion/admin
+work never runs on the event loop. The native routes resolve the tenant (tenants.py) themselves;
+the Flask app does it for the rest.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 8080
+"""
+import asyncio
+import json
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route, request_response
+
+import adaptive
+import corpus_operations as co
+import deadline
+import payloads
+import progress
+import tenants
+from admission import AdmissionRejected
+from app import NDJSON_HEADERS, app as flask_app, rag_body
+from corpus_operations import FIRESTORE_COLLECTION, db
+
+# --- ASGI CONFIGURATION ---
+WSGI_WORKERS = int(os.getenv("WSGI_WORKERS", "8"))                  # Threads for the Flask routes
+RAG_MAX_CONCURRENCY = int(os.getenv("RAG_MAX_CONCURRENCY", "512"))  # /rag requests in flight; the rest wait their turn
+
+_rag_slots = asyncio.Semaphore(RAG_MAX_CONCURRENCY)
+
+
+async def invoke_rag(request: Request) -> Response:
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    reqs = data.get('requirement')
+    if not reqs:
+        return JSONResponse({"message": "Missing 'requirement'"}, status_code=400)
+    try:
+        tenant = tenants.resolve(request.headers)
+    except tenants.UnknownTenant as e:
+        return JSONResponse({"message": str(e)}, status_code=401)
+    try:
+        with tenants.scope(tenant), deadline.scope(deadline.parse_timeout_ms(request.headers, data)):
+            async with tenant.request_slot_async(), _rag_slots:
+                retrieved_docs, degraded = await co.retrieve_regulations_async(reqs)
+    except AdmissionRejected as e:
+        # Answered here rather than by an exception handler so the response still gets CORS headers
+        return busy_response(e)
+    body = rag_body(retrieved_docs, data)
+    content, headers = payloads.encode(body, request.headers.get('accept-encoding', ''))
+    headers[adaptive.CUTOFF_HEADER] = adaptive.cutoff_header(retrieved_docs)
+    if degraded:
+        headers[deadline.DEGRADED_HEADER] = ",".join(degraded)
+    return Response(content, headers=headers)
+
+
+async def stream_rag(request: Request) -> Response:
+    """POST /rag/stream (see app.stream_rag) on the event loop."""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    reqs = data.get('requirement')
+    if not reqs:
+        return JSONResponse({"message": "Missing 'requirement'"}, status_code=400)
+    try:
+        tenant = tenants.resolve(request.headers)
+    except tenants.UnknownTenant as e:
+        return JSONResponse({"message": str(e)}, status_code=401)
+    seconds = deadline.parse_timeout_ms(request.headers, data)
+    try:
+        tenant.check_budget()
+        # Admitted before the response starts, so a tenant over its limit gets 429, not a cut-off stream
+        started = await tenant.admit_async()
+    except AdmissionRejected as e:
+        return busy_response(e)
+
+    async def generate():
+        try:
+            with tenants.scope(tenant), deadline.scope(seconds):
+                async with _rag_slots:
+                    async for event in co.stream_regulations_async(reqs):
+                        yield json.dumps(event) + "\n"
+        finally:
+            tenant.release(started)
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson', headers=NDJSON_HEADERS)
+
+
+async def corpus_events(request: Request) -> Response:
+    """GET /corpus/<name>/events (see app.corpus_events), streamed from the event loop."""
+    corpus_name = request.path_params['corpus_name']
+    try:
+        tenant = tenants.resolve(request.headers)
+    except tenants.UnknownTenant as e:
+        return JSONResponse({"message": str(e)}, status_code=401)
+    doc = await run_in_threadpool(db.collection(FIRESTORE_COLLECTION).document(corpus_name).get)
+    if not doc.exists or not tenant.sees(doc.to_dict()):
+        return JSONResponse({"message": f"Corpus '{corpus_name}' not found."}, status_code=404)
+    if progress.channel(corpus_name) is None:
+        state = progress.stored_state(doc.to_dict(), corpus_name)
+        return Response(progress.format_sse(state, retry_ms=progress.SSE_REMOTE_RETRY_MS),
+                        media_type='text/event-stream', headers=progress.SSE_HEADERS)
+
+    async def stream():
+        started = time.monotonic()
+        async for state in progress.subscribe_async(corpus_name, progress.SSE_HEARTBEAT_SECONDS):
+            yield progress.format_sse(state)
+            if time.monotonic() - started > progress.SSE_MAX_SECONDS:
+                break
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers=progress.SSE_HEADERS)
+
+
+def busy_response(e: AdmissionRejected) -> JSONResponse:
+    return JSONResponse({"message": f"Service is busy ({e}). Retry later.", "retry_after": e.retry_after},
+                        status_code=429, headers={"Retry-After": str(e.retry_after)})
+
+
+def _with_cors(endpoint):
+    # The mounted Flask app sets its own CORS headers; only the native routes need them here
+    return CORSMiddleware(request_response(endpoint), allow_origins=["*"], allow_methods=["*"], allow_headers=["*"],
+                          expose_headers=[deadline.DEGRADED_HEADER, adaptive.CUTOFF_HEADER, "Retry-After"])
+
+
+app = Starlette(routes=[
+    Route('/rag', _with_cors(invoke_rag), methods=['POST', 'OPTIONS']),
+    Route('/rag/stream', _with_cors(stream_rag), methods=['POST', 'OPTIONS']),
+    Route('/corpus/{corpus_name}/events', _with_cors(corpus_events), methods=['GET', 'OPTIONS']),
+    Mount('/', app=WSGIMiddleware(flask_app, workers=WSGI_WORKERS)),
+])
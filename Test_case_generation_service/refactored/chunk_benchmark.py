@@ -0,0 +1,184 @@
+"""
+Chunking configuration benchmark.
+
+Re-chunks a local document set under a grid of chunk sizes and overlaps, indexes each variant
+in a local BM25 index and scores it against labelled requirement -> expected-section pairs.
+
+Documents are the .txt files written by pdf_preprocess (PDFs in the folder are pre-chunked
+first), so every section heading carries its page range. Labels are JSON lines:
+    {"requirement": "Patients can ask for their records to be deleted", "document": "gdpr", "section": "Article 17"}
+`document` is the file name without extension and is optional. A retrieved chunk counts as a
+hit when it overlaps a section whose heading starts with `section`.
+
+Each configuration also reports the mean /rag response size for its deepest-k results, full and
+compact (payloads.py), before and after compression, since chunk size drives payload size too.
+
+    python chunk_benchmark.py --docs ./regulations --labels labels.jsonl --sizes 256,512,1024 --overlaps 0,100,200
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import statistics
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import payloads
+import pdf_preprocess
+from local_index import BM25Index
+
+SECTION_LINE = re.compile(r'^## (.+?) \((?:page|pages) [\d-]+\)$', re.MULTILINE)
+WORD = re.compile(r'\S+')
+
+
+def load_documents(docs_dir: str) -> Dict[str, str]:
+    """Returns {document name: text}, pre-chunking any PDFs into a temporary folder first."""
+    documents = {}
+    pdf_paths = glob.glob(os.path.join(docs_dir, "*.pdf"))
+    if pdf_paths:
+        out_dir = tempfile.mkdtemp(prefix="chunk-bench-")
+        for report in pdf_preprocess.preprocess_pdfs(pdf_paths, out_dir):
+            if report["text_path"]:
+                with open(report["text_path"], encoding='utf-8') as f:
+                    documents[os.path.splitext(os.path.basename(report["source"]))[0]] = f.read()
+    for path in glob.glob(os.path.join(docs_dir, "*.txt")):
+        with open(path, encoding='utf-8') as f:
+            documents[os.path.splitext(os.path.basename(path))[0]] = f.read()
+    return documents
+
+
+def section_spans(text: str) -> List[Tuple[str, int, int]]:
+    """(title, start offset, end offset) for each '## title (pages a-b)' section."""
+    matches = list(SECTION_LINE.finditer(text))
+    spans = []
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        spans.append((match.group(1), match.start(), end))
+    return spans
+
+
+def chunk_text(text: str, chunk_size: int, chunk_overlap: int) -> List[Tuple[int, int]]:
+    """Splits text into windows of `chunk_size` words overlapping by `chunk_overlap` words (words ~ tokens)."""
+    words = [(m.start(), m.end()) for m in WORD.finditer(text)]
+    if not words:
+        return []
+    stride = max(1, chunk_size - chunk_overlap)
+    chunks = []
+    for start in range(0, len(words), stride):
+        window = words[start:start + chunk_size]
+        chunks.append((window[0][0], window[-1][1]))
+        if start + chunk_size >= len(words):
+            break
+    return chunks
+
+
+def build_index(documents: Dict[str, str], chunk_size: int, chunk_overlap: int) -> BM25Index:
+    index = BM25Index()
+    for name, text in documents.items():
+        spans = section_spans(text)
+        for i, (start, end) in enumerate(chunk_text(text, chunk_size, chunk_overlap)):
+            sections = [title for title, s_start, s_end in spans if s_start < end and start < s_end]
+            index.add(f"{name}#{i}", text[start:end], {"document": name, "sections": sections, "text": text[start:end]})
+    return index
+
+
+def _is_hit(metadata: Dict, label: Dict) -> bool:
+    if label.get("document") and metadata["document"] != label["document"]:
+        return False
+    wanted = label["section"].lower()
+    return any(title.lower().startswith(wanted) for title in metadata["sections"])
+
+
+def evaluate(index: BM25Index, labels: List[Dict], ks: List[int]) -> Dict:
+    """recall@k for each k, MRR over the deepest k, query latency and /rag payload size."""
+    max_k = max(ks)
+    hits_at = {k: 0 for k in ks}
+    reciprocal_ranks = []
+    latencies = []
+    sizes: Dict[str, List[int]] = {}
+    for label in labels:
+        start = time.perf_counter()
+        results = index.search(label["requirement"], max_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        rag_results = [{"text": index.metadata[doc_id]["text"], "score": round(score, 4),
+                        "source_uri": index.metadata[doc_id]["document"]} for doc_id, score in results]
+        for name, size in payloads.payload_sizes(rag_results).items():
+            sizes.setdefault(name, []).append(size)
+
+        first_hit = next((rank for rank, (doc_id, _) in enumerate(results, start=1)
+                          if _is_hit(index.metadata[doc_id], label)), None)
+        reciprocal_ranks.append(1 / first_hit if first_hit else 0.0)
+        for k in ks:
+            if first_hit and first_hit <= k:
+                hits_at[k] += 1
+
+    n = max(len(labels), 1)
+    latencies.sort()
+    return {
+        **{f"recall@{k}": round(hits_at[k] / n, 3) for k in ks},
+        "mrr": round(sum(reciprocal_ranks) / n, 3),
+        "query_ms_mean": round(statistics.mean(latencies), 2) if latencies else 0.0,
+        "query_ms_p95": round(latencies[max(0, math.ceil(0.95 * len(latencies)) - 1)], 2) if latencies else 0.0,
+        **{name: round(statistics.mean(values)) for name, values in sizes.items()},
+    }
+
+
+def run_benchmark(documents: Dict[str, str], labels: List[Dict], sizes: List[int], overlaps: List[int], ks: List[int]) -> List[Dict]:
+    results = []
+    for chunk_size in sizes:
+        for chunk_overlap in overlaps:
+            if chunk_overlap >= chunk_size:
+                continue
+            start = time.perf_counter()
+            index = build_index(documents, chunk_size, chunk_overlap)
+            build_seconds = time.perf_counter() - start
+            results.append({
+                "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap,
+                "chunks": len(index),
+                "index_bytes": index.size_bytes,
+                "build_s": round(build_seconds, 2),
+                **evaluate(index, labels, ks),
+            })
+    return results
+
+
+def _print_table(results: List[Dict]):
+    if not results:
+        print("No configurations were run.")
+        return
+    columns = list(results[0].keys())
+    widths = {c: max(len(c), *(len(str(r[c])) for r in results)) for c in columns}
+    print("  ".join(c.rjust(widths[c]) for c in columns))
+    for r in results:
+        print("  ".join(str(r[c]).rjust(widths[c]) for c in columns))
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark chunk size / overlap settings on a local index.")
+    parser.add_argument("--docs", required=True, help="Folder of .txt (pdf_preprocess output) and/or .pdf files")
+    parser.add_argument("--labels", required=True, help="JSON lines of {requirement, section, document?}")
+    parser.add_argument("--sizes", type=_int_list, default=[256, 512, 1024, 2048])
+    parser.add_argument("--overlaps", type=_int_list, default=[0, 100, 200])
+    parser.add_argument("--k", type=_int_list, default=[5, 10, 15])
+    parser.add_argument("--output", help="Optional path to write the results as JSON")
+    args = parser.parse_args()
+
+    with open(args.labels, encoding='utf-8') as f:
+        labels = [json.loads(line) for line in f if line.strip()]
+    documents = load_documents(args.docs)
+    print(f"Benchmarking {len(documents)} documents against {len(labels)} labelled requirements")
+
+    results = run_benchmark(documents, labels, args.sizes, args.overlaps, args.k)
+    _print_table(sorted(results, key=lambda r: r["mrr"], reverse=True))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
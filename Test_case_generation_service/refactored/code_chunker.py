@@ -0,0 +1,338 @@
+"""
+Language-aware chunking for source code.
+
+Files are split on top-level symbols so a function or class is never cut in half:
+Python with `ast`, brace languages (JS/TS, C/C++, Java, Go, Rust, Swift, PHP, CSS) by tracking
+brace depth outside strings and comments, Ruby on top-level def/class/module ... end blocks and
+Markdown on headings. Every chunk carries its path, symbol name and line range, and is written
+between START/END CHUNK markers that repeat the location, so any piece of a retrieved chunk can
+be traced back to `file:line`.
+"""
+import ast
+import re
+from typing import Dict, List, Optional, Tuple
+
+MAX_CHUNK_LINES = 120       # Longer symbols are split into windows of this many lines
+MODULE_SYMBOL = "<module>"  # Imports, constants and other top-level statements
+
+BRACE_EXTENSIONS = {'.js', '.ts', '.c', '.cpp', '.java', '.go', '.rs', '.swift', '.php', '.css'}
+LINE_COMMENT = {'.php': ('//', '#'), '.css': ()}
+COMMENT_PREFIXES = ('//', '/*', '*', '#')
+SYMBOL_PATTERNS = [
+    re.compile(r'\b(?:class|interface|struct|enum|trait|impl|union|namespace|protocol|extension|object|type)\s+([A-Za-z_$][\w$]*)'),
+    re.compile(r'\b(?:function|func|fn|def)\s*(?:\([^)]*\)\s*)?([A-Za-z_$][\w$]*)'),
+    re.compile(r'([A-Za-z_$][\w$]*)\s*(?:<[^<>]*>)?\s*\([^()]*\)\s*(?:[\w\s:<>\[\],*&.?-]*)?(?:=>)?\s*\{?\s*$'),
+    re.compile(r'\b(?:const|let|var)\s+([A-Za-z_$][\w$]*)'),
+]
+CHUNK_HEADER = re.compile(r'--- (?:START|END) CHUNK: (.+?):(\d+)-(\d+)(?: \| (.+?))? ---')
+
+
+def _chunk(path: str, symbol: str, lines: List[str], start: int, end: int) -> Dict:
+    """start/end are 1-based and inclusive."""
+    return {"path": path, "symbol": symbol, "start_line": start, "end_line": end,
+            "text": "\n".join(lines[start - 1:end])}
+
+
+def _split_long(chunks: List[Dict], lines: List[str]) -> List[Dict]:
+    result = []
+    for c in chunks:
+        span = c["end_line"] - c["start_line"] + 1
+        if span <= MAX_CHUNK_LINES:
+            result.append(c)
+            continue
+        for part, start in enumerate(range(c["start_line"], c["end_line"] + 1, MAX_CHUNK_LINES), start=1):
+            end = min(start + MAX_CHUNK_LINES - 1, c["end_line"])
+            result.append(_chunk(c["path"], f"{c['symbol']} (part {part})", lines, start, end))
+    return result
+
+
+def _merge_module_runs(path: str, units: List[Dict], lines: List[str]) -> List[Dict]:
+    """Merges consecutive top-level statements into one <module> chunk."""
+    merged = []
+    for unit in units:
+        if (unit["symbol"] == MODULE_SYMBOL and merged and merged[-1]["symbol"] == MODULE_SYMBOL):
+            merged[-1] = _chunk(path, MODULE_SYMBOL, lines, merged[-1]["start_line"], unit["end_line"])
+        else:
+            merged.append(unit)
+    return [u for u in merged if u["text"].strip()]
+
+
+def _skip_blank(lines: List[str], start: int, end: int) -> int:
+    while start < end and not lines[start - 1].strip():
+        start += 1
+    return start
+
+
+def chunk_python(path: str, source: str) -> List[Dict]:
+    lines = source.splitlines()
+    tree = ast.parse(source)
+    units = []
+    previous_end = 0
+    for node in tree.body:
+        # From just after the previous node, so comments and decorators above a def stay with it
+        end = node.end_lineno or node.lineno
+        start = _skip_blank(lines, previous_end + 1, end)
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            symbol = node.name
+        else:
+            symbol = MODULE_SYMBOL
+        units.append(_chunk(path, symbol, lines, start, end))
+        previous_end = end
+    if previous_end < len(lines):
+        units.append(_chunk(path, MODULE_SYMBOL, lines, _skip_blank(lines, previous_end + 1, len(lines)), len(lines)))
+    return _merge_module_runs(path, units, lines)
+
+
+def _brace_depths(source: str, line_comments) -> Tuple[List[int], List[int]]:
+    """
+    Brace and parenthesis depth at the end of every line, ignoring braces and parentheses
+    inside strings and comments.
+    """
+    depths, paren_depths = [], []
+    depth = paren = 0
+    i, n = 0, len(source)
+    in_string: Optional[str] = None
+    in_block_comment = in_line_comment = False
+    while i < n:
+        ch = source[i]
+        if ch == '\n':
+            depths.append(depth)
+            paren_depths.append(paren)
+            in_line_comment = False
+            if in_string in ('"', "'"):
+                in_string = None  # Unterminated literal; don't let it swallow the file
+        elif in_line_comment:
+            pass
+        elif in_block_comment:
+            if source.startswith('*/', i):
+                in_block_comment = False
+                i += 1
+        elif in_string:
+            if ch == '\\':
+                i += 1
+            elif ch == in_string:
+                in_string = None
+        elif source.startswith('/*', i):
+            in_block_comment = True
+            i += 1
+        elif any(source.startswith(marker, i) for marker in line_comments):
+            in_line_comment = True
+        elif ch in ('"', "'", '`'):
+            in_string = ch
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth = max(0, depth - 1)
+        elif ch == '(':
+            paren += 1
+        elif ch == ')':
+            paren = max(0, paren - 1)
+        i += 1
+    depths.append(depth)
+    paren_depths.append(paren)
+    return depths, paren_depths
+
+
+def _declared_symbol(header_lines: List[str]) -> Optional[str]:
+    """The name declared by a declaration's header, looking at its lines in order."""
+    for line in header_lines:
+        line = " ".join(line.split())
+        if line.startswith(('import ', 'import{', 'export {', 'export{', 'export *')):
+            return None
+        for pattern in SYMBOL_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                return match.group(1)
+    return None
+
+
+def _symbol_for(header_lines: List[str], extension: str) -> str:
+    header = " ".join(" ".join(header_lines).split()).split('{', 1)[0].strip()
+    if extension == '.css':
+        return header[:60] or MODULE_SYMBOL
+    return _declared_symbol(header_lines) or header[:60] or MODULE_SYMBOL
+
+
+def _next_code_line(lines: List[str], number: int) -> str:
+    for line in lines[number:]:
+        stripped = line.strip()
+        if stripped and not stripped.startswith(COMMENT_PREFIXES):
+            return stripped
+    return ""
+
+
+def chunk_braces(path: str, source: str, extension: str) -> List[Dict]:
+    lines = source.splitlines()
+    depths, paren_depths = _brace_depths(source, LINE_COMMENT.get(extension, ('//',)))
+    units = []
+    unit_start = None       # First line of the block being read (including leading comments)
+    pending_start = None    # First line of a comment run that belongs to the next block
+    header_start = None     # First line of a declaration whose header runs over several lines
+
+    def code_lines(start: int, end: int) -> List[str]:
+        return [l for l in lines[start - 1:end] if l.strip() and not l.strip().startswith(COMMENT_PREFIXES)]
+
+    def block_header(start: int, end: int) -> List[str]:
+        """The code lines of a block up to the one that opens it."""
+        header = code_lines(start, end)
+        return header[:next((i for i, l in enumerate(header) if '{' in l), len(header)) + 1]
+
+    for number, line in enumerate(lines, start=1):
+        depth_before = depths[number - 2] if number > 1 else 0
+        depth_after = depths[number - 1]
+        stripped = line.strip()
+        if unit_start is not None:
+            # A block inside a parameter list (e.g. an object default) does not end the declaration
+            if depth_after == 0 and paren_depths[number - 1] == 0:
+                header = block_header(header_start or unit_start, number)
+                units.append(_chunk(path, _symbol_for(header, extension), lines, unit_start, number))
+                unit_start = header_start = None
+            continue
+        if depth_before == 0 and depth_after > 0:
+            unit_start = pending_start or header_start or number
+            header_start = header_start or number
+            pending_start = None
+            continue
+        if not stripped:
+            continue
+        if stripped.startswith(COMMENT_PREFIXES):
+            if header_start is None:
+                pending_start = pending_start or number
+            continue
+        if (paren_depths[number - 1] > 0 or stripped.startswith('@') or stripped.endswith(',')
+                or _next_code_line(lines, number).startswith('{')):
+            # The header goes on: a parameter list or selector list over several lines, an
+            # annotation, or a brace on the next line
+            header_start = header_start or number
+            continue
+        header = code_lines(header_start or number, number)
+        joined = " ".join(header)
+        if '{' in joined and '}' in joined:
+            # A whole block on one line, e.g. `body { margin: 0; }`
+            symbol = _symbol_for(header, extension) if extension == '.css' else _declared_symbol(header)
+        else:
+            symbol = None
+        units.append(_chunk(path, symbol or MODULE_SYMBOL, lines, pending_start or header_start or number, number))
+        pending_start = header_start = None
+    if unit_start is not None:
+        header = block_header(header_start or unit_start, len(lines))
+        units.append(_chunk(path, _symbol_for(header, extension), lines, unit_start, len(lines)))
+    elif header_start is not None:
+        units.append(_chunk(path, MODULE_SYMBOL, lines, pending_start or header_start, len(lines)))
+    return _merge_module_runs(path, units, lines)
+
+
+def chunk_ruby(path: str, source: str) -> List[Dict]:
+    lines = source.splitlines()
+    units = []
+    start = None
+    symbol = MODULE_SYMBOL
+    module_start = None
+    for number, line in enumerate(lines, start=1):
+        match = re.match(r'(?:def|class|module)\s+([\w:.?!=]+)', line)
+        if start is None and match:
+            if module_start:
+                units.append(_chunk(path, MODULE_SYMBOL, lines, module_start, number - 1))
+                module_start = None
+            start, symbol = number, match.group(1)
+        elif start is not None and re.match(r'end\b', line):
+            units.append(_chunk(path, symbol, lines, start, number))
+            start = None
+        elif start is None and module_start is None:
+            module_start = number
+    if start is not None:
+        units.append(_chunk(path, symbol, lines, start, len(lines)))
+    elif module_start:
+        units.append(_chunk(path, MODULE_SYMBOL, lines, module_start, len(lines)))
+    return _merge_module_runs(path, units, lines)
+
+
+def chunk_markdown(path: str, source: str) -> List[Dict]:
+    lines = source.splitlines()
+    units = []
+    start, symbol = 1, MODULE_SYMBOL
+    for number, line in enumerate(lines, start=1):
+        heading = re.match(r'#{1,6}\s+(.+)', line)
+        if heading and number > start:
+            units.append(_chunk(path, symbol, lines, start, number - 1))
+            start = number
+        if heading:
+            symbol = heading.group(1).strip()
+    if lines:
+        units.append(_chunk(path, symbol, lines, start, len(lines)))
+    return [u for u in units if u["text"].strip()]
+
+
+def chunk_lines(path: str, source: str) -> List[Dict]:
+    lines = source.splitlines()
+    return [_chunk(path, MODULE_SYMBOL, lines, 1, len(lines))] if lines else []
+
+
+def chunk_source(path: str, source: str) -> List[Dict]:
+    """Splits one file into symbol chunks, falling back to line windows if it can't be parsed."""
+    extension = '.' + path.rsplit('.', 1)[-1].lower() if '.' in path else ''
+    lines = source.splitlines()
+    try:
+        if extension == '.py':
+            chunks = chunk_python(path, source)
+        elif extension in BRACE_EXTENSIONS:
+            chunks = chunk_braces(path, source, extension)
+        elif extension == '.rb':
+            chunks = chunk_ruby(path, source)
+        elif extension == '.md':
+            chunks = chunk_markdown(path, source)
+        else:
+            chunks = chunk_lines(path, source)
+    except (SyntaxError, ValueError, RecursionError):
+        chunks = chunk_lines(path, source)
+    return _split_long(chunks, lines)
+
+
+def location(chunk: Dict) -> str:
+    return f"{chunk['path']}:{chunk['start_line']}-{chunk['end_line']}"
+
+
+def format_chunk_entry(chunk: Dict) -> str:
+    return (f"--- START CHUNK: {location(chunk)} | {chunk['symbol']} ---\n{chunk['text']}\n"
+            f"--- END CHUNK: {location(chunk)} | {chunk['symbol']} ---\n\n")
+
+
+def locate_in_text(text: str) -> List[Dict]:
+    """File/line locations named by the chunk markers inside a retrieved piece of text, in order."""
+    seen = []
+    for match in CHUNK_HEADER.finditer(text):
+        loc = {"path": match.group(1), "start_line": int(match.group(2)), "end_line": int(match.group(3)),
+               "symbol": match.group(4) or MODULE_SYMBOL}
+        if loc not in seen:
+            seen.append(loc)
+    return seen
+
+
+class SymbolIndex:
+    """symbol -> chunk locations for one repository, so traceability can cite file:line directly."""
+
+    def __init__(self, entries: Optional[List[Dict]] = None):
+        self.entries: List[Dict] = []
+        self._by_symbol: Dict[str, List[Dict]] = {}
+        for entry in entries or []:
+            self.add(entry)
+
+    def add(self, entry: Dict):
+        entry = {k: entry[k] for k in ("path", "symbol", "start_line", "end_line", "shard") if k in entry}
+        self.entries.append(entry)
+        base = entry["symbol"].split(" (part ")[0].lower()
+        self._by_symbol.setdefault(base, []).append(entry)
+
+    def drop_paths(self, paths) -> "SymbolIndex":
+        paths = set(paths)
+        return SymbolIndex([e for e in self.entries if e["path"] not in paths])
+
+    def lookup(self, symbol: str) -> List[Dict]:
+        return [dict(e, location=f"{e['path']}:{e['start_line']}") for e in self._by_symbol.get(symbol.lower(), [])]
+
+    def to_json(self) -> Dict:
+        return {"entries": self.entries}
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "SymbolIndex":
+        return cls(data.get("entries", []))
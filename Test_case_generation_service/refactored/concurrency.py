@@ -0,0 +1,163 @@
+"""
+Single-flight request coalescing.
+
+Concurrent calls with the same key share one in-flight computation: the first caller (the
+leader) runs it, everyone who arrives while it runs waits for and receives the same result,
+or the same exception. Nothing is cached once the call finishes. Waiters that give up after
+`wait_timeout` (or at their request deadline) run the computation themselves instead of failing.
+With `reusable`, a result it rejects (e.g. one the leader cut short at its own deadline) is only
+shared with waiters whose deadline is no later than the leader's; the others run it themselves.
+
+`SingleFlight` is for threads (the Flask app), `AsyncSingleFlight` for the event loop (asgi_app).
+Each counts `<name>.requests`, `<name>.coalesced` (waiters that got the leader's result) and
+`<name>.rerun` in metrics. `Refreshing` applies the same idea to slowly changing lookups: one
+reload at a time, with the others served the last value.
+"""
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import deadline
+import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.deadline = deadline.at()
+
+
+def _outlasts(leader_deadline: Optional[float]) -> bool:
+    """The current request has more time than a leader with `leader_deadline`."""
+    mine = deadline.at()
+    return leader_deadline is not None and (mine is None or mine > leader_deadline)
+
+
+def _wait_timeout(wait_timeout: float) -> float:
+    """A waiter never waits past its own request deadline (the leader may have a longer one)."""
+    left = deadline.remaining()
+    return wait_timeout if left is None else min(wait_timeout, left)
+
+
+class SingleFlight:
+    def __init__(self, name: str, wait_timeout: float = 60.0):
+        self.name = name
+        self.wait_timeout = wait_timeout
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable, *args, reusable: Optional[Callable[[Any], bool]] = None) -> Any:
+        metrics.incr(f"{self.name}.requests")
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(_wait_timeout(self.wait_timeout)):
+                metrics.incr(f"{self.name}.wait_timeouts")
+                return fn(*args)
+            if (call.error is None and reusable is not None and not reusable(call.result)
+                    and _outlasts(call.deadline)):
+                metrics.incr(f"{self.name}.rerun")
+                return fn(*args)
+            metrics.incr(f"{self.name}.coalesced")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Forget the call before waking waiters, so later arrivals start a fresh one
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """
+    The computation runs as its own task, so a leader whose request is cancelled (client gone)
+    does not take its waiters down with it.
+    """
+
+    def __init__(self, name: str, wait_timeout: float = 60.0):
+        self.name = name
+        self.wait_timeout = wait_timeout
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._deadlines: Dict[asyncio.Task, Optional[float]] = {}
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        self._deadlines.pop(task, None)
+        if not task.cancelled():
+            task.exception()  # Marks the error as retrieved even if every caller went away
+
+    async def do(self, key: str, fn: Callable[..., Awaitable], *args,
+                 reusable: Optional[Callable[[Any], bool]] = None) -> Any:
+        metrics.incr(f"{self.name}.requests")
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._tasks[key] = task
+            self._deadlines[task] = deadline.at()
+            task.add_done_callback(lambda t: self._finished(key, t))
+            return await asyncio.shield(task)
+
+        leader_deadline = self._deadlines.get(task)  # Gone once the task finishes
+        try:
+            await asyncio.wait_for(asyncio.wait({task}), _wait_timeout(self.wait_timeout))
+        except asyncio.TimeoutError:
+            metrics.incr(f"{self.name}.wait_timeouts")
+            return await fn(*args)
+        if (not task.cancelled() and task.exception() is None and reusable is not None
+                and not reusable(task.result()) and _outlasts(leader_deadline)):
+            metrics.incr(f"{self.name}.rerun")
+            return await fn(*args)
+        metrics.incr(f"{self.name}.coalesced")
+        return task.result()
+
+
+class Refreshing:
+    """
+    A value from `load()`, reloaded at most once per `ttl` seconds. While one caller reloads, the
+    others keep using the previous value; only the very first load is waited for.
+    """
+
+    def __init__(self, load: Callable[[], Any], ttl: float):
+        self.load = load
+        self.ttl = ttl
+        self._value: Any = None
+        self._loaded_at: Optional[float] = None
+        self._refresh = threading.Lock()
+
+    @property
+    def fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def get(self) -> Any:
+        if self.fresh:
+            return self._value
+        if not self._refresh.acquire(blocking=self._loaded_at is None):
+            return self._value  # Someone else is reloading; stale is fine meanwhile
+        try:
+            if not self.fresh:
+                self._value = self.load()
+                self._loaded_at = time.monotonic()
+            return self._value
+        finally:
+            self._refresh.release()
+
+    def invalidate(self):
+        """Forces a reload on next use (the current value is still served while it runs)."""
+        if self._loaded_at is not None:
+            self._loaded_at = -self.ttl
@@ -1,18 +1,24 @@
+import asyncio
+import contextvars
 import hashlib
-import re
 import time
 import glob
+import random
 import os, shutil
-from typing import Tuple, List, Dict
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Tuple, List, Dict, Iterator, AsyncIterator
+from google.api_core.exceptions import ResourceExhausted, TooManyRequests
 from google.cloud import firestore, storage
 from selenium import webdriver
 from selenium_stealth import stealth
 # Assuming only_pdf_url_scraper.py is available in the environment
-from google.cloud.storage import Client
+from google.cloud.storage import Client, transfer_manager
 import vertexai
+from google.cloud import aiplatform_v1
 from vertexai import rag
-from pathlib import Path
-from git import Repo
 
 from vertexai.rag import RagEmbeddingModelConfig, RagVectorDbConfig, TransformationConfig, ChunkingConfig
 from google import genai
@@ -25,6 +31,26 @@ from google.genai.errors import APIError
 from google.genai.types import GenerateContentConfig
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv,find_dotenv
+import adaptive
+import admission
+import code_chunker
+import deadline
+import hedging
+from concurrency import AsyncSingleFlight, Refreshing, SingleFlight
+import jobs
+import lanes
+import leases
+import metrics
+import pdf_preprocess
+import progress
+import resilience
+import shards
+import tenants
+from admission import AdmissionRejected
+from deadline import DeadlineExceeded
+from jobs import JobAbandoned, JobCancelled, check_cancelled
+from local_index import RecentChunkIndex
+from resilience import CircuitOpen
 
 load_dotenv(dotenv_path=find_dotenv())
 
@@ -37,7 +63,33 @@ VAI_REGION = os.getenv("VAI_REGION")
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 MASTER_RAG_CORPUS = os.getenv("MASTER_RAG_CORPUS")      
 
+# --- UPLOAD CONFIGURATION ---
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))          # In-flight rag.upload_file calls
+UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "5"))          # Retries on quota (429) errors
+UPLOAD_BACKOFF_BASE = float(os.getenv("UPLOAD_BACKOFF_BASE", "2.0"))    # Seconds, doubled per attempt
+BULK_IMPORT_THRESHOLD = int(os.getenv("BULK_IMPORT_THRESHOLD", "10"))   # Switch to GCS + import_files at this many files
+GCS_UPLOAD_WORKERS = int(os.getenv("GCS_UPLOAD_WORKERS", "8"))
+PDF_PREPROCESS = os.getenv("PDF_PREPROCESS", "true").lower() == "true"   # Upload cleaned text instead of raw PDFs
+
+# --- /rag CONFIGURATION ---
+RAG_COALESCE_WAIT_SECONDS = float(os.getenv("RAG_COALESCE_WAIT_SECONDS", "60"))  # Then a waiter runs the query itself
+ENHANCEMENT_BUDGET_SHARE = float(os.getenv("ENHANCEMENT_BUDGET_SHARE", "0.5"))    # Of the request deadline; retrieval gets the rest
+RAG_STREAM_MAX_SUBQUERIES = int(os.getenv("RAG_STREAM_MAX_SUBQUERIES", "6"))      # Sub-queries retrieved per /rag/stream call
+RAG_STREAM_WORKERS = int(os.getenv("RAG_STREAM_WORKERS", "32"))                    # Threads for concurrent /rag/stream retrievals
+RRF_K = 60                                                                         # Reciprocal rank fusion damping constant
+FALLBACK_INDEX_MAX_BYTES = int(os.getenv("FALLBACK_INDEX_MAX_BYTES", str(64 * 1024 * 1024)))  # Chunk text kept for outages
+
+# --- CHECKPOINT CONFIGURATION ---
+CHECKPOINT_BATCH_SIZE = int(os.getenv("CHECKPOINT_BATCH_SIZE", "10"))   # Files ingested between checkpoint writes
+DELETE_ADMISSION_ATTEMPTS = int(os.getenv("DELETE_ADMISSION_ATTEMPTS", "5"))  # Per file, for deletes inside a job
+CHECKPOINT_PREFIX = "checkpoints"                                        # GCS prefix for downloaded files of unfinished jobs
+
+# --- CHUNKING CONFIGURATION (overridable per corpus via the document's "chunking" field) ---
+DEFAULT_CHUNK_SIZE = int(os.getenv("DEFAULT_CHUNK_SIZE", "1024"))
+DEFAULT_CHUNK_OVERLAP = int(os.getenv("DEFAULT_CHUNK_OVERLAP", "200"))
+
 # --- SELENIUM SETUP (Global Driver for Scraping/Download) ---
+BROWSER_PAGE_LOAD_TIMEOUT = int(os.getenv("BROWSER_PAGE_LOAD_TIMEOUT", "60"))  # Bounds how long a cancelled job can hold the browser
 options = webdriver.ChromeOptions()
 options.add_argument("--headless")
 options.add_argument("--no-sandbox")
@@ -53,6 +105,7 @@ options.add_experimental_option('prefs', {
 options.add_experimental_option("excludeSwitches", ["enable-automation"])
 options.add_experimental_option('useAutomationExtension', False)
 driver = webdriver.Chrome(options=options)
+driver.set_page_load_timeout(BROWSER_PAGE_LOAD_TIMEOUT)
 stealth(driver,
         languages=["en-US", "en"],
         vendor="Google Inc.",
@@ -61,6 +114,44 @@ stealth(driver,
         renderer="Intel Iris OpenGL Engine",
         fix_hairline=True,
 )
+# One job at a time drives the browser; its downloads go to that job's workspace
+_browser_lock = threading.Lock()
+
+def job_workspace() -> str:
+    """
+    The current job's own download directory, temp/<job id>/, so cleaning up after one job does
+    not touch files another job is still working on. temp/ itself outside jobs.
+    """
+    if not jobs.in_job():
+        return pdf_temp_save_path
+    path = os.path.join(pdf_temp_save_path, jobs.current_token().job_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def discard_job_workspace():
+    """Deletes the current job's workspace and everything in it."""
+    path = job_workspace()
+    if path == pdf_temp_save_path:
+        delete_folder_content(path)
+    else:
+        shutil.rmtree(path, ignore_errors=True)
+
+@contextmanager
+def browser_lease():
+    """
+    Holds the shared driver, downloading into the current job's workspace. Waiting jobs give up
+    as soon as they are cancelled.
+    """
+    while not _browser_lock.acquire(timeout=0.5):
+        check_cancelled()
+    try:
+        try:
+            driver.execute_cdp_cmd("Browser.setDownloadBehavior", {"behavior": "allow", "downloadPath": job_workspace()})
+        except Exception as e:
+            print(f"Warning: could not point browser downloads at the job workspace: {e}")
+        yield driver
+    finally:
+        _browser_lock.release()
 
 # --- CLIENT INITIALIZATION ---
 db = firestore.Client(project=PROJECT_ID)
@@ -74,79 +165,19 @@ rag_retrieval_config = rag.RagRetrievalConfig(
     # filter=rag.utils.resources.Filter(vector_distance_threshold=0.5),
 )
 rag_corpora = rag.get_corpus(name=MASTER_RAG_CORPUS)
-
-def repo_to_txt(repo_link):
-    global pdf_temp_save_path
-    temp_dir = pdf_temp_save_path
-    repo_dir = os.path.join(temp_dir, "temp_repo")
-    Repo.clone_from(repo_link, repo_dir)
-    SOURCE_EXTENSIONS = ['.py', '.js', '.ts', '.html', '.css', '.c', '.cpp', '.java', '.go', '.rs', '.swift', '.rb', '.php', '.md']
-    EXCLUDE_DIRS = ['.git', '__pycache__', 'node_modules', '.idea', '.vscode', 'venv', 'env', '.env', 'site-packages']
-    clone_path = Path(repo_dir)
-    output_file = os.path.join(temp_dir, "source_code.txt")
-    with open(output_file, 'w', encoding='utf-8') as outfile:
-        for root, dirs, files in os.walk(clone_path, topdown=True):
-            new_dirs = []
-            for d in dirs:
-                include = False
-                for ed in EXCLUDE_DIRS: 
-                    if ed in d: 
-                        include = False
-                        break
-                if include: new_dirs += d
-            dirs[:] = new_dirs
-            for file_name in files:
-                file_path = Path(root) / file_name
-                if file_path.suffix.lower() in SOURCE_EXTENSIONS:
-                    try:
-                        relative_path = file_path.relative_to(clone_path)
-                        outfile.write(f"--- START FILE: {relative_path} ---\n")
-                        content = file_path.read_text(encoding='utf-8')
-                        outfile.write(content.strip() + '\n') # .strip() cleans up extra leading/trailing whitespace
-                        outfile.write(f"--- END FILE: {relative_path} ---\n\n")
-                        # print(f"  - Included: {relative_path}")
-                    except Exception as e:
-                        print(f"  - Skipped (Error {e.__class__.__name__}): {file_path}")
-    # print(f"\nAggregation complete. The RAG source file is: **{output_file}**")
-    return output_file
-
-def create_source_code_embdeeings(repo_link):
-    repo_name = repo_link.split('/')[-1]
-    doc_id = hashlib.sha256(repo_link.encode('utf-8')).hexdigest()
-    doc_ref = db.collection(FIRESTORE_COLLECTION).document(doc_id)
-    print(f"--- STARTING ASYNC CREATION for source code {repo_link} ---")
-    
-    try:
-        # 1. Determine content type and find PDF links
-        output_file = repo_to_txt(repo_link)
-
-        rag_file_ids = []
-        rag_file_response = rag.upload_file(
-            corpus_name=MASTER_RAG_CORPUS,
-            path=output_file,
-            display_name=repo_name, # Use the filename as the display name
-            description="Uploaded via Python SDK example."
-        )
-        rag_file_ids.append(rag_file_response.name)
-
-        delete_folder_content(pdf_temp_save_path) 
-        
-        # 3. Update DB with collected information
-        doc_ref.update({
-            "rag_file_ids": rag_file_ids,
-            "processing": False,
-            "embeddings_available": True if len(rag_file_ids) else False
-        })
-        
-        print(f"--- ASYNC CREATION COMPLETE for {repo_link}  ---")
-        
-    except Exception as e:
-        print(f"Fatal error during async creation of {repo_link}: {e}")
-        doc_ref.update({
-            "processing": False,
-            "embeddings_available": False,
-            "error": str(e)
-        })
+_rag_async_client = None  # See rag_async_client()
+_rag_flights = SingleFlight("rag", RAG_COALESCE_WAIT_SECONDS)
+_rag_flights_async = AsyncSingleFlight("rag", RAG_COALESCE_WAIT_SECONDS)
+# Slow enhancement / retrieval calls get a duplicate once past their latency percentile (see hedging.py)
+_enhancement_hedge = hedging.hedger("enhancement")
+_retrieval_hedge = hedging.hedger("retrieval")
+# What /rag serves while a circuit breaker is open (see resilience.py), filled from successful calls
+_enhancement_cache = resilience.TTLCache()
+_result_cache = resilience.TTLCache()
+_stream_result_cache = resilience.TTLCache()          # Fused stream rankings, kept apart from /rag's results
+_fallback_indexes: Dict[str, RecentChunkIndex] = {}   # One per tenant, see fallback_index()
+_fallback_indexes_lock = threading.Lock()
+_stream_executor = ThreadPoolExecutor(max_workers=RAG_STREAM_WORKERS, thread_name_prefix="rag-stream")
 
 def delete_source_code_embeddings(repo_link):
 
@@ -155,26 +186,22 @@ def delete_source_code_embeddings(repo_link):
     initial_data = doc_ref.get().to_dict()
     
     try:
-        # 1. Delete GCS files
-        # delete_directory_gcs(corpus_name)
+        # 1. Delete GCS files (the shard manifest and symbol index)
+        if initial_data.get("manifest_uri"):
+            delete_directory_gcs(f"source-code/{doc_id}")
         rag_file_ids = initial_data.get("rag_file_ids")
 
         if rag_file_ids:
             print(f"Deleting {len(rag_file_ids)} RAG Files from the master corpus...")
-            for file_id in rag_file_ids:
-                try:
-                    # Deletes the file resource from the single master corpus
-                    rag.delete_file(file_id) 
-                    print(f"Deleted RAG File: {file_id}")
-                except Exception as e:
-                    # Log but continue to ensure GCS/Firestore are cleaned up
-                    print(f"Warning: Could not delete RAG File {file_id}. Error: {e}")
+            keep_files_on_record(doc_ref, delete_rag_files(rag_file_ids))
         else:
             print(f"No RAG file IDs found to delete for source {repo_link}.")           
         
         doc_ref.delete()
         print(f'Firestore record for {repo_link} deleted.')
         return True
+    except AdmissionRejected:
+        raise
     except Exception as e:
         print(f"Error during synchronous deletion of {repo_link}: {e}")
         return False
@@ -208,26 +235,86 @@ Focus your queries on finding:
 **GENERATED SEARCH QUERIES (Semicolon separated list ONLY):**
 """
 
-def retrieve_regulations(software_requirement: str):
+def rag_request_key(software_requirement: str) -> str:
+    """Requirements that differ only in case or whitespace are the same /rag request (of the same tenant)."""
+    digest = hashlib.sha256(" ".join(software_requirement.split()).lower().encode('utf-8')).hexdigest()
+    return tenants.current().namespace(digest)
+
+def fallback_index() -> RecentChunkIndex:
+    """The current tenant's index of recently retrieved chunks."""
+    name = tenants.current().name
+    with _fallback_indexes_lock:
+        if name not in _fallback_indexes:
+            _fallback_indexes[name] = RecentChunkIndex(FALLBACK_INDEX_MAX_BYTES)
+        return _fallback_indexes[name]
+
+def retrieve_regulations(software_requirement: str) -> Tuple[List[Dict], List[str]]:
     """
-    Executes the full flow: Enhancement -> Search -> Retrieval.
+    Executes the full flow: Enhancement -> Search -> Retrieval, within the request deadline if
+    one is set (see deadline.py). Returns (results, degraded) where `degraded` names the stages
+    that ran out of time or failed and the fallback served instead, e.g.
+    ["enhancement_timeout"] or ["retrieval_unavailable", "results_cached"].
+    Identical requests in flight at the same time share one run (see concurrency.SingleFlight),
+    except that a run cut short by its deadline is not handed to requests with more time left.
     """
+    return _rag_flights.do(rag_request_key(software_requirement), _retrieve_regulations, software_requirement,
+                           reusable=_not_timed_out)
+
+async def retrieve_regulations_async(software_requirement: str) -> Tuple[List[Dict], List[str]]:
+    """retrieve_regulations for the ASGI app, coalesced the same way."""
+    return await _rag_flights_async.do(rag_request_key(software_requirement), _retrieve_regulations_async,
+                                       software_requirement, reusable=_not_timed_out)
+
+def _not_timed_out(outcome: Tuple[List[Dict], List[str]]) -> bool:
+    return not any(stage.endswith("_timeout") for stage in outcome[1])
+
+def enhance_query(prompt: str) -> str:
+    tenant = tenants.current()
+    tenant.check_budget()
+    with resilience.gemini.guard(), admission.gemini.slot():
+        response = client.models.generate_content(
+            model='gemini-2.5-flash',
+            contents=[prompt],
+        )
+    tenant.charge(response)
+    return response.text
+
+async def enhance_query_async(prompt: str) -> str:
+    tenant = tenants.current()
+    tenant.check_budget()
+    with resilience.gemini.guard():
+        async with admission.gemini.slot_async():
+            response = await client.aio.models.generate_content(
+                model='gemini-2.5-flash',
+                contents=[prompt],
+            )
+    tenant.charge(response)
+    return response.text
+
+def _retrieve_regulations(software_requirement: str) -> Tuple[List[Dict], List[str]]:
+    degraded = []
     # 1. Enhance the query using the LLM
     print(f"-> Enhancing requirement: '{software_requirement[:50]}...'")
 
     prompt = get_enhancement_prompt(software_requirement)
     
+    key = rag_request_key(software_requirement)
     enhanced_query = ""
     try:
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=[prompt],
-        )
-        enhanced_query = response.text
-
+        enhanced_query = deadline.call("enhancement", _enhancement_hedge.call, enhance_query, prompt,
+                                       share=ENHANCEMENT_BUDGET_SHARE)
+        _enhancement_cache.put(key, enhanced_query)
+    except DeadlineExceeded:
+        # Retrieval with the bare requirement beats no answer
+        degraded.append("enhancement_timeout")
+    except CircuitOpen:
+        enhanced_query = cached_enhancement(key, degraded)
+    except AdmissionRejected:
+        raise
     except Exception as e:
+        # Fall back to retrieval with the original requirement
         print(f"An error occurred during query enhancement: {e}")
-        return [software_requirement] # Fallback to original query
+        degraded.append("enhancement_error")
 
     
     # 2. Query the RAG corpus with the enhanced queries
@@ -235,27 +322,475 @@ def retrieve_regulations(software_requirement: str):
 
     print(f"Query: {rag_query}\n")
 
-    response = rag.retrieval_query(
-        rag_resources=[
-            rag.RagResource(
-                rag_corpus=rag_corpora.name,
-                # Optional: you can  specific files within the corpus
-                # rag_file_ids=["rag-file-1", "rag-file-2"],
-            )
-        ],
-        text=rag_query,
-        rag_retrieval_config=rag_retrieval_config,
+    try:
+        results = deadline.call("retrieval", _retrieval_hedge.call, search_lanes, rag_query)
+    except DeadlineExceeded:
+        return fallback_results(key, rag_query, degraded + ["retrieval_timeout"])
+    except CircuitOpen:
+        return fallback_results(key, rag_query, degraded + ["retrieval_unavailable"])
+    return remember_results(key, results), degraded
+
+async def _retrieve_regulations_async(software_requirement: str) -> Tuple[List[Dict], List[str]]:
+    """
+    Same flow as _retrieve_regulations, awaiting the async genai client for the
+    enhancement and the async Vertex RAG client for the retrieval.
+    """
+    degraded = []
+    print(f"-> Enhancing requirement: '{software_requirement[:50]}...'")
+
+    prompt = get_enhancement_prompt(software_requirement)
+
+    key = rag_request_key(software_requirement)
+    enhanced_query = ""
+    try:
+        enhanced_query = await deadline.call_async("enhancement", _enhancement_hedge.call_async,
+                                                   enhance_query_async, prompt, share=ENHANCEMENT_BUDGET_SHARE)
+        _enhancement_cache.put(key, enhanced_query)
+    except DeadlineExceeded:
+        degraded.append("enhancement_timeout")
+    except CircuitOpen:
+        enhanced_query = cached_enhancement(key, degraded)
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        # Fall back to retrieval with the original requirement
+        print(f"An error occurred during query enhancement: {e}")
+        degraded.append("enhancement_error")
+
+    rag_query = software_requirement + "\n" + enhanced_query
+
+    print(f"Query: {rag_query}\n")
+
+    try:
+        results = await deadline.call_async("retrieval", _retrieval_hedge.call_async, search_lanes_async, rag_query)
+    except DeadlineExceeded:
+        return fallback_results(key, rag_query, degraded + ["retrieval_timeout"])
+    except CircuitOpen:
+        return fallback_results(key, rag_query, degraded + ["retrieval_unavailable"])
+    return remember_results(key, results), degraded
+
+def cached_enhancement(key: str, degraded: List[str]) -> str:
+    """Gemini is unavailable: the last enhancement of this requirement, else none (raw-requirement retrieval)."""
+    enhanced_query = _enhancement_cache.get(key)
+    degraded.append("enhancement_cached" if enhanced_query is not None else "enhancement_unavailable")
+    return enhanced_query or ""
+
+def remember_results(key: str, results: List[Dict]) -> List[Dict]:
+    _result_cache.put(key, results)
+    fallback_index().add_results(results)
+    return results
+
+def fallback_results(key: str, rag_query: str, degraded: List[str],
+                     cache: resilience.TTLCache = _result_cache) -> Tuple[List[Dict], List[str]]:
+    """
+    Retrieval did not answer: the last results for this requirement from `cache`, else a BM25
+    search over chunks seen in earlier retrievals, else nothing. `degraded` records which was served.
+    """
+    cached = cache.get(key)
+    if cached is not None:
+        return cached, degraded + ["results_cached"]
+    results = fallback_index().search(rag_query, top_k_chunks)
+    if results:
+        return results, degraded + ["local_index"]
+    return [], degraded
+
+def retrieval_query(rag_query: str, lane: Optional[lanes.Lane] = None, file_ids: Optional[List[str]] = None,
+                    rag_corpus: Optional[str] = None):
+    """
+    One retrieval against the master corpus (blocking), or against `rag_corpus` restricted to
+    `file_ids` with the lane's settings.
+    """
+    config = rag_retrieval_config
+    if lane is not None:
+        config = rag.RagRetrievalConfig(
+            top_k=lane.fetch_k,
+            filter=rag.utils.resources.Filter(vector_distance_threshold=lane.vector_distance_threshold)
+            if lane.vector_distance_threshold is not None else None,
+        )
+    with resilience.rag.guard():
+        return admission.admitted(
+            admission.rag,
+            rag.retrieval_query,
+            rag_resources=[
+                rag.RagResource(
+                    rag_corpus=rag_corpus or rag_corpora.name,
+                    rag_file_ids=file_ids,
+                )
+            ],
+            text=rag_query,
+            rag_retrieval_config=config,
+        )
+
+def rag_async_client() -> aiplatform_v1.VertexRagServiceAsyncClient:
+    """
+    One async RAG client (and gRPC channel) for the process, so requests reuse connections.
+    Created on first use because the channel binds to the running event loop.
+    """
+    global _rag_async_client
+    if _rag_async_client is None:
+        _rag_async_client = aiplatform_v1.VertexRagServiceAsyncClient(
+            client_options={"api_endpoint": f"{VAI_REGION}-aiplatform.googleapis.com"}
+        )
+    return _rag_async_client
+
+async def retrieval_query_async(rag_query: str, lane: Optional[lanes.Lane] = None,
+                                file_ids: Optional[List[str]] = None, rag_corpus: Optional[str] = None):
+    """retrieval_query without blocking the event loop. Returns the same response type."""
+    vertex_rag_store = aiplatform_v1.RetrieveContextsRequest.VertexRagStore
+    config = aiplatform_v1.RagRetrievalConfig(top_k=top_k_chunks)
+    if lane is not None:
+        config = aiplatform_v1.RagRetrievalConfig(top_k=lane.fetch_k)
+        if lane.vector_distance_threshold is not None:
+            config.filter = aiplatform_v1.RagRetrievalConfig.Filter(
+                vector_distance_threshold=lane.vector_distance_threshold)
+    request = aiplatform_v1.RetrieveContextsRequest(
+        parent=f"projects/{PROJECT_ID}/locations/{VAI_REGION}",
+        vertex_rag_store=vertex_rag_store(
+            rag_resources=[vertex_rag_store.RagResource(rag_corpus=rag_corpus or rag_corpora.name,
+                                                       rag_file_ids=file_ids or [])]
+        ),
+        query=aiplatform_v1.RagQuery(
+            text=rag_query,
+            rag_retrieval_config=config,
+        ),
     )
+    with resilience.rag.guard():
+        async with admission.rag.slot_async():
+            return await rag_async_client().retrieve_contexts(request=request)
+
+def format_contexts(response) -> List[Dict]:
     ret_list = []
     for ctx in response.contexts.contexts:
-        ret_list.append({
+        item = {
             "text": ctx.text,
             "score": ctx.score,
             "source_uri": ctx.source_uri
-        })
+        }
+        # Source-code chunks name their file:line range; surface it for traceability
+        locations = code_chunker.locate_in_text(ctx.text)
+        if locations:
+            item["locations"] = locations
+        ret_list.append(item)
 
     return ret_list
 
+# --- RETRIEVAL LANES AND SHARDS (see lanes.py, shards.py) ---
+def _lane_file_ids_from_firestore() -> Dict[Tuple[Optional[str], str], Set[str]]:
+    sets: Dict[Tuple[Optional[str], str], Set[str]] = {}
+    for doc in db.collection(FIRESTORE_COLLECTION).select(["type", "tenant", "rag_file_ids"]).stream():
+        data = doc.to_dict() or {}
+        sets.setdefault((data.get("tenant"), data.get("type")), set()).update(data.get("rag_file_ids") or [])
+    return sets
+
+def _load_corpus_handles() -> Dict[str, object]:
+    """Every RAG corpus of the project, by display name and by resource name, from one list_corpora."""
+    handles = {}
+    for corpus in admission.admitted(admission.rag, rag.list_corpora):
+        handles[corpus.display_name] = handles[corpus.name] = corpus
+    return handles
+
+def _load_shard_table() -> List[Dict]:
+    table = []
+    for doc in db.collection(shards.RAG_SHARDS_COLLECTION).stream():
+        shard = doc.to_dict() or {}
+        name = shard.get("rag_corpus") or ""
+        corpus = _corpus_handles.get().get(name) if "/ragCorpora/" not in name else None
+        if corpus is not None:
+            shard["rag_corpus"] = corpus.name
+        elif "/ragCorpora/" not in name:
+            print(f"Warning: shard '{doc.id}' names no known RAG corpus ('{name}'); ignoring it.")
+            continue
+        table.append(shard)
+    return table
+
+_lane_files = lanes.FileIdSets(_lane_file_ids_from_firestore)
+_corpus_handles = Refreshing(_load_corpus_handles, shards.CORPUS_HANDLES_TTL_SECONDS)
+_shard_table = Refreshing(_load_shard_table, shards.SHARD_TABLE_TTL_SECONDS)
+_lane_executor = ThreadPoolExecutor(max_workers=lanes.RAG_LANE_WORKERS, thread_name_prefix="rag-lane")
+
+def route_corpus(corpus_data: Dict) -> str:
+    """The backing RAG corpus that new files of this corpus document go to (see shards.py)."""
+    try:
+        table = _shard_table.get()
+    except Exception as e:
+        print(f"Warning: could not read the shard routing table, using the master corpus: {e}")
+        table = []
+    return shards.route(corpus_data, table, MASTER_RAG_CORPUS)
+
+def _lane_plan() -> Optional[List[Tuple[lanes.Lane, str, List[str]]]]:
+    """
+    (lane, backing corpus, file ids) for each shard holding files of a lane that the current tenant
+    may search, or None if the ids cannot be read.
+    """
+    tenant = tenants.current()
+    try:
+        return [(lane, rag_corpus, file_ids) for lane in lanes.LANES
+                for rag_corpus, file_ids in _lane_files.for_lane(lane, rag_corpora.name, tenant.tag).items()]
+    except Exception as e:
+        if tenant.tag is not None:
+            raise  # The whole corpus includes other tenants' files
+        print(f"Warning: could not read lane file ids, searching the whole corpus: {e}")
+        return None
+
+def _same_embedding_model(rag_corpora: List[str]) -> bool:
+    """True if all of these backing corpora are known to embed with the same model."""
+    try:
+        handles = _corpus_handles.get()
+    except Exception as e:
+        print(f"Warning: could not read the RAG corpora, treating shard scores as not comparable: {e}")
+        return False
+    models = {shards.embedding_model(handles.get(name)) for name in rag_corpora}
+    return len(models) == 1 and None not in models
+
+def _merge_lanes(plan: List[Tuple[lanes.Lane, str, List[str]]], outcomes: List) -> List[Dict]:
+    """
+    Formatted results of each lane, in lane order. A lane's shards are normalized together, each
+    shard's ranking is cut on its own score curve, then the shards are merged on normalized
+    scores. A failed query is left out unless all of them failed.
+    """
+    rankings: Dict[str, List[List[Dict]]] = {}
+    shard_corpora: Dict[str, List[str]] = {}
+    errors = []
+    for (lane, rag_corpus, _), outcome in zip(plan, outcomes):
+        if isinstance(outcome, BaseException):
+            print(f"Retrieval in lane '{lane.name}' of {rag_corpus} failed: {outcome}")
+            metrics.incr(f"lane.{lane.name}.errors")
+            if not isinstance(outcome, (CircuitOpen, AdmissionRejected)):
+                _lane_files.invalidate()  # e.g. a file deleted since the ids were read
+            errors.append(outcome)
+            continue
+        rankings.setdefault(lane.name, []).append(format_contexts(outcome))
+        shard_corpora.setdefault(lane.name, []).append(rag_corpus)
+    if plan and len(errors) == len(plan):
+        raise errors[0]
+
+    results = []
+    for lane in lanes.LANES:
+        lane_rankings = rankings.get(lane.name) or []
+        if len(lane_rankings) > 1:
+            shards.normalize(lane_rankings, adaptive.RAG_SCORE_IS_DISTANCE, _same_embedding_model(shard_corpora[lane.name]))
+        if adaptive.ADAPTIVE_TOPK:
+            lane_rankings = [adaptive.apply(ranking, lane) for ranking in lane_rankings]
+        if len(lane_rankings) > 1:
+            lane_results = shards.gather(lane_rankings, lane.max_k if adaptive.ADAPTIVE_TOPK else lane.top_k)
+        else:
+            lane_results = lane_rankings[0] if lane_rankings else []
+        results.extend({**item, "lane": lane.name} for item in lane_results)
+    return results
+
+def search_lanes(rag_query: str) -> List[Dict]:
+    """
+    Retrieval for `rag_query` in every lane and shard at once (blocking). Results carry their "lane".
+    """
+    plan = _lane_plan()
+    if plan is None:
+        return format_contexts(retrieval_query(rag_query))
+    futures = [_lane_executor.submit(contextvars.copy_context().run, retrieval_query, rag_query, lane, file_ids,
+                                     rag_corpus)
+               for lane, rag_corpus, file_ids in plan]
+    outcomes = []
+    for future in futures:
+        try:
+            outcomes.append(future.result())
+        except Exception as e:
+            outcomes.append(e)
+    return _merge_lanes(plan, outcomes)
+
+async def search_lanes_async(rag_query: str) -> List[Dict]:
+    """search_lanes on the event loop."""
+    plan = _lane_plan() if _lane_files.fresh else await asyncio.to_thread(_lane_plan)
+    if plan is None:
+        return format_contexts(await retrieval_query_async(rag_query))
+    outcomes = await asyncio.gather(*(retrieval_query_async(rag_query, lane, file_ids, rag_corpus)
+                                      for lane, rag_corpus, file_ids in plan), return_exceptions=True)
+    return _merge_lanes(plan, list(outcomes))
+
+# --- STREAMING /rag ---
+# stream_regulations yields these events, in this order (documented for clients in README.md):
+#   {"event": "raw", "query", "results"}                       retrieval for the requirement as written
+#   {"event": "queries", "queries"}                            sub-queries from the enhancement
+#   {"event": "subquery", "index", "query", "results"}         one per sub-query, in completion order
+#   {"event": "fused", "results"}                              all rankings merged by reciprocal rank fusion
+#   {"event": "error", "message", "retry_after"}               only if the service shed the request
+#   {"event": "done", "degraded", "elapsed_ms"}                always last
+# "results" items have the /rag shape; fused items add "fused_score" and "matched_queries".
+
+def split_subqueries(enhanced_query: str) -> List[str]:
+    queries = [q.strip().strip('"') for q in enhanced_query.split(";")]
+    return [q for q in queries if q][:RAG_STREAM_MAX_SUBQUERIES]
+
+def fuse_rankings(rankings: List[List[Dict]], k: int = RRF_K, limit: int = top_k_chunks) -> List[Dict]:
+    """Reciprocal rank fusion: a chunk scores sum(1 / (k + rank)) over the rankings it appears in."""
+    fused: Dict[str, Dict] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            key = hashlib.sha256(item["text"].encode('utf-8')).hexdigest()
+            entry = fused.setdefault(key, {**item, "fused_score": 0.0, "matched_queries": 0})
+            entry["fused_score"] += 1 / (k + rank)
+            entry["matched_queries"] += 1
+    best = sorted(fused.values(), key=lambda e: e["fused_score"], reverse=True)[:limit]
+    for entry in best:
+        entry["fused_score"] = round(entry["fused_score"], 6)
+    return best
+
+def retrieve_query(query: str) -> Tuple[List[Dict], List[str]]:
+    """One retrieval of `query` as written. Upstream trouble becomes a degraded flag, not an exception."""
+    try:
+        results = deadline.call("retrieval", _retrieval_hedge.call, search_lanes, query)
+    except DeadlineExceeded:
+        return [], ["retrieval_timeout"]
+    except CircuitOpen:
+        return [], ["retrieval_unavailable"]
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        print(f"An error occurred during streamed retrieval: {e}")
+        return [], ["retrieval_error"]
+    fallback_index().add_results(results)
+    return results, []
+
+async def _stream_retrieval_async(query: str) -> Tuple[List[Dict], List[str]]:
+    try:
+        results = await deadline.call_async("retrieval", _retrieval_hedge.call_async, search_lanes_async, query)
+    except DeadlineExceeded:
+        return [], ["retrieval_timeout"]
+    except CircuitOpen:
+        return [], ["retrieval_unavailable"]
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        print(f"An error occurred during streamed retrieval: {e}")
+        return [], ["retrieval_error"]
+    fallback_index().add_results(results)
+    return results, []
+
+def _stream_enhancement(software_requirement: str) -> Tuple[str, List[str]]:
+    key, degraded = rag_request_key(software_requirement), []
+    try:
+        enhanced_query = deadline.call("enhancement", _enhancement_hedge.call, enhance_query,
+                                       get_enhancement_prompt(software_requirement), share=ENHANCEMENT_BUDGET_SHARE)
+        _enhancement_cache.put(key, enhanced_query)
+        return enhanced_query, degraded
+    except DeadlineExceeded:
+        return "", ["enhancement_timeout"]
+    except CircuitOpen:
+        return cached_enhancement(key, degraded), degraded
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        print(f"An error occurred during query enhancement: {e}")
+        return "", ["enhancement_error"]
+
+async def _stream_enhancement_async(software_requirement: str) -> Tuple[str, List[str]]:
+    key, degraded = rag_request_key(software_requirement), []
+    try:
+        enhanced_query = await deadline.call_async("enhancement", _enhancement_hedge.call_async, enhance_query_async,
+                                                   get_enhancement_prompt(software_requirement),
+                                                   share=ENHANCEMENT_BUDGET_SHARE)
+        _enhancement_cache.put(key, enhanced_query)
+        return enhanced_query, degraded
+    except DeadlineExceeded:
+        return "", ["enhancement_timeout"]
+    except CircuitOpen:
+        return cached_enhancement(key, degraded), degraded
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        print(f"An error occurred during query enhancement: {e}")
+        return "", ["enhancement_error"]
+
+def _stream_raw_event(software_requirement: str, results: List[Dict], flags: List[str]) -> Tuple[Dict, List[str]]:
+    if not results and flags:
+        results, flags = fallback_results(rag_request_key(software_requirement), software_requirement, flags,
+                                          _stream_result_cache)
+    return {"event": "raw", "query": software_requirement, "results": results}, flags
+
+def _stream_done(degraded: List[str], started: float) -> Dict:
+    return {"event": "done", "degraded": list(dict.fromkeys(degraded)),
+            "elapsed_ms": round((time.monotonic() - started) * 1000)}
+
+def stream_regulations(software_requirement: str) -> Iterator[Dict]:
+    """
+    retrieve_regulations as a stream of events (see the table above). The raw requirement is
+    retrieved while the enhancement runs, so the first results arrive after one retrieval.
+    """
+    started, degraded, rankings = time.monotonic(), [], []
+
+    def submit(fn, *args):
+        # Runs with this request's deadline
+        return _stream_executor.submit(contextvars.copy_context().run, fn, *args)
+
+    raw, enhancement = submit(retrieve_query, software_requirement), submit(_stream_enhancement, software_requirement)
+    futures = {}
+    try:
+        event, flags = _stream_raw_event(software_requirement, *raw.result())
+        degraded += flags
+        rankings.append(event["results"])
+        yield event
+
+        enhanced_query, flags = enhancement.result()
+        degraded += flags
+        queries = split_subqueries(enhanced_query)
+        yield {"event": "queries", "queries": queries}
+
+        futures.update({submit(retrieve_query, q): i for i, q in enumerate(queries)})
+        for future in as_completed(futures):
+            results, flags = future.result()
+            degraded += flags
+            rankings.append(results)
+            yield {"event": "subquery", "index": futures[future], "query": queries[futures[future]], "results": results}
+
+        fused = fuse_rankings(rankings)
+        if fused:
+            _stream_result_cache.put(rag_request_key(software_requirement), fused)
+        yield {"event": "fused", "results": fused}
+    except AdmissionRejected as e:
+        yield {"event": "error", "message": f"Service is busy ({e}). Retry later.", "retry_after": e.retry_after}
+    finally:
+        # Also on client disconnect (GeneratorExit); calls already running finish on their own
+        for future in [raw, enhancement, *futures]:
+            future.cancel()
+    yield _stream_done(degraded, started)
+
+async def stream_regulations_async(software_requirement: str) -> AsyncIterator[Dict]:
+    """stream_regulations for the ASGI app. Retrievals still running when the client goes away are cancelled."""
+    started, degraded, rankings = time.monotonic(), [], []
+
+    async def indexed(i, q):
+        return i, await _stream_retrieval_async(q)
+
+    raw = asyncio.ensure_future(_stream_retrieval_async(software_requirement))
+    enhancement = asyncio.ensure_future(_stream_enhancement_async(software_requirement))
+    tasks = [raw, enhancement]
+    try:
+        event, flags = _stream_raw_event(software_requirement, *await raw)
+        degraded += flags
+        rankings.append(event["results"])
+        yield event
+
+        enhanced_query, flags = await enhancement
+        degraded += flags
+        queries = split_subqueries(enhanced_query)
+        yield {"event": "queries", "queries": queries}
+
+        tasks += [asyncio.ensure_future(indexed(i, q)) for i, q in enumerate(queries)]
+        for next_done in asyncio.as_completed(tasks[2:]):
+            i, (results, flags) = await next_done
+            degraded += flags
+            rankings.append(results)
+            yield {"event": "subquery", "index": i, "query": queries[i], "results": results}
+
+        fused = fuse_rankings(rankings)
+        if fused:
+            _stream_result_cache.put(rag_request_key(software_requirement), fused)
+        yield {"event": "fused", "results": fused}
+    except AdmissionRejected as e:
+        yield {"event": "error", "message": f"Service is busy ({e}). Retry later.", "retry_after": e.retry_after}
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield _stream_done(degraded, started)
+
 # --- UTILITY FUNCTIONS ---
 def fetch_webpage_selenium(url, PROCESSED_URLS):
     if url in PROCESSED_URLS:
@@ -263,9 +798,11 @@ def fetch_webpage_selenium(url, PROCESSED_URLS):
         return None
     PROCESSED_URLS.add(url)
     
-    driver.get(url)
-    time.sleep(1)
-    return driver.page_source
+    check_cancelled()
+    with browser_lease():
+        driver.get(url)
+        time.sleep(1)
+        return driver.page_source
 
 def extract_hyperlinks(soup: BeautifulSoup, BASE_URL) -> List[Dict[str, str]]:
     """Extracts anchor text and converts hrefs to absolute URLs."""
@@ -356,11 +893,16 @@ def find_regulatory_links_structured(url: str):
     print("-> Sending context to LLM for structured link identification...")
     
     try:
-        response = client.models.generate_content(
+        check_cancelled()
+        tenants.current().check_budget()
+        response = admission.admitted(
+            admission.gemini,
+            client.models.generate_content,
             model='gemini-2.5-flash',
             contents=[prompt],
             config=generation_config # Pass the configuration here
         )
+        tenants.current().charge(response)
     
         # 3. LLM Output Parsing is now guaranteed to be JSON according to the schema
         
@@ -397,6 +939,7 @@ def find_regulatory_links_structured(url: str):
         # 4. Final Verification: Check if the links are actually PDFs
         final_pdf_links = []
         for link in potential_links:
+            check_cancelled()
             # Assumes get_content_type(url) is available
             if check_pdf(link):
                 final_pdf_links.append(link)
@@ -404,6 +947,8 @@ def find_regulatory_links_structured(url: str):
         
         return final_pdf_links
 
+    except (JobCancelled, AdmissionRejected):
+        raise
     except Exception as e:
         print(f"An error occurred during LLM generation or parsing: {e}")
         return []
@@ -449,36 +994,25 @@ def check_pdf(url: str) -> bool:
     if not driver: return False # Safety check if driver failed init
     if url.lower().endswith(('.html', '.htm', '.php', '.aspx')): return False
     
-    initial_files = set(os.listdir(pdf_temp_save_path))
-    try:
-        driver.get(url)
-        # Give some time for the potential download to start
-        time.sleep(3) 
-    except Exception as e:
-        print(f"Error accessing URL via Selenium: {e}")
-        return False
-        
-    current_files = set(os.listdir(pdf_temp_save_path))
-    new_files = current_files - initial_files
+    check_cancelled()
+    with browser_lease():
+        downloads = job_workspace()
+        initial_files = set(os.listdir(downloads))
+        try:
+            driver.get(url)
+            # Give some time for the potential download to start
+            jobs.current_token().wait(3)
+        except Exception as e:
+            print(f"Error accessing URL via Selenium: {e}")
+            return False
+            
+        current_files = set(os.listdir(downloads))
+        new_files = current_files - initial_files
+    check_cancelled()
     
     return True if new_files else False
 
 
-def get_corpus_id_by_display_name(display_name: str) -> str:
-    """Finds a Vertex AI RAG Corpus ID given its display name."""
-    try:
-        corpora_pager = rag.list_corpora()
-        for corpus in corpora_pager:
-            if corpus.display_name == display_name:
-                # Extract the corpus ID (the last segment of the resource name)
-                full_name = corpus.name
-                match = re.search(r'ragCorpora/(\d+)', full_name)
-                return match.group(1) if match else full_name.split('/')[-1]
-        return ""
-    except Exception as e:
-        print(f"An error occurred while listing corpora: {e}")
-        return ""
-
 def upload_parent_directory(parent_dir: str, gcs_destination_folder: str = "") -> Tuple[List[str], List[str]]:
     """Uploads content of a local directory to GCS and computes checksums."""
     if not os.path.isdir(parent_dir):
@@ -523,189 +1057,635 @@ def upload_parent_directory(parent_dir: str, gcs_destination_folder: str = "") -
     print(f"Synchronous upload complete. {len(gcs_uris)} files uploaded and local 'temp/' cleaned.")
     return gcs_uris, checksums
 
-def import_files_to_corpus(corpus_name: str, gcs_uris: List[str]):
+def chunking_for(corpus_data: Optional[Dict]) -> Dict[str, int]:
+    """The corpus document's chunk settings, falling back to the service defaults."""
+    chunking = (corpus_data or {}).get("chunking") or {}
+    return {
+        "chunk_size": int(chunking.get("chunk_size", DEFAULT_CHUNK_SIZE)),
+        "chunk_overlap": int(chunking.get("chunk_overlap", DEFAULT_CHUNK_OVERLAP)),
+    }
+
+def transformation_config_for(chunking: Optional[Dict] = None) -> TransformationConfig:
+    chunking = chunking or chunking_for(None)
+    return TransformationConfig(
+        chunking_config=ChunkingConfig(chunk_size=chunking["chunk_size"], chunk_overlap=chunking["chunk_overlap"])
+    )
+
+def import_files_to_corpus(corpus_name: str, gcs_uris: List[str], chunking: Optional[Dict] = None,
+                           rag_corpus: Optional[str] = None):
     print(f"importing to RAG Corpus: {corpus_name}")
-    import_operation = rag.import_files(
-        corpus_name=MASTER_RAG_CORPUS,
+    import_operation = admission.admitted(
+        admission.rag,
+        rag.import_files,
+        corpus_name=rag_corpus or MASTER_RAG_CORPUS,
         paths=gcs_uris,
-        transformation_config=TransformationConfig(
-            chunking_config=ChunkingConfig(chunk_size=1024, chunk_overlap=200)
-        ),
+        transformation_config=transformation_config_for(chunking),
     )
         
     rag_file_resource_names = [file.name for file in import_operation.imported_rag_files]
     return rag_file_resource_names
 
+# --- PARALLEL / BULK INGESTION ---
+
+def _is_quota_error(e: Exception) -> bool:
+    """True for 429 / RESOURCE_EXHAUSTED style errors from Vertex AI."""
+    if isinstance(e, (ResourceExhausted, TooManyRequests)):
+        return True
+    if getattr(e, "code", None) == 429:
+        return True
+    message = str(e).lower()
+    return "429" in message or "quota" in message or "resource_exhausted" in message
+
+def call_with_backoff(fn, *args, max_retries: int = UPLOAD_MAX_RETRIES, base_delay: float = UPLOAD_BACKOFF_BASE, **kwargs):
+    """
+    Calls fn(*args, **kwargs), retrying quota errors with full-jitter exponential backoff.
+    Any other error is raised immediately.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if not _is_quota_error(e) or attempt >= max_retries:
+                raise
+            delay = random.uniform(0, base_delay * (2 ** attempt))
+            attempt += 1
+            print(f"Quota error ({e.__class__.__name__}), retry {attempt}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+def delete_rag_files(rag_file_ids: List[str]) -> List[str]:
+    """
+    Deletes RAG files from whichever corpus holds them, logging (not raising) individual failures.
+    Inside a job, deletes wait for a background slot, even once the job is cancelled (they are its
+    cleanup), and rejected ones are retried up to DELETE_ADMISSION_ATTEMPTS times. Returns the ids
+    that were never admitted: they still exist, so the caller has to keep them on record.
+    """
+    token = jobs.current_token()
+    cleanup = jobs.CancelToken(token.job_id, token.kind) if jobs.in_job() else None
+    not_admitted = []
+    for file_id in rag_file_ids:
+        for attempt in range(1, DELETE_ADMISSION_ATTEMPTS + 1):
+            try:
+                with jobs.running_as(cleanup or token):
+                    admission.admitted(admission.rag, rag.delete_file, file_id)
+                print(f"Deleted RAG File: {file_id}")
+            except AdmissionRejected as e:
+                if cleanup is not None and attempt < DELETE_ADMISSION_ATTEMPTS:
+                    time.sleep(e.retry_after)
+                    continue
+                print(f"Warning: RAG File {file_id} was not deleted: {e}")
+                not_admitted.append(file_id)
+            except Exception as e:
+                print(f"Warning: Could not delete RAG File {file_id}. Error: {e}")
+            break
+    return not_admitted
+
+def keep_files_on_record(doc_ref, not_deleted: List[str]):
+    """
+    After delete_rag_files: if some files were not admitted, the corpus document is left pointing
+    at just those, and AdmissionRejected is raised (a 429 for the request that deleted) instead of
+    the caller dropping the last record of them.
+    """
+    if not not_deleted:
+        return
+    doc_ref.update({"rag_file_ids": not_deleted})
+    raise AdmissionRejected(f"{len(not_deleted)} RAG files could not be deleted yet; try again later", 30)
+
+def file_md5(path: str) -> str:
+    """Computes the MD5 checksum of a local file in 1 MiB blocks."""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+def upload_single_file(path: str, display_name: str, chunking: Optional[Dict] = None,
+                       rag_corpus: Optional[str] = None, description: Optional[str] = None) -> Tuple[str, float]:
+    """Uploads one file to `rag_corpus` (the master corpus by default). Returns (rag_file_id, seconds taken)."""
+    start = time.perf_counter()
+    rag_file_response = call_with_backoff(
+        admission.admitted,
+        admission.rag,
+        rag.upload_file,
+        corpus_name=rag_corpus or MASTER_RAG_CORPUS,
+        path=path,
+        display_name=display_name,
+        description=description or "Uploaded via Python SDK example.",
+        transformation_config=transformation_config_for(chunking),
+    )
+    return rag_file_response.name, time.perf_counter() - start
+
+def upload_files_by_path(paths: List[str], display_name: str, max_in_flight: int = UPLOAD_CONCURRENCY,
+                         chunking: Optional[Dict] = None, rag_corpus: Optional[str] = None,
+                         description: Optional[str] = None) -> Dict[str, str]:
+    """
+    Uploads files with rag.upload_file, keeping at most `max_in_flight` calls running.
+    Failed files are logged and skipped. Returns {path: rag_file_id} for the files that made it.
+    """
+    if not paths:
+        return {}
+
+    batch_start = time.perf_counter()
+    token = jobs.current_token()
+    results: Dict[str, str] = {}
+
+    def upload(pth):
+        token.check()  # Queued uploads of a cancelled job never start
+        with jobs.running_as(token):  # ...and count against the job's (background) admission lane
+            return upload_single_file(pth, display_name, chunking, rag_corpus, description)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as executor:
+        futures = {executor.submit(upload, pth): pth for pth in paths}
+        for future in as_completed(futures):
+            pth = futures[future]
+            try:
+                rag_file_id, elapsed = future.result()
+                results[pth] = rag_file_id
+                print(f"  -> Uploaded {os.path.basename(pth)} in {elapsed:.1f}s")
+            except (JobCancelled, JobAbandoned):
+                pass
+            except Exception as e:
+                print(f"Error uploading {pth} to corpus: {e}")
+
+    if token.cancelled:
+        # Also when abandoned: nothing records these files, so the new owner would never find them
+        print(f"Upload cancelled; deleting the {len(results)} files already uploaded.")
+        delete_rag_files(list(results.values()))
+        token.check()
+
+    print(f"Uploaded {len(results)}/{len(paths)} files in {time.perf_counter() - batch_start:.1f}s "
+          f"({max_in_flight} in flight).")
+    return results
+
+def stage_files_to_gcs(paths: List[str], gcs_destination_folder: str, workers: int = GCS_UPLOAD_WORKERS) -> List[str]:
+    """Uploads local files to GCS in parallel with transfer_manager. Returns the gs:// URIs that succeeded."""
+    if not paths:
+        return []
+    if not gcs_destination_folder.endswith('/'):
+        gcs_destination_folder += '/'
+
+    bucket = storage_client.bucket(BUCKET_NAME)
+    filenames = [os.path.basename(pth) for pth in paths]
+
+    start = time.perf_counter()
+    results = transfer_manager.upload_many(
+        [(pth, bucket.blob(gcs_destination_folder + filename)) for pth, filename in zip(paths, filenames)],
+        max_workers=workers,
+    )
+
+    gcs_uris = []
+    for filename, result in zip(filenames, results):
+        if isinstance(result, Exception):
+            print(f"Error staging {filename} to GCS: {result}")
+        else:
+            gcs_uris.append(f'gs://{BUCKET_NAME}/{gcs_destination_folder}{filename}')
+    print(f"Staged {len(gcs_uris)}/{len(paths)} files to gs://{BUCKET_NAME}/{gcs_destination_folder} "
+          f"in {time.perf_counter() - start:.1f}s")
+    return gcs_uris
+
+def list_rag_files(rag_corpus: Optional[str] = None) -> List:
+    """Every RAG file in `rag_corpus` (the master corpus by default); all pages are fetched inside the admission slot."""
+    return admission.admitted(admission.rag, lambda: list(rag.list_files(corpus_name=rag_corpus or MASTER_RAG_CORPUS)))
+
+def _source_uris(rag_file) -> Set[str]:
+    return set(getattr(getattr(rag_file, "gcs_source", None), "uris", []) or [])
+
+def _rag_file_ids_for_uris(gcs_uris: List[str], rag_corpus: Optional[str] = None) -> Dict[str, str]:
+    """Looks up the RAG file resources created by an import from their GCS source URIs. Returns {uri: rag_file_id}."""
+    by_name = {uri.rsplit('/', 1)[-1]: uri for uri in gcs_uris}
+    found = {}
+    for rag_file in list_rag_files(rag_corpus):
+        source_uris = _source_uris(rag_file)
+        for uri in source_uris & set(gcs_uris) or ([by_name[rag_file.display_name]]
+                                                    if not source_uris and rag_file.display_name in by_name else []):
+            found[uri] = rag_file.name
+    return found
+
+def bulk_import_via_gcs(paths: List[str], corpus_name: str, chunking: Optional[Dict] = None,
+                        rag_corpus: Optional[str] = None) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Stages files to GCS in parallel, then issues a single rag.import_files for all of them.
+    Returns ({path: rag_file_id} for the files that made it, gcs_uris).
+    """
+    gcs_uris = stage_files_to_gcs(paths, corpus_name)
+    if not gcs_uris:
+        return {}, []
+    check_cancelled()
+
+    start = time.perf_counter()
+    call_with_backoff(
+        admission.admitted,
+        admission.rag,
+        rag.import_files,
+        corpus_name=rag_corpus or MASTER_RAG_CORPUS,
+        paths=gcs_uris,
+        transformation_config=transformation_config_for(chunking),
+    )
+    by_uri = _rag_file_ids_for_uris(gcs_uris, rag_corpus)
+    prefix = f"gs://{BUCKET_NAME}/{corpus_name.rstrip('/')}/"
+    results = {pth: by_uri[prefix + os.path.basename(pth)] for pth in paths if prefix + os.path.basename(pth) in by_uri}
+    print(f"Imported {len(results)} files into corpus in {time.perf_counter() - start:.1f}s")
+    return results, gcs_uris
+
+def preprocess_for_upload(pdf_paths: List[str], chunking: Optional[Dict] = None) -> Tuple[List[str], List[Dict]]:
+    """
+    Replaces PDFs with their pre-chunked text (see pdf_preprocess). PDFs without usable text
+    are kept as-is. Returns (paths to upload, page/section maps for the corpus document).
+    """
+    if not PDF_PREPROCESS or not pdf_paths:
+        return pdf_paths, []
+    check_cancelled()
+
+    chunking = chunking or chunking_for(None)
+    reports = pdf_preprocess.preprocess_pdfs(pdf_paths, os.path.join(job_workspace(), "preprocessed"),
+                                             chunk_size=chunking["chunk_size"], chunk_overlap=chunking["chunk_overlap"])
+    upload_paths = [r["text_path"] or r["source"] for r in reports]
+    section_maps = [{
+        "source": os.path.basename(r["source"]),
+        "uploaded_as": os.path.basename(r["text_path"] or r["source"]),
+        "sections": r["sections"],
+        "original_bytes": r["original_bytes"],
+        "uploaded_bytes": r["output_bytes"] if r["text_path"] else r["original_bytes"],
+        "chunks_before": r["chunks_before"],
+        "chunks_after": r["chunks_after"] if r["text_path"] else r["chunks_before"],
+    } for r in reports]
+
+    before = sum(m["original_bytes"] for m in section_maps)
+    after = sum(m["uploaded_bytes"] for m in section_maps)
+    print(f"Pre-chunking reduced upload from {before} to {after} bytes "
+          f"(~{sum(m['chunks_before'] for m in section_maps)} -> ~{sum(m['chunks_after'] for m in section_maps)} chunks)")
+    return upload_paths, section_maps
+
+def ingest_files(paths: List[str], corpus_name: str, bulk_threshold: int = BULK_IMPORT_THRESHOLD,
+                 chunking: Optional[Dict] = None,
+                 rag_corpus: Optional[str] = None) -> Tuple[List[str], List[str], List[str], List[Dict]]:
+    """
+    Pushes local PDFs into `rag_corpus` (the master corpus by default), picking the path by file count:
+    concurrent rag.upload_file below `bulk_threshold`, GCS staging + one import_files at or above it.
+    Checksums are of the original PDFs so update checks keep comparing like with like.
+    `chunking` ({"chunk_size", "chunk_overlap"}) defaults to the service-wide settings.
+    Returns (rag_file_ids, md5_checksums, gcs_uris, section_maps), where the ids, checksums and
+    section maps only cover the files that made it, so a later run retries the others.
+    """
+    checksums = [file_md5(pth) for pth in paths]
+    upload_paths, section_maps = preprocess_for_upload(paths, chunking)
+    if len(upload_paths) >= bulk_threshold:
+        print(f"Bulk importing {len(upload_paths)} files via GCS for {corpus_name}")
+        uploaded, gcs_uris = bulk_import_via_gcs(upload_paths, corpus_name, chunking, rag_corpus)
+    else:
+        print(f"Uploading {len(upload_paths)} files concurrently for {corpus_name}")
+        uploaded, gcs_uris = upload_files_by_path(upload_paths, corpus_name, chunking=chunking, rag_corpus=rag_corpus,
+                                                  description=upload_description(corpus_name)), []
+    kept = [i for i, pth in enumerate(upload_paths) if pth in uploaded]
+    return ([uploaded[upload_paths[i]] for i in kept], [checksums[i] for i in kept], gcs_uris,
+            [section_maps[i] for i in kept] if section_maps else [])
+
+# --- CHECKPOINTS ---
+# A job's progress lives in the corpus document's "checkpoint" field:
+#   {"task": "create" | "update", "stage": ..., "doc_type", "pdf_links",
+#    "downloaded": [{"name", "md5", "gcs_uri", "local_path"}],
+#    "batches": [{"md5s", "rag_file_ids", "gcs_uris", "section_maps"}]}
+# Stages run in CHECKPOINT_STAGES order; a resumed job skips every stage already reached.
+# Downloaded files are copied to gs://BUCKET/checkpoints/<corpus>/ so a restart on another
+# instance (or after temp/ is wiped) does not have to scrape and download them again.
+
+CHECKPOINT_STAGES = ("downloaded", "cleared", "uploading")
+
+def load_checkpoint(corpus_data: Optional[Dict], task: str) -> Dict:
+    """The saved checkpoint for `task`, or a fresh one. Checkpoints of a different task are ignored."""
+    checkpoint = (corpus_data or {}).get("checkpoint") or {}
+    if checkpoint.get("task") != task:
+        return {"task": task, "stage": None, "downloaded": [], "batches": []}
+    return checkpoint
+
+def checkpoint_reached(checkpoint: Dict, stage: str) -> bool:
+    if checkpoint.get("stage") is None:
+        return False
+    return CHECKPOINT_STAGES.index(checkpoint["stage"]) >= CHECKPOINT_STAGES.index(stage)
+
+def save_checkpoint(doc_ref, checkpoint: Dict, stage: Optional[str] = None):
+    """Persists the checkpoint. updated_at doubles as the job heartbeat used to spot stale jobs."""
+    if stage:
+        checkpoint["stage"] = stage
+    doc_ref.update({"checkpoint": checkpoint, "updated_at": firestore.SERVER_TIMESTAMP})
+
+def checkpoint_downloads(doc_ref, checkpoint: Dict, corpus_name: str, paths: List[str], checksums: List[str]):
+    """Copies downloaded files to the checkpoint prefix in GCS and records them with their hashes."""
+    staged = stage_files_to_gcs(paths, f"{CHECKPOINT_PREFIX}/{corpus_name}")
+    staged_by_name = {uri.rsplit('/', 1)[-1]: uri for uri in staged}
+    checkpoint["downloaded"] = [{
+        "name": os.path.basename(pth),
+        "md5": md5,
+        "gcs_uri": staged_by_name.get(os.path.basename(pth)),
+        "local_path": pth,
+    } for pth, md5 in zip(paths, checksums)]
+    save_checkpoint(doc_ref, checkpoint, "downloaded")
+    progress.stage(corpus_name, "downloaded", files_downloaded=len(paths),
+                   bytes_downloaded=sum(os.path.getsize(pth) for pth in paths))
+
+def restore_downloads(checkpoint: Dict, dest_dir: str) -> List[Optional[str]]:
+    """
+    Local paths of the checkpointed files, aligned with checkpoint["downloaded"]. Files no longer
+    on this machine are fetched from GCS into dest_dir; None where neither copy exists.
+    """
+    bucket = storage_client.bucket(BUCKET_NAME)
+    paths = []
+    for entry in checkpoint["downloaded"]:
+        if entry.get("local_path") and os.path.exists(entry["local_path"]) and file_md5(entry["local_path"]) == entry["md5"]:
+            paths.append(entry["local_path"])
+        elif entry.get("gcs_uri"):
+            local_path = os.path.join(dest_dir, entry["name"])
+            bucket.blob(entry["gcs_uri"].replace(f"gs://{BUCKET_NAME}/", "", 1)).download_to_filename(local_path)
+            paths.append(local_path)
+        else:
+            print(f"Warning: {entry['name']} was not checkpointed and is gone; it will be skipped.")
+            paths.append(None)
+    return paths
+
+def upload_description(corpus_name: str) -> str:
+    """The description of the files a corpus job uploads, so a resumed job can find its own."""
+    return f"Uploaded for corpus {corpus_name}"
+
+def discard_unrecorded_uploads(checkpoint: Dict, corpus_name: str):
+    """
+    Deletes the files an earlier run of this job put in the corpus but never recorded in a batch,
+    e.g. because it died between an upload finishing and the checkpoint being saved. Without this
+    the resumed run would upload them again next to the old copies.
+    """
+    recorded = {i for batch in checkpoint["batches"] for i in batch["rag_file_ids"]}
+    prefix = f"gs://{BUCKET_NAME}/{corpus_name}/"
+    orphans = [f.name for f in list_rag_files(checkpoint.get("rag_corpus"))
+               if f.name not in recorded and (getattr(f, "description", None) == upload_description(corpus_name)
+                                              or any(uri.startswith(prefix) for uri in _source_uris(f)))]
+    if orphans:
+        print(f"Resuming {corpus_name}: deleting {len(orphans)} files uploaded after the last checkpoint.")
+        delete_rag_files(orphans)
+
+def ingest_with_checkpoint(doc_ref, checkpoint: Dict, paths: List[Optional[str]], corpus_name: str,
+                           chunking: Optional[Dict] = None) -> Tuple[List[str], List[str], List[str], List[Dict]]:
+    """
+    ingest_files in batches of CHECKPOINT_BATCH_SIZE, recording each batch once it is in the corpus.
+    Files whose checksum is already in a recorded batch are skipped; batches only record the files
+    that made it, so failed ones are retried. Files go to the checkpoint's "rag_corpus" shard, so
+    a resumed job keeps using the shard it started with.
+    Returns (rag_file_ids, md5_checksums, gcs_uris, section_maps) over all batches.
+    """
+    if checkpoint.get("stage") == "uploading":
+        discard_unrecorded_uploads(checkpoint, corpus_name)
+    done = {md5 for batch in checkpoint["batches"] for md5 in batch["md5s"]}
+    pending = [pth for pth, entry in zip(paths, checkpoint["downloaded"]) if pth and entry["md5"] not in done]
+    if done:
+        print(f"Resuming {corpus_name}: {len(done)} files already uploaded, {len(pending)} to go.")
+    progress.stage(corpus_name, "uploading", files_downloaded=len(checkpoint["downloaded"]),
+                   files_total=len(done) + len(pending), files_uploaded=len(done))
+
+    for i in range(0, len(pending), CHECKPOINT_BATCH_SIZE):
+        check_cancelled()
+        batch = pending[i:i + CHECKPOINT_BATCH_SIZE]
+        rag_file_ids, checksums, gcs_uris, section_maps = ingest_files(batch, corpus_name, chunking=chunking,
+                                                                       rag_corpus=checkpoint.get("rag_corpus"))
+        checkpoint["batches"].append({
+            "md5s": checksums,
+            "rag_file_ids": rag_file_ids,
+            "gcs_uris": gcs_uris,
+            "section_maps": section_maps,
+        })
+        save_checkpoint(doc_ref, checkpoint, "uploading")
+        # Only what made it: failed files are retried by a later run and counted then
+        ok = set(checksums)
+        progress.advance(corpus_name, files_uploaded=len(rag_file_ids),
+                         bytes_uploaded=sum(os.path.getsize(pth) for pth in batch if file_md5(pth) in ok))
+
+    batches = checkpoint["batches"]
+    return ([i for b in batches for i in b["rag_file_ids"]], [m for b in batches for m in b["md5s"]],
+            [u for b in batches for u in b["gcs_uris"]], [m for b in batches for m in b["section_maps"]])
+
+def discard_checkpoint_files(corpus_name: str):
+    """Drops the checkpointed downloads in GCS. The checkpoint field itself goes with the final doc update."""
+    delete_directory_gcs(f"{CHECKPOINT_PREFIX}/{corpus_name}")
+
+def abandon_cancelled_job(doc_ref, corpus_name: str, checkpoint: Optional[Dict], previous_rag_file_ids: List[str]):
+    """
+    Reclaims what a cancelled create/update left behind: RAG files and GCS objects of the batches it
+    uploaded, its checkpointed downloads and its own workspace in temp/ (other jobs' are left alone).
+    The corpus keeps `previous_rag_file_ids` (the files it had before an update cleared them), and
+    is marked cancelled.
+    """
+    print(f"--- CANCELLING job for {corpus_name} ---")
+    batches = (checkpoint or {}).get("batches", [])
+    delete_rag_files([i for b in batches for i in b["rag_file_ids"]])
+    # The corpus prefix only holds this run's files once an update has cleared the old ones
+    if any(b["gcs_uris"] for b in batches):
+        delete_directory_gcs(corpus_name)
+    if checkpoint and checkpoint.get("downloaded"):
+        discard_checkpoint_files(corpus_name)
+    discard_job_workspace()
+    doc_ref.update({
+        "checkpoint": firestore.DELETE_FIELD,
+        "processing": False,
+        "embeddings_available": bool(previous_rag_file_ids),
+        "error": "Cancelled",
+        "cancelled_at": firestore.SERVER_TIMESTAMP,
+        "progress": progress.finish(corpus_name, "cancelled", "Cancelled"),
+    })
+    print(f"--- JOB CANCELLED for {corpus_name} ---")
+
 def create_corpus_async_task(corpus_name: str, link: str):
     """
     The long-running task to scrape, download, upload, and create RAG corpus.
+    Resumes from the corpus document's checkpoint if an earlier run got part of the way.
     This runs in a background thread.
     """
-    doc_ref = db.collection(FIRESTORE_COLLECTION).document(corpus_name)
+    doc_ref = leases.document(db.collection(FIRESTORE_COLLECTION).document(corpus_name))
     print(f"--- STARTING ASYNC CREATION for {corpus_name} ---")
+    progress.begin(corpus_name, "create", doc_ref)
+    restore_dir = tempfile.mkdtemp(prefix=f"resume-{corpus_name}-")
+    checkpoint = None
     
     try:
-        # 1. Determine content type and find PDF links
-        is_pdf = check_pdf(link)
-        doc_type = 'pdf' if is_pdf else 'webpage'
-        
-        pdf_links_to_download = [link] if is_pdf else find_regulatory_links_structured(link)
-        
-        # We need to re-run check_pdf on the initial link for non-PDFs 
-        # to trigger the download of the link's content into the 'temp/' folder
-        if not is_pdf:
-            print(f"Scraping links from webpage: {link}")
+        current_data = doc_ref.get().to_dict()
+        chunking = chunking_for(current_data)
+        checkpoint = load_checkpoint(current_data, "create")
+        if checkpoint["stage"]:
+            print(f"Resuming {corpus_name} from checkpoint stage '{checkpoint['stage']}'")
+
+        if not checkpoint_reached(checkpoint, "downloaded"):
+            # 1. Determine content type and find PDF links
+            progress.stage(corpus_name, "scraping")
+            is_pdf = check_pdf(link)
+            checkpoint["doc_type"] = 'pdf' if is_pdf else 'webpage'
+            
             # Note: find_regulatory_links_structured already uses Selenium and downloads 
-            # the found PDFs to 'temp/'. We just need the list of links.
-            pass
+            # the found PDFs to the job's workspace. We just need the list of links.
+            checkpoint["pdf_links"] = [link] if is_pdf else find_regulatory_links_structured(link)
+            progress.update(corpus_name, links_found=len(checkpoint["pdf_links"]))
             
-        # 2. Upload downloaded PDFs (which are now in 'temp/') to GCS and get checksums
-        # gcs_uris, checksums = upload_parent_directory(pdf_temp_save_path, corpus_name)
-        rag_file_ids = []
-        checksums = []
-        for pth in glob.glob(os.path.join(pdf_temp_save_path, "*.pdf")):
-            with open(pth, 'rb') as f:
-                md5_cs = hashlib.md5(f.read()).hexdigest()
-            checksums.append(md5_cs)
-            print(f"Uploading {pth} to corpus")
-            rag_file_response = rag.upload_file(
-                corpus_name=MASTER_RAG_CORPUS,
-                path=pth,
-                display_name=corpus_name, # Use the filename as the display name
-                description="Uploaded via Python SDK example."
-            )
-            rag_file_ids.append(rag_file_response.name)
-        delete_folder_content(pdf_temp_save_path) 
+            pdf_paths = glob.glob(os.path.join(job_workspace(), "*.pdf"))
+            checkpoint_downloads(doc_ref, checkpoint, corpus_name, pdf_paths, [file_md5(pth) for pth in pdf_paths])
+            
+        # 2. Upload the downloaded PDFs, skipping any a previous run already uploaded
+        pdf_paths = restore_downloads(checkpoint, restore_dir)
+        checkpoint.setdefault("rag_corpus", route_corpus({"name": corpus_name, **current_data,
+                                                          "type": checkpoint["doc_type"]}))
+        rag_file_ids, checksums, gcs_uris, section_maps = ingest_with_checkpoint(
+            doc_ref, checkpoint, pdf_paths, corpus_name, chunking)
+        discard_job_workspace()
         
         # 3. Update DB with collected information
         doc_ref.update({
-            "type": doc_type,
-            "pdf_links": pdf_links_to_download,
+            "type": checkpoint["doc_type"],
+            "rag_corpus": checkpoint["rag_corpus"],
+            "pdf_links": checkpoint["pdf_links"],
             "rag_file_ids": rag_file_ids,
             "md5_checksums": checksums,
+            "gcs_uris": gcs_uris,
+            "section_maps": section_maps,
+            "chunking_applied": chunking,
+            "checkpoint": firestore.DELETE_FIELD,
             "processing": False,
-            "rag_file_ids": rag_file_ids,
-            "embeddings_available": True if len(rag_file_ids) else False
+            "embeddings_available": True if len(rag_file_ids) else False,
+            "progress": progress.finish(corpus_name),
         })
+        discard_checkpoint_files(corpus_name)
         
         print(f"--- ASYNC CREATION COMPLETE for {corpus_name}  ---")
         
+    except JobCancelled:
+        abandon_cancelled_job(doc_ref, corpus_name, checkpoint, [])
     except Exception as e:
+        # The checkpoint is kept so a retry picks up where this run stopped
         print(f"Fatal error during async creation of {corpus_name}: {e}")
         doc_ref.update({
             "processing": False,
             "embeddings_available": False,
-            "error": str(e)
+            "error": str(e),
+            "progress": progress.finish(corpus_name, "failed", str(e)),
         })
+    finally:
+        shutil.rmtree(restore_dir, ignore_errors=True)
 
 def update_corpus_async_task(corpus_name: str, link: str):
     """
     The long-running task to re-scrape, check for updates, and re-create RAG corpus.
+    Resumes from the corpus document's checkpoint if an earlier run got part of the way.
     This runs in a background thread.
     """
-    doc_ref = db.collection(FIRESTORE_COLLECTION).document(corpus_name)
+    doc_ref = leases.document(db.collection(FIRESTORE_COLLECTION).document(corpus_name))
     print(f"--- STARTING ASYNC UPDATE for {corpus_name} ---")
+    restore_dir = tempfile.mkdtemp(prefix=f"resume-{corpus_name}-")
+    initial_data, checkpoint = {}, None
+    progress.begin(corpus_name, "update", doc_ref)
 
     try:
-        # 1. Re-check/re-scrape content (downloads new PDFs to 'temp/')
+        # 1. Re-check/re-scrape content (downloads new PDFs to the job's workspace)
         initial_data = doc_ref.get().to_dict()
         if not initial_data:
             print(f"Error: Corpus {corpus_name} not found for update.")
+            progress.finish(corpus_name, "failed", "Corpus not found")
             return
 
-        doc_ref.update({"processing": True, "embeddings_available": False})
-        
-        pdf_links_to_download = []
-        # Execute scraping/download logic based on type
-        if initial_data.get('type') == 'pdf':
-            # For direct PDF links, just check for re-download to 'temp/'
-            check_pdf(link)
-            pdf_links_to_download = [link]
-        else:
-            # For web pages, re-scrape for new links (downloads to 'temp/')
-            pdf_links_to_download = find_regulatory_links_structured(link)
-            
-        # 2. Check if files in 'temp/' are actually new
-        pdfs_paths = glob.glob(os.path.join(pdf_temp_save_path, '*.pdf'))
-        new_checksums_set = set()
-        for pth in pdfs_paths:
-            with open(pth, 'rb') as f:
-                new_checksums_set.add(hashlib.md5(f.read()).hexdigest())
-
-        existing_checksums_set = set(initial_data.get('md5_checksums', []))
+        if (initial_data.get("checkpoint") or {}).get("task") == "create":
+            # Retrying a creation that never finished: pick it up instead of starting over
+            create_corpus_async_task(corpus_name, link)
+            return
 
-        if not new_checksums_set.issubset(existing_checksums_set):
-            print("Checksum mismatch detected or new files found. Proceeding with update.")
-            
+        doc_ref.update({"processing": True, "embeddings_available": False})
+        chunking = chunking_for(initial_data)
+        checkpoint = load_checkpoint(initial_data, "update")
+        if checkpoint["stage"]:
+            print(f"Resuming {corpus_name} from checkpoint stage '{checkpoint['stage']}'")
+
+        if not checkpoint_reached(checkpoint, "downloaded"):
+            progress.stage(corpus_name, "scraping")
+            pdf_links_to_download = []
+            # Execute scraping/download logic based on type
+            if initial_data.get('type') == 'pdf':
+                # For direct PDF links, just check for re-download to the workspace
+                check_pdf(link)
+                pdf_links_to_download = [link]
+            else:
+                # For web pages, re-scrape for new links (downloads to the workspace)
+                pdf_links_to_download = find_regulatory_links_structured(link)
+            progress.update(corpus_name, links_found=len(pdf_links_to_download))
+                
+            # 2. Check if the downloaded files are actually new
+            pdfs_paths = glob.glob(os.path.join(job_workspace(), '*.pdf'))
+            new_checksums = [file_md5(pth) for pth in pdfs_paths]
+
+            existing_checksums_set = set(initial_data.get('md5_checksums', []))
+            # Corpora ingested before per-corpus settings existed used the defaults
+            chunking_changed = chunking != initial_data.get("chunking_applied", chunking_for(None))
+
+            if set(new_checksums).issubset(existing_checksums_set) and not chunking_changed:
+                print('Checksum match or no new content. No update required.')
+                discard_job_workspace()
+                doc_ref.update({"processing": False, "embeddings_available": True,
+                                "progress": progress.finish(corpus_name, "skipped")})
+                print(f"--- ASYNC UPDATE SKIPPED for {corpus_name} ---")
+                return
+
+            print("Checksum mismatch, new files or changed chunking settings detected. Proceeding with update.")
+            checkpoint["pdf_links"] = pdf_links_to_download
+            checkpoint_downloads(doc_ref, checkpoint, corpus_name, pdfs_paths, new_checksums)
+
+        if not checkpoint_reached(checkpoint, "cleared"):
             # 3. Clean up old resources
-            # delete_directory_gcs(corpus_name)    
+            progress.stage(corpus_name, "clearing")
+            if initial_data.get("gcs_uris"):
+                delete_directory_gcs(corpus_name)
     
-            # 4. Upload new content, get new URIs and checksums
-            # new_gcs_uris, final_checksums = upload_parent_directory(pdf_temp_save_path, corpus_name)
             rag_file_ids = initial_data.get("rag_file_ids")
 
             if rag_file_ids:
                 print(f"Deleting {len(rag_file_ids)} RAG Files from the master corpus...")
-                for file_id in rag_file_ids:
-                    try:
-                        # Deletes the file resource from the single master corpus
-                        rag.delete_file(file_id) 
-                        print(f"Deleted RAG File: {file_id}")
-                    except Exception as e:
-                        # Log but continue to ensure GCS/Firestore are cleaned up
-                        print(f"Warning: Could not delete RAG File {file_id}. Error: {e}")
+                # Fails the run (keeping the checkpoint) if any are left, so a retry clears the rest
+                keep_files_on_record(doc_ref, delete_rag_files(rag_file_ids))
             else:
                 print(f"No RAG file IDs found to delete for source {corpus_name}.")           
-                # 5. Create new RAG Corpus and import
-                #
-            rag_file_ids = []
-            checksums = []
-            for pth in glob.glob(os.path.join(pdf_temp_save_path, "*.pdf")):
-                with open(pth, 'rb') as f:
-                    md5_cs = hashlib.md5(f.read()).hexdigest()
-                checksums.append(md5_cs)
-                print(f"Uploading {pth} to corpus")
-                rag_file_response = rag.upload_file(
-                    corpus_name=MASTER_RAG_CORPUS,
-                    path=pth,
-                    display_name=corpus_name, # Use the filename as the display name
-                    description="Uploaded via Python SDK example."
-                )
-                rag_file_ids.append(rag_file_response.name)
-            delete_folder_content(pdf_temp_save_path) 
+            # The old files are gone; don't let a failed run point at them
+            doc_ref.update({"rag_file_ids": [], "gcs_uris": []})
+            save_checkpoint(doc_ref, checkpoint, "cleared")
+        check_cancelled()
+
+        # 4. Upload new content, skipping any a previous run already uploaded
+        pdfs_paths = restore_downloads(checkpoint, restore_dir)
+        checkpoint.setdefault("rag_corpus", route_corpus({"name": corpus_name, **initial_data}))
+        rag_file_ids, checksums, gcs_uris, section_maps = ingest_with_checkpoint(
+            doc_ref, checkpoint, pdfs_paths, corpus_name, chunking)
+        discard_job_workspace()
         
-        # 3. Update DB with collected information
-            doc_ref.update({
-                "pdf_links": pdf_links_to_download,
-                "rag_file_ids": rag_file_ids,
-                "md5_checksums": checksums,
-                "processing": False,
-                "rag_file_ids": rag_file_ids,
-                "embeddings_available": True if len(rag_file_ids) else False
-            })
-    
-            # 6. Final DB update
-            final_data = {
-                "processing": False,
-                "embeddings_available": True,
-                "md5_checksums": list(new_checksums_set),
-            }
-            doc_ref.update(final_data)
-            print(f"--- ASYNC UPDATE COMPLETE for {corpus_name} ---")
-
-        else:
-            print('Checksum match or no new content. No update required.')
-            delete_folder_content(pdf_temp_save_path)
-            doc_ref.update({"processing": False, "embeddings_available": True})
-            print(f"--- ASYNC UPDATE SKIPPED for {corpus_name} ---")
+        # 5. Final DB update
+        doc_ref.update({
+            "rag_corpus": checkpoint["rag_corpus"],
+            "pdf_links": checkpoint["pdf_links"],
+            "rag_file_ids": rag_file_ids,
+            "md5_checksums": checksums,  # Only the files that made it, so the next update retries the rest
+            "gcs_uris": gcs_uris,
+            "section_maps": section_maps,
+            "chunking_applied": chunking,
+            "checkpoint": firestore.DELETE_FIELD,
+            "processing": False,
+            "embeddings_available": True if len(rag_file_ids) else False,
+            "progress": progress.finish(corpus_name),
+        })
+        discard_checkpoint_files(corpus_name)
+        print(f"--- ASYNC UPDATE COMPLETE for {corpus_name} ---")
 
+    except JobCancelled:
+        cleared = checkpoint is not None and checkpoint_reached(checkpoint, "cleared")
+        abandon_cancelled_job(doc_ref, corpus_name, checkpoint,
+                              [] if cleared else (initial_data or {}).get("rag_file_ids") or [])
     except Exception as e:
+        # The checkpoint is kept so a retry picks up where this run stopped
         print(f"Fatal error during async update of {corpus_name}: {e}")
         doc_ref.update({
             "processing": False,
             "embeddings_available": False,
-            "error": str(e)
+            "error": str(e),
+            "progress": progress.finish(corpus_name, "failed", str(e)),
         })
+    finally:
+        shutil.rmtree(restore_dir, ignore_errors=True)
 
 # --- SYNCHRONOUS TASK (Fast enough for API) ---
 
@@ -715,26 +1695,24 @@ def delete_corpus_sync_task(corpus_name: str) -> bool:
     initial_data = doc_ref.get().to_dict()
     
     try:
-        # 1. Delete GCS files
-        # delete_directory_gcs(corpus_name)
+        # 1. Delete GCS files (only present when the corpus went through the bulk import path)
+        if initial_data.get("gcs_uris"):
+            delete_directory_gcs(corpus_name)
+        if initial_data.get("checkpoint"):
+            discard_checkpoint_files(corpus_name)
         rag_file_ids = initial_data.get("rag_file_ids")
 
         if rag_file_ids:
             print(f"Deleting {len(rag_file_ids)} RAG Files from the master corpus...")
-            for file_id in rag_file_ids:
-                try:
-                    # Deletes the file resource from the single master corpus
-                    rag.delete_file(file_id) 
-                    print(f"Deleted RAG File: {file_id}")
-                except Exception as e:
-                    # Log but continue to ensure GCS/Firestore are cleaned up
-                    print(f"Warning: Could not delete RAG File {file_id}. Error: {e}")
+            keep_files_on_record(doc_ref, delete_rag_files(rag_file_ids))
         else:
             print(f"No RAG file IDs found to delete for source {corpus_name}.")           
         
         doc_ref.delete()
         print(f'Firestore record for {corpus_name} deleted.')
         return True
+    except AdmissionRejected:
+        raise
     except Exception as e:
         print(f"Error during synchronous deletion of {corpus_name}: {e}")
         return False
@@ -0,0 +1,163 @@
+"""
+Request deadlines carried through the retrieval pipeline.
+
+A request's deadline lives in a context variable, so every stage below the route sees it
+without extra arguments (threads and asyncio tasks each get their own copy). A stage runs
+under `call` / `call_async` with a share of the time left; if it misses, DeadlineExceeded is
+raised in the caller (the blocking call itself is abandoned on a helper thread) and
+`deadline.<stage>.missed` is counted, so the pipeline can return what it has and flag the
+response as degraded. Code inside a stage registers `on_abandon` hooks to give back what the
+abandoned call still holds, e.g. its admission slot (admission.py).
+
+Clients send the budget as `timeout_ms` in the body or the X-Timeout-Ms header.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from typing import Awaitable, Callable, List, Optional
+
+import metrics
+
+# --- DEADLINE CONFIGURATION ---
+DEFAULT_TIMEOUT_MS = int(os.getenv("RAG_DEFAULT_TIMEOUT_MS", "30000"))
+MAX_TIMEOUT_MS = int(os.getenv("RAG_MAX_TIMEOUT_MS", "120000"))
+STAGE_WORKERS = int(os.getenv("DEADLINE_STAGE_WORKERS", "32"))    # Threads running deadline-bound blocking calls
+TIMEOUT_HEADER = "X-Timeout-Ms"
+DEGRADED_HEADER = "X-Degraded"
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+_executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="deadline-stage")
+
+
+class _AbandonHooks:
+    def __init__(self):
+        self.abandoned = False
+        self._hooks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def add(self, hook: Callable[[], None]) -> Callable[[], None]:
+        with self._lock:
+            if not self.abandoned:
+                self._hooks.append(hook)
+                return lambda: self._remove(hook)
+        hook()  # The stage was already given up on
+        return lambda: None
+
+    def _remove(self, hook: Callable[[], None]):
+        with self._lock:
+            if hook in self._hooks:
+                self._hooks.remove(hook)
+
+    def abandon(self):
+        with self._lock:
+            self.abandoned = True
+            hooks, self._hooks = self._hooks, []
+        for hook in hooks:
+            hook()
+
+
+_abandon_hooks: contextvars.ContextVar[Optional[_AbandonHooks]] = contextvars.ContextVar("abandon_hooks", default=None)
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage: str):
+        super().__init__(f"deadline exceeded during {stage}")
+        self.stage = stage
+
+
+def parse_timeout_ms(headers, body: Optional[dict]) -> float:
+    """Seconds allowed for the request: body `timeout_ms`, then the header, then the default; capped."""
+    raw = (body or {}).get("timeout_ms")
+    if raw is None:
+        raw = headers.get(TIMEOUT_HEADER)
+    try:
+        timeout_ms = int(raw) if raw is not None else DEFAULT_TIMEOUT_MS
+    except (TypeError, ValueError):
+        timeout_ms = DEFAULT_TIMEOUT_MS
+    return max(1, min(timeout_ms, MAX_TIMEOUT_MS)) / 1000
+
+
+@contextmanager
+def scope(seconds: Optional[float]):
+    """Sets the deadline for the block. A deadline already in place is never extended."""
+    current = _deadline.get()
+    new = time.monotonic() + seconds if seconds is not None else None
+    token = _deadline.set(min(filter(None, (current, new)), default=None))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def at() -> Optional[float]:
+    """The deadline as a time.monotonic() value, or None when no deadline is set."""
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    """Seconds left, or None when no deadline is set."""
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def budget(share: float = 1.0) -> Optional[float]:
+    left = remaining()
+    return None if left is None else left * share
+
+
+def on_abandon(hook: Callable[[], None]) -> Callable[[], None]:
+    """
+    Calls `hook` if the `call` stage running this code is abandoned at its deadline (at once if it
+    already was). Returns a function that unregisters the hook, for when the code is done.
+    """
+    hooks = _abandon_hooks.get()
+    return hooks.add(hook) if hooks is not None else (lambda: None)
+
+
+def _run_stage(hooks: _AbandonHooks, fn: Callable, *args, **kwargs):
+    _abandon_hooks.set(hooks)
+    return fn(*args, **kwargs)
+
+
+def _missed(stage: str) -> DeadlineExceeded:
+    metrics.incr(f"deadline.{stage}.missed")
+    print(f"Deadline missed during {stage}")
+    return DeadlineExceeded(stage)
+
+
+def call(stage: str, fn: Callable, *args, share: float = 1.0, **kwargs):
+    """fn(*args, **kwargs) within `share` of the remaining time, else DeadlineExceeded."""
+    timeout = budget(share)
+    if timeout is None:
+        return fn(*args, **kwargs)
+    if timeout <= 0:
+        raise _missed(stage)
+    hooks = _AbandonHooks()
+    forget = on_abandon(hooks.abandon)  # A stage inside an abandoned stage is abandoned too
+    future = _executor.submit(contextvars.copy_context().run, _run_stage, hooks, fn, *args, **kwargs)
+    try:
+        return future.result(timeout)
+    except FutureTimeout:
+        future.cancel()
+        hooks.abandon()
+        raise _missed(stage)
+    finally:
+        forget()
+
+
+async def call_async(stage: str, fn: Callable[..., Awaitable], *args, share: float = 1.0, **kwargs):
+    """await fn(*args, **kwargs) within `share` of the remaining time, else DeadlineExceeded."""
+    timeout = budget(share)
+    if timeout is None:
+        return await fn(*args, **kwargs)
+    if timeout <= 0:
+        raise _missed(stage)
+    try:
+        return await asyncio.wait_for(fn(*args, **kwargs), timeout)
+    except asyncio.TimeoutError:
+        raise _missed(stage)
@@ -0,0 +1,251 @@
+"""
+Hedged calls for the tail latency of /rag.
+
+A hedged call starts normally; if it has not returned after the hedge delay, an identical
+second call is issued and whichever answers first wins. The loser is cancelled when it can be
+(asyncio tasks) and otherwise left to finish with its result ignored (threads). A thread that is
+left running still holds a pool worker, so blocking calls only use the pool (primary and hedge)
+while less than HEDGE_POOL_SHARE of it is busy. Past that a call runs unhedged on its caller's
+thread, so no call queues behind losers.
+
+The hedge delay is a percentile (HEDGE_PERCENTILE, e.g. p95) of a live latency histogram of
+the same call, so only the slowest few percent of calls are ever hedged. Hedges are further
+capped at HEDGE_MAX_RATIO of calls: every call earns that fraction of a hedge credit and a hedge
+spends a whole one, so a slow upstream cannot double our quota usage. Until a histogram has
+HEDGE_MIN_SAMPLES observations nothing is hedged.
+
+Each Hedger counts `hedge.<name>.calls`, `.issued`, `.won`, `.skipped_budget` and
+`.skipped_capacity` in metrics.
+"""
+import asyncio
+import bisect
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import metrics
+
+# --- HEDGING CONFIGURATION ---
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))          # Latency percentile used as the hedge delay
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.05"))          # Most hedges per call, over time
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "50"))          # Observations before hedging starts
+HEDGE_MIN_DELAY_MS = int(os.getenv("HEDGE_MIN_DELAY_MS", "50"))
+HEDGE_DECAY_EVERY = int(os.getenv("HEDGE_DECAY_EVERY", "1000"))        # Halve the histogram after this many samples
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "32"))                  # Threads running hedged blocking calls
+HEDGE_POOL_SHARE = float(os.getenv("HEDGE_POOL_SHARE", "0.5"))         # Busy share of those above which nothing is hedged
+
+# Bucket upper bounds in seconds: 5ms to ~2min, 25% apart
+_BOUNDS: List[float] = [round(0.005 * 1.25 ** i, 4) for i in range(46)]
+
+_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+_busy = 0   # Calls submitted to _executor and not finished, losers included
+_busy_lock = threading.Lock()
+
+
+def _finished(_future):
+    global _busy
+    with _busy_lock:
+        _busy -= 1
+
+
+def _submit(fn: Callable, *args, **kwargs):
+    global _busy
+    with _busy_lock:
+        _busy += 1
+    future = _executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+    future.add_done_callback(_finished)
+    return future
+
+
+def _has_capacity() -> bool:
+    """Room in the pool for one more call without crossing HEDGE_POOL_SHARE."""
+    with _busy_lock:
+        return _busy + 1 <= HEDGE_WORKERS * HEDGE_POOL_SHARE
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed latencies. Counts are halved every HEDGE_DECAY_EVERY samples so the
+    percentiles follow the upstream's current behaviour rather than its whole history.
+    """
+
+    def __init__(self, decay_every: int = HEDGE_DECAY_EVERY):
+        self.decay_every = decay_every
+        self._counts = [0.0] * (len(_BOUNDS) + 1)
+        self._total = 0.0
+        self._since_decay = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(_BOUNDS, seconds)] += 1
+            self._total += 1
+            self._since_decay += 1
+            if self._since_decay >= self.decay_every:
+                self._counts = [c / 2 for c in self._counts]
+                self._total /= 2
+                self._since_decay = 0
+
+    @property
+    def count(self) -> float:
+        return self._total
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Upper bound of the bucket holding the p-th percentile, or None when empty."""
+        with self._lock:
+            if not self._total:
+                return None
+            target = self._total * p / 100
+            seen = 0.0
+            for i, c in enumerate(self._counts):
+                seen += c
+                if seen >= target:
+                    return _BOUNDS[i] if i < len(_BOUNDS) else _BOUNDS[-1]
+            return _BOUNDS[-1]
+
+
+class Hedger:
+    def __init__(self, name: str, percentile: float = HEDGE_PERCENTILE, max_ratio: float = HEDGE_MAX_RATIO,
+                 min_samples: int = HEDGE_MIN_SAMPLES, enabled: bool = HEDGE_ENABLED):
+        self.name = name
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.enabled = enabled
+        self.histogram = LatencyHistogram()
+        self._credit = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None while there is too little data."""
+        if self.histogram.count < self.min_samples:
+            return None
+        return max(self.histogram.percentile(self.percentile), HEDGE_MIN_DELAY_MS / 1000)
+
+    def _earn(self):
+        metrics.incr(f"hedge.{self.name}.calls")
+        with self._lock:
+            # Capped so a quiet period cannot bank a burst of hedges
+            self._credit = min(self._credit + self.max_ratio, 1 + self.max_ratio)
+
+    def _spend(self, blocking: bool = False) -> bool:
+        if blocking and not _has_capacity():
+            metrics.incr(f"hedge.{self.name}.skipped_capacity")
+            return False
+        with self._lock:
+            if self._credit < 1:
+                metrics.incr(f"hedge.{self.name}.skipped_budget")
+                return False
+            self._credit -= 1
+        metrics.incr(f"hedge.{self.name}.issued")
+        return True
+
+    def _timed(self, fn: Callable, *args, **kwargs):
+        started = time.monotonic()
+        result = fn(*args, **kwargs)
+        self.histogram.observe(time.monotonic() - started)
+        return result
+
+    async def _timed_async(self, fn: Callable[..., Awaitable], *args, **kwargs):
+        started = time.monotonic()
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            # A cancelled loser was at least this slow; dropping it would hide the tail
+            self.histogram.observe(time.monotonic() - started)
+            raise
+        self.histogram.observe(time.monotonic() - started)
+        return result
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """fn(*args, **kwargs), hedged once if it is slower than the hedge delay."""
+        delay = self.delay() if self.enabled else None
+        self._earn()
+        if delay is None:
+            return self._timed(fn, *args, **kwargs)
+        if not _has_capacity():
+            # The pool is taken up by losers still running; waiting for a worker would eat the deadline
+            metrics.incr(f"hedge.{self.name}.skipped_capacity")
+            return self._timed(fn, *args, **kwargs)
+
+        primary = _submit(self._timed, fn, *args, **kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._spend(blocking=True):
+            return primary.result()
+
+        hedge = _submit(self._timed, fn, *args, **kwargs)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        metrics.incr(f"hedge.{self.name}.won")
+                    for loser in pending:
+                        loser.cancel()  # Only stops it if not started; otherwise its result is ignored
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    async def call_async(self, fn: Callable[..., Awaitable], *args, **kwargs):
+        """await fn(*args, **kwargs), hedged once if it is slower than the hedge delay. The loser is cancelled."""
+        delay = self.delay() if self.enabled else None
+        self._earn()
+        if delay is None:
+            return await self._timed_async(fn, *args, **kwargs)
+
+        primary = asyncio.ensure_future(self._timed_async(fn, *args, **kwargs))
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self._spend():
+                return await primary
+
+            hedge = asyncio.ensure_future(self._timed_async(fn, *args, **kwargs))
+            pending = {primary, hedge}
+            error = None
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if task is hedge:
+                                metrics.incr(f"hedge.{self.name}.won")
+                            return task.result()
+                        error = error or task.exception()
+                raise error
+            finally:
+                for task in pending:
+                    task.cancel()
+        finally:
+            primary.cancel()  # No-op once it finished; stops it if our caller was cancelled
+
+    def snapshot(self) -> Dict:
+        h = self.histogram
+        return {
+            "enabled": self.enabled,
+            "samples": round(h.count),
+            "p50_ms": _ms(h.percentile(50)),
+            "p99_ms": _ms(h.percentile(99)),
+            "hedge_delay_ms": _ms(self.delay()),
+        }
+
+
+def _ms(seconds: Optional[float]) -> Optional[int]:
+    return None if seconds is None else round(seconds * 1000)
+
+
+_hedgers: Dict[str, Hedger] = {}
+
+
+def hedger(name: str) -> Hedger:
+    """The process-wide Hedger for `name`, created on first use."""
+    return _hedgers.setdefault(name, Hedger(name))
+
+
+def snapshot() -> Dict:
+    return {name: h.snapshot() for name, h in _hedgers.items()}
@@ -0,0 +1,154 @@
+"""
+Registry of running background jobs with cooperative cancellation.
+
+Every ingestion task runs under a CancelToken registered by job id (the corpus document id).
+Long-running code calls `check_cancelled()` between fetches, LLM calls and uploads; once the
+token is cancelled it raises JobCancelled, and the task's handler reclaims what the job held
+(browser lease, partial uploads, workspace files) and marks the corpus document cancelled.
+
+The token of the current job is kept thread-locally, so helpers deep in the call stack can check
+it without every signature taking a token. Worker threads started by a job (e.g. upload pools)
+should capture `current_token()` in the job thread and run under `running_as(token)`.
+A job started by a request runs in a copy of the request's context (e.g. its tenant).
+
+A job whose lease was taken over by another instance (see leases.py) is abandoned instead:
+`check_cancelled()` raises JobAbandoned, which skips the task's cancellation cleanup because the
+checkpoint and uploads it would discard now belong to the new owner.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once its cancellation has been requested."""
+
+
+class JobAbandoned(BaseException):
+    """
+    Raised inside a job that no longer owns its corpus. A BaseException, so the tasks' generic
+    `except Exception` handlers do not record it as a failure on a document that is not theirs.
+    """
+
+
+class CancelToken:
+    def __init__(self, job_id: str = "", kind: str = ""):
+        self.job_id = job_id
+        self.kind = kind
+        self.started_at = time.time()
+        self.abandoned = False
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def abandon(self):
+        self.abandoned = True
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        if self.abandoned:
+            raise JobAbandoned(f"Job {self.job_id} lost its lease")
+        if self._event.is_set():
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+    def wait(self, seconds: float) -> bool:
+        """Sleeps up to `seconds`, waking early on cancellation. Returns True if cancelled."""
+        return self._event.wait(seconds)
+
+
+_NEVER_CANCELLED = CancelToken()
+_jobs: Dict[str, CancelToken] = {}
+_jobs_lock = threading.Lock()
+_local = threading.local()
+
+
+def current_token() -> CancelToken:
+    """The token of the job running on this thread (a token that is never cancelled outside jobs)."""
+    return getattr(_local, "token", None) or _NEVER_CANCELLED
+
+
+def check_cancelled():
+    current_token().check()
+
+
+def in_job() -> bool:
+    return getattr(_local, "token", None) is not None
+
+
+@contextmanager
+def running_as(token: CancelToken):
+    """Runs the block as part of `token`'s job, e.g. inside a worker thread the job started."""
+    previous = getattr(_local, "token", None)
+    _local.token = token if token is not _NEVER_CANCELLED else previous
+    try:
+        yield
+    finally:
+        _local.token = previous
+
+
+def register(job_id: str, kind: str) -> CancelToken:
+    token = CancelToken(job_id, kind)
+    with _jobs_lock:
+        _jobs[job_id] = token
+    return token
+
+
+def _unregister(job_id: str, token: CancelToken):
+    with _jobs_lock:
+        if _jobs.get(job_id) is token:
+            del _jobs[job_id]
+
+
+def run_job(job_id: str, kind: str, fn: Callable, *args, token: Optional[CancelToken] = None):
+    """Runs fn(*args) on this thread as job `job_id`."""
+    token = token or register(job_id, kind)
+    previous = getattr(_local, "token", None)
+    _local.token = token
+    try:
+        return fn(*args)
+    except JobCancelled:
+        # Tasks clean up after themselves; anything that reaches here just stops
+        print(f"Job {job_id} stopped after cancellation.")
+    except JobAbandoned as e:
+        print(f"Job {job_id} stopped: {e}; another instance owns it now.")
+    finally:
+        _local.token = previous
+        _unregister(job_id, token)
+
+
+def start_job(job_id: str, kind: str, fn: Callable, *args) -> threading.Thread:
+    """Registers the job before starting its thread, so it can be cancelled as soon as this returns."""
+    token = register(job_id, kind)
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(run_job, job_id, kind, fn, *args),
+                              kwargs={"token": token}, name=f"job-{job_id[:32]}")
+    thread.start()
+    return thread
+
+
+def cancel(job_id: str) -> bool:
+    """Requests cancellation. Returns False if no job with that id is running in this process."""
+    with _jobs_lock:
+        token = _jobs.get(job_id)
+    if token is None:
+        return False
+    token.cancel()
+    print(f"Cancellation requested for job {job_id}")
+    return True
+
+
+def list_jobs() -> List[Dict]:
+    with _jobs_lock:
+        tokens = list(_jobs.values())
+    return [{
+        "job_id": t.job_id,
+        "kind": t.kind,
+        "running_seconds": round(time.time() - t.started_at, 1),
+        "cancel_requested": t.cancelled,
+    } for t in tokens]
@@ -0,0 +1,93 @@
+"""
+Typed retrieval lanes.
+
+Regulation documents and source code share the master corpus, so one top_k over everything
+lets a large repository crowd the regulations out of the results (and the other way round).
+Each lane searches only the files of its Firestore corpus `type`s, with its own top_k and
+vector distance threshold; the lanes are queried concurrently and every result is tagged with
+its "lane". /rag keeps returning one list, lanes in configured order; with "group_by_lane": true
+it returns {"lanes": {lane: [...]}} instead.
+
+Lanes come from RAG_LANES (JSON), so a new corpus type only needs a new entry:
+
+    {"regulations": {"types": ["pdf", "webpage"], "top_k": 10},
+     "source_code": {"types": ["source code"], "top_k": 5, "vector_distance_threshold": 0.6}}
+
+With adaptive top_k (adaptive.py) a lane may also set "min_k" and "max_k".
+
+A lane's file ids are read from the corpus documents' `rag_file_ids` and kept for
+LANE_FILE_IDS_TTL_SECONDS; a lane with no files is skipped. A tenant's lanes only hold the
+files of its own and the shared corpora (tenants.py). A lane whose files are spread over
+several backing corpora queries each of them (shards.py).
+"""
+import json
+import math
+import os
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import adaptive
+import shards
+from concurrency import Refreshing
+
+DEFAULT_LANES = {
+    "regulations": {"types": ["pdf", "webpage"], "top_k": 10},
+    "source_code": {"types": ["source code"], "top_k": 5},
+}
+
+# --- LANE CONFIGURATION ---
+RAG_LANES = json.loads(os.getenv("RAG_LANES") or json.dumps(DEFAULT_LANES))
+LANE_FILE_IDS_TTL_SECONDS = float(os.getenv("LANE_FILE_IDS_TTL_SECONDS", "60"))   # Then re-read from Firestore
+RAG_LANE_WORKERS = int(os.getenv("RAG_LANE_WORKERS", "32"))                        # Threads for concurrent lane queries
+
+
+class Lane:
+    def __init__(self, name: str, types: List[str], top_k: int, vector_distance_threshold: Optional[float] = None,
+                 min_k: Optional[int] = None, max_k: Optional[int] = None):
+        self.name = name
+        self.types = list(types)
+        self.top_k = int(top_k)
+        self.vector_distance_threshold = vector_distance_threshold
+        # Bounds on the chunks kept when top_k is adaptive (see adaptive.py)
+        self.max_k = int(max_k) if max_k is not None else math.ceil(self.top_k * adaptive.ADAPTIVE_MAX_FACTOR)
+        self.min_k = min(int(min_k) if min_k is not None else adaptive.ADAPTIVE_MIN_CHUNKS, self.max_k)
+
+    @property
+    def fetch_k(self) -> int:
+        """Chunks to request from Vertex RAG."""
+        return self.max_k + adaptive.ADAPTIVE_LOOKAHEAD if adaptive.ADAPTIVE_TOPK else self.top_k
+
+
+LANES: List[Lane] = [Lane(name, **spec) for name, spec in RAG_LANES.items()]
+
+
+class FileIdSets(Refreshing):
+    """
+    The RAG file resource names of each corpus type and owning tenant, from
+    `load()` -> {(tenant or None for shared corpora, type): set of names}.
+    """
+
+    def __init__(self, load: Callable[[], Dict[Tuple[Optional[str], str], Set[str]]],
+                 ttl: float = LANE_FILE_IDS_TTL_SECONDS):
+        super().__init__(load, ttl)
+
+    def for_lane(self, lane: Lane, default_corpus: str, tenant: Optional[str] = None) -> Dict[str, List[str]]:
+        """{backing corpus: file ids} of the lane's files in shared corpora and `tenant`'s (see shards.py)."""
+        sets = self.get()
+        owners = {None, tenant}
+        by_corpus: Dict[str, List[str]] = {}
+        for name in sorted(set().union(*(sets.get((o, t), set()) for o in owners for t in lane.types))):
+            by_corpus.setdefault(shards.corpus_of(name) or default_corpus, []).append(file_id(name))
+        return by_corpus
+
+
+def file_id(rag_file_name: str) -> str:
+    """Firestore stores full RagFile resource names; RagResource filters take the bare id."""
+    return rag_file_name.rsplit("/", 1)[-1]
+
+
+def group(results: List[Dict]) -> Dict[str, List[Dict]]:
+    """{lane: results} for every configured lane, in configured order."""
+    grouped: Dict[str, List[Dict]] = {lane.name: [] for lane in LANES}
+    for item in results:
+        grouped.setdefault(item.get("lane") or "unassigned", []).append(item)
+    return grouped
@@ -0,0 +1,239 @@
+"""
+Leases on corpus documents, so several instances can share ingestion.
+
+With more than one instance, two PUTs for the same corpus could both pass a read-then-write
+`processing` check and run the same update twice. A job now has to hold its corpus document's
+lease, claimed in a Firestore transaction:
+
+    lease_owner       the instance running the job (INSTANCE_ID)
+    lease_expires_at  renewed every JOB_LEASE_HEARTBEAT_SECONDS while the job runs
+    lease_token       fencing token: larger on every claim (also across a delete and re-create),
+                      and kept after release
+
+A document can be claimed while it is not processing or once its lease has expired (the owner
+died without releasing it), so an expired job is picked up by the next PUT, refresh or stale-job
+sweep (recovery_ops.py) on any instance. Documents still processing without a lease, from jobs
+started before leases, are claimable once their `updated_at` is STALE_JOB_SECONDS old.
+
+Every write a job makes to its document goes through `document()`, which checks the lease token
+in the same transaction. A job that lost its lease therefore cannot overwrite the new owner's
+progress; once a fenced write or the heartbeat finds the lease gone, the job stops at its next
+`check_cancelled()` with jobs.JobAbandoned. A cancellation for a job on another instance is left
+on the document as `cancel_requested`, and the owner's heartbeat passes it on to the job.
+"""
+import contextvars
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+from google.api_core.exceptions import Conflict
+from google.cloud import firestore
+
+import jobs
+import metrics
+
+# --- LEASE CONFIGURATION ---
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))                      # Claimable this long after the last renewal
+JOB_LEASE_HEARTBEAT_SECONDS = int(os.getenv("JOB_LEASE_HEARTBEAT_SECONDS", "30"))
+STALE_JOB_SECONDS = int(os.getenv("STALE_JOB_SECONDS", "1800"))                     # For processing documents without a lease
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{os.getenv('K_REVISION', socket.gethostname())}-{uuid.uuid4().hex[:8]}"
+
+_current: contextvars.ContextVar[Optional["Lease"]] = contextvars.ContextVar("lease", default=None)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _transaction(doc_ref):
+    # The document's own client, so this module does not need corpus_operations.db
+    return doc_ref._client.transaction()
+
+
+def available(data: Optional[Dict], now: Optional[datetime] = None, stale_after: int = STALE_JOB_SECONDS) -> bool:
+    """No live job holds the document: it is not processing, or its lease (or heartbeat) ran out."""
+    data, now = data or {}, now or _now()
+    if not data.get("processing"):
+        return True
+    expires = data.get("lease_expires_at")
+    if expires is None:
+        heartbeat = data.get("updated_at") or data.get("created_at")
+        return heartbeat is None or heartbeat < now - timedelta(seconds=stale_after)
+    return expires < now
+
+
+def _next_token(previous: Optional[int]) -> int:
+    return max((previous or 0) + 1, int(time.time() * 1000))
+
+
+def _lease_fields(token: int) -> Dict:
+    return {"lease_owner": INSTANCE_ID, "lease_token": token,
+            "lease_expires_at": _now() + timedelta(seconds=JOB_LEASE_SECONDS)}
+
+
+class Lease:
+    def __init__(self, doc_ref, token: int):
+        self.doc_ref = doc_ref
+        self.token = token
+        self.lost = False
+        self._job: Optional[jobs.CancelToken] = None
+        self._stop = threading.Event()
+
+    def _held(self, data: Optional[Dict]) -> bool:
+        return data is not None and data.get("lease_token") == self.token
+
+    def update(self, fields: Dict):
+        """doc_ref.update(fields), only while this lease is held; also renews it."""
+        @firestore.transactional
+        def write(transaction):
+            if not self._held(self.doc_ref.get(transaction=transaction).to_dict()):
+                return False
+            transaction.update(self.doc_ref, {**fields, **_lease_fields(self.token)})
+            return True
+
+        if not write(_transaction(self.doc_ref)):
+            self._lose()
+            raise jobs.JobAbandoned(f"lease {self.token} on {self.doc_ref.id} is no longer held")
+
+    def renew(self) -> bool:
+        """Extends the lease. False once another claim replaced it; passes on a pending cancellation."""
+        @firestore.transactional
+        def extend(transaction):
+            data = self.doc_ref.get(transaction=transaction).to_dict()
+            if not self._held(data):
+                return None
+            transaction.update(self.doc_ref, _lease_fields(self.token))
+            return data
+
+        data = extend(_transaction(self.doc_ref))
+        if data is None:
+            return False
+        if data.get("cancel_requested") and self._job is not None:
+            self._job.cancel()
+        return True
+
+    def _lose(self):
+        if not self.lost:
+            self.lost = True
+            metrics.incr("leases.lost")
+            print(f"Lease {self.token} on {self.doc_ref.id} was taken over; abandoning the job.")
+        if self._job is not None:
+            self._job.abandon()
+
+    def _heartbeat(self):
+        expires = _now() + timedelta(seconds=JOB_LEASE_SECONDS)
+        while not self._stop.wait(JOB_LEASE_HEARTBEAT_SECONDS):
+            try:
+                if not self.renew():
+                    self._lose()
+                    return
+                expires = _now() + timedelta(seconds=JOB_LEASE_SECONDS)
+            except Exception as e:
+                print(f"Warning: could not renew lease on {self.doc_ref.id}: {e}")
+                if _now() >= expires:
+                    # Others may have claimed it by now; carrying on would risk duplicate work
+                    self._lose()
+                    return
+
+    def release(self):
+        """Gives the lease up (the token stays, so the next claim gets a higher one)."""
+        @firestore.transactional
+        def clear(transaction):
+            if self._held(self.doc_ref.get(transaction=transaction).to_dict()):
+                transaction.update(self.doc_ref, {"lease_owner": firestore.DELETE_FIELD,
+                                                  "lease_expires_at": firestore.DELETE_FIELD})
+
+        if not self.lost:
+            try:
+                clear(_transaction(self.doc_ref))
+            except Exception as e:
+                print(f"Warning: could not release lease on {self.doc_ref.id}; it expires on its own: {e}")
+
+
+class FencedDocument:
+    """A corpus document reference whose updates only apply while the job still holds its lease."""
+
+    def __init__(self, doc_ref, lease: Lease):
+        self._doc_ref = doc_ref
+        self._lease = lease
+
+    def __getattr__(self, name):
+        return getattr(self._doc_ref, name)
+
+    def update(self, fields: Dict):
+        self._lease.update(fields)
+
+
+def acquire(doc_ref, fields: Optional[Dict] = None, stale_after: int = STALE_JOB_SECONDS) -> Optional[Lease]:
+    """
+    Claims the document for a job and writes `fields` with `processing: True` in the same
+    transaction. None if a live job holds it (or it does not exist).
+    """
+    @firestore.transactional
+    def claim(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        data = snapshot.to_dict() if snapshot.exists else None
+        if data is None or not available(data, stale_after=stale_after):
+            return None
+        token = _next_token(data.get("lease_token"))
+        transaction.update(doc_ref, {**(fields or {}), "processing": True, "cancel_requested": firestore.DELETE_FIELD,
+                                     **_lease_fields(token)})
+        return token
+
+    token = claim(_transaction(doc_ref))
+    metrics.incr("leases.acquired" if token else "leases.busy")
+    return Lease(doc_ref, token) if token else None
+
+
+def create(doc_ref, data: Dict) -> Optional[Lease]:
+    """Creates the document (with `processing: True`) already leased. None if it exists."""
+    token = _next_token(None)
+    try:
+        doc_ref.create({**data, "processing": True, **_lease_fields(token)})
+    except Conflict:  # AlreadyExists
+        metrics.incr("leases.busy")
+        return None
+    metrics.incr("leases.acquired")
+    return Lease(doc_ref, token)
+
+
+def request_cancel(doc_ref) -> bool:
+    """Asks the instance running the document's job to cancel it. False if no live job holds it."""
+    @firestore.transactional
+    def mark(transaction):
+        data = doc_ref.get(transaction=transaction).to_dict()
+        if available(data) or not data.get("lease_expires_at"):
+            return False
+        transaction.update(doc_ref, {"cancel_requested": True})
+        return True
+
+    return mark(_transaction(doc_ref))
+
+
+def run(lease: Lease, fn: Callable, *args):
+    """
+    fn(*args) as the holder of `lease`, called inside the job (see jobs.run_job): the lease is
+    renewed while it runs and released after. Use `document()` for the job's writes.
+    """
+    lease._job = jobs.current_token()
+    heartbeat = threading.Thread(target=lease._heartbeat, daemon=True, name=f"lease-{lease.doc_ref.id[:32]}")
+    heartbeat.start()
+    token = _current.set(lease)
+    try:
+        return fn(*args)
+    finally:
+        _current.reset(token)
+        lease._stop.set()
+        lease.release()
+
+
+def document(doc_ref):
+    """`doc_ref`, fenced by the current job's lease if it holds the lease on that document."""
+    lease = _current.get()
+    if lease is None or lease.doc_ref.id != doc_ref.id:
+        return doc_ref
+    return FencedDocument(doc_ref, lease)
@@ -0,0 +1,95 @@
+"""
+Small in-memory BM25 index.
+
+Used where we need retrieval without calling Vertex AI, e.g. the chunking benchmark, or as
+the /rag fallback while Vertex RAG is unavailable (RecentChunkIndex).
+"""
+import hashlib
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def chunk_id(text: str) -> str:
+    """Content id for a chunk: the same text gets the same id in every request and process."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:20]
+
+
+class BM25Index:
+    """Okapi BM25 over whole chunks. Documents are added once and searched many times."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids: List[str] = []
+        self.metadata: Dict[str, Dict] = {}
+        self.doc_lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.size_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def add(self, doc_id: str, text: str, metadata: Optional[Dict] = None):
+        index = len(self.doc_ids)
+        terms = Counter(tokenize(text))
+        for term, count in terms.items():
+            self.postings[term].append((index, count))
+        self.doc_ids.append(doc_id)
+        self.doc_lengths.append(sum(terms.values()))
+        self.metadata[doc_id] = metadata or {}
+        self.size_bytes += len(text.encode('utf-8'))
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Returns up to k (doc_id, score) pairs, best first."""
+        n = len(self.doc_ids)
+        if not n:
+            return []
+        avg_length = sum(self.doc_lengths) / n
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for index, count in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[index] / avg_length)
+                scores[index] += idf * count * (self.k1 + 1) / (count + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.doc_ids[index], score) for index, score in best]
+
+
+class RecentChunkIndex:
+    """
+    BM25 over chunks returned by earlier retrievals, so /rag can still answer from what it has
+    seen while Vertex RAG is down. Thread-safe; stops growing at `max_bytes` of text.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._index = BM25Index()
+        self._lock = threading.Lock()
+
+    def add_results(self, results: List[Dict]):
+        """Adds formatted retrieval results ({"text", "score", "source_uri", ...}), skipping known chunks."""
+        with self._lock:
+            for item in results:
+                text = item.get("text") or ""
+                doc_id = chunk_id(text)
+                if not text or doc_id in self._index.metadata or self._index.size_bytes >= self.max_bytes:
+                    continue
+                self._index.add(doc_id, text, {k: v for k, v in item.items() if k != "score"})
+
+    def search(self, query: str, k: int = 10) -> List[Dict]:
+        """Results in the retrieval format, scored by BM25 instead of vector similarity."""
+        with self._lock:
+            hits = self._index.search(query, k)
+            return [{**self._index.metadata[doc_id], "score": score} for doc_id, score in hits]
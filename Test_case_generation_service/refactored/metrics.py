@@ -0,0 +1,38 @@
+"""
+In-process counters exposed by GET /metrics.
+
+Counters are plain named integers (e.g. "rag.requests", "rag.coalesced"); ratios worth watching
+are derived from them in `snapshot()`.
+"""
+import threading
+from collections import defaultdict
+from typing import Dict
+
+_counters: Dict[str, int] = defaultdict(int)
+_lock = threading.Lock()
+
+
+def incr(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] += amount
+
+
+def get(name: str) -> int:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def ratio(numerator: str, denominator: str) -> float:
+    with _lock:
+        total = _counters.get(denominator, 0)
+        return round(_counters.get(numerator, 0) / total, 4) if total else 0.0
+
+
+def snapshot() -> Dict:
+    with _lock:
+        counters = dict(sorted(_counters.items()))
+    return {
+        "counters": counters,
+        # Share of /rag calls answered by joining an identical in-flight call
+        "rag_coalescing_ratio": ratio("rag.coalesced", "rag.requests"),
+    }
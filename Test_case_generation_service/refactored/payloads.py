@@ -0,0 +1,145 @@
+"""
+Compact /rag payloads and response encoding.
+
+A full /rag result repeats each chunk's text and source URI. With {"compact": true} in the body,
+/rag answers with ids, scores and short snippets instead, and each source URI is sent once:
+
+    {"sources": ["gs://bucket/gdpr.pdf", ...],
+     "results": [{"id": "9f86d081884c7d659a2f", "score": 0.82, "source": 0, "snippet": "Article 17 ...",
+                  "lane": "regulations", "locations": [...]}]}     locations only for source-code chunks
+
+`source` indexes `sources`. Clients that rank or dedupe stop there; full texts are fetched by id
+with GET /chunks?ids=a,b,... from the chunk cache below. Ids are content hashes, so they are
+stable across requests and instances, but only the instance that served a compact response is
+sure to hold its chunks; ids it does not have are listed as "missing". The cache is per tenant
+(tenants.py), so a tenant only gets back chunks it was served itself.
+
+Responses are serialized with orjson and compressed with brotli or gzip when the client accepts
+it and the body is over COMPRESS_MIN_BYTES.
+"""
+import gzip
+import os
+from typing import Dict, List, Optional, Tuple
+
+import brotli
+import orjson
+
+import metrics
+import tenants
+from local_index import chunk_id
+from resilience import TTLCache
+
+# --- COMPACT PAYLOAD CONFIGURATION ---
+COMPACT_SNIPPET_CHARS = int(os.getenv("COMPACT_SNIPPET_CHARS", "160"))
+CHUNK_CACHE_SIZE = int(os.getenv("CHUNK_CACHE_SIZE", "20000"))          # Chunks GET /chunks can serve
+CHUNK_CACHE_TTL = float(os.getenv("CHUNK_CACHE_TTL", "3600"))           # Seconds after its last /rag
+CHUNKS_MAX_IDS = int(os.getenv("CHUNKS_MAX_IDS", "100"))                # Per GET /chunks call
+
+# --- RESPONSE ENCODING CONFIGURATION ---
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))       # Smaller bodies are sent as-is
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))                  # 0-11; above ~6 costs more CPU than it saves
+
+_chunks = TTLCache(CHUNK_CACHE_SIZE, CHUNK_CACHE_TTL)
+
+
+def snippet(text: str, limit: int = COMPACT_SNIPPET_CHARS) -> str:
+    """The start of `text` on one line, cut at a word boundary."""
+    flat = " ".join(text.split())
+    if len(flat) <= limit:
+        return flat
+    cut = flat.rfind(" ", 0, limit)
+    return flat[:cut if cut > 0 else limit] + "…"
+
+
+def compact_results(results: List[Dict], cache: Optional[TTLCache] = None) -> Dict:
+    """
+    /rag results in the compact form above. Their chunks are cached for GET /chunks, or in
+    `cache` instead when given.
+    """
+    cache = _chunks if cache is None else cache
+    sources: Dict[str, int] = {}
+    items = []
+    for r in results:
+        text = r.get("text") or ""
+        cid = chunk_id(text)
+        cache.put(tenants.current().namespace(cid), {k: v for k, v in r.items() if k != "score"})
+        item = {"id": cid, "score": r.get("score"),
+                "source": sources.setdefault(r.get("source_uri") or "", len(sources)),
+                "snippet": snippet(text)}
+        if r.get("locations"):
+            item["locations"] = r["locations"]
+        if r.get("lane"):
+            item["lane"] = r["lane"]
+        items.append(item)
+    return {"sources": list(sources), "results": items}
+
+
+def fetch_chunks(ids: List[str]) -> Dict:
+    """{"chunks": {id: {"text", "source_uri", ...}}, "missing": [ids not in this instance's cache]}"""
+    found, missing = {}, []
+    tenant = tenants.current()
+    for cid in dict.fromkeys(ids):
+        chunk = _chunks.get(tenant.namespace(cid))
+        if chunk is None:
+            missing.append(cid)
+        else:
+            found[cid] = chunk
+    metrics.incr("chunks.served", len(found))
+    metrics.incr("chunks.missing", len(missing))
+    return {"chunks": found, "missing": missing}
+
+
+def parse_ids(value: Optional[str]) -> Tuple[List[str], Optional[str]]:
+    """Reads the comma-separated 'ids' query parameter. Returns (ids, error message or None)."""
+    ids = [i.strip() for i in (value or "").split(",") if i.strip()]
+    if not ids:
+        return [], "Missing 'ids'"
+    if len(ids) > CHUNKS_MAX_IDS:
+        return [], f"At most {CHUNKS_MAX_IDS} ids per request."
+    return ids, None
+
+
+def accepted_encoding(accept_encoding: str) -> Optional[str]:
+    """'br' or 'gzip' if the Accept-Encoding header allows it (br preferred), else None."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        try:
+            weight = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            weight = 1.0
+        if weight > 0:
+            accepted.add(name.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+def encode(obj, accept_encoding: str = "") -> Tuple[bytes, Dict[str, str]]:
+    """JSON body for `obj`, compressed if worthwhile, and the headers that describe it."""
+    body = orjson.dumps(obj, default=str)
+    headers = {"Content-Type": "application/json", "Vary": "Accept-Encoding"}
+    encoding = accepted_encoding(accept_encoding) if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding == "br":
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+    elif encoding == "gzip":
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return body, headers
+
+
+def payload_sizes(results: List[Dict]) -> Dict[str, int]:
+    """Bytes on the wire for `results` as a full and as a compact /rag response, raw and compressed."""
+    # A scratch cache: measuring must not fill the one GET /chunks serves from
+    scratch = TTLCache(max(len(results), 1), CHUNK_CACHE_TTL)
+    full, compact = orjson.dumps(results, default=str), orjson.dumps(compact_results(results, scratch))
+    return {
+        "full_bytes": len(full),
+        "full_gzip_bytes": len(gzip.compress(full, compresslevel=GZIP_LEVEL)),
+        "compact_bytes": len(compact),
+        "compact_br_bytes": len(brotli.compress(compact, quality=BROTLI_QUALITY)),
+    }
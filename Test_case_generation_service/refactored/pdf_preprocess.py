@@ -0,0 +1,194 @@
+"""
+Local PDF pre-chunker.
+
+Extracts text page by page, strips running headers/footers, page numbers, table-of-contents
+lines and boilerplate repeated across pages, and splits what remains on article/section
+headings. The result is a compact text file that is uploaded to the corpus in place of the
+PDF, plus a page/section map kept on the corpus document for traceability.
+"""
+import math
+import multiprocessing
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from pypdf import PdfReader
+
+# --- PREPROCESSING CONFIGURATION ---
+EDGE_LINES = 3              # Lines at the top and bottom of a page checked for running headers/footers
+REPEAT_FRACTION = 0.5       # A line on at least this share of pages is treated as boilerplate
+MIN_REPEAT_PAGES = 3        # ...but only once the document has this many pages
+BOILERPLATE_MIN_CHARS = 40  # Repeated lines outside the header/footer zone must be at least this long
+TOC_PAGE_FRACTION = 0.5     # Pages where this share of lines look like TOC entries are dropped
+MIN_TEXT_CHARS = 200        # Below this the PDF is probably scanned; upload the original instead
+CHARS_PER_TOKEN = 4         # Rough token estimate used for the chunk-count report
+
+SECTION_HEADING = re.compile(
+    r'^\s*(?:'
+    r'(?:ARTICLE|Article|CHAPTER|Chapter|SECTION|Section|PART|Part|ANNEX|Annex|APPENDIX|Appendix)\s+[\dIVXLCM]+[A-Za-z]?\b.{0,80}'
+    r'|§\s*\d+(?:\.\d+)*.{0,80}'
+    r'|\d+(?:\.\d+){0,3}\.?\s+[A-Z][^.;:]{2,80}'
+    r')$'
+)
+TOC_LINE = re.compile(r'^.{3,}?(?:\.{4,}|…+|\s{3,})\s*\d+\s*$')
+PAGE_NUMBER = re.compile(r'^\s*(?:page\s*)?(?:\d+|[ivxlcdm]+)(?:\s*(?:of|/)\s*\d+)?\s*$', re.IGNORECASE)
+
+
+def _normalise(line: str) -> str:
+    """Collapses whitespace and digits so 'Page 3 of 40' and 'Page 4 of 40' compare equal."""
+    return re.sub(r'\s+', ' ', re.sub(r'\d+', '#', line)).strip().lower()
+
+
+def extract_pages(pdf_path: str) -> List[List[str]]:
+    """Returns the non-empty text lines of every page."""
+    reader = PdfReader(pdf_path)
+    pages = []
+    for page in reader.pages:
+        text = page.extract_text() or ''
+        pages.append([line.rstrip() for line in text.splitlines() if line.strip()])
+    return pages
+
+
+def _repeated_lines(pages: List[List[str]]) -> Tuple[set, set]:
+    """
+    Finds boilerplate by counting, once per page, normalised lines in the header/footer zone
+    and long lines anywhere on the page. Returns (edge_lines, body_lines) to strip.
+    """
+    if len(pages) < MIN_REPEAT_PAGES:
+        return set(), set()
+
+    edge_counts, body_counts = Counter(), Counter()
+    for lines in pages:
+        edge = lines[:EDGE_LINES] + lines[-EDGE_LINES:]
+        edge_counts.update({_normalise(line) for line in edge})
+        body_counts.update({_normalise(line) for line in lines if len(line.strip()) >= BOILERPLATE_MIN_CHARS})
+
+    threshold = max(MIN_REPEAT_PAGES, math.ceil(len(pages) * REPEAT_FRACTION))
+    edge_lines = {line for line, count in edge_counts.items() if count >= threshold}
+    body_lines = {line for line, count in body_counts.items() if count >= threshold}
+    return edge_lines, body_lines
+
+
+def clean_pages(pages: List[List[str]]) -> List[List[str]]:
+    """Strips headers/footers, page numbers, TOC entries and repeated boilerplate from each page."""
+    edge_lines, body_lines = _repeated_lines(pages)
+    cleaned = []
+    for lines in pages:
+        toc_lines = sum(1 for line in lines if TOC_LINE.match(line))
+        if lines and toc_lines / len(lines) >= TOC_PAGE_FRACTION:
+            cleaned.append([])
+            continue
+
+        kept = []
+        last = len(lines) - 1
+        for i, line in enumerate(lines):
+            key = _normalise(line)
+            in_edge = i < EDGE_LINES or i > last - EDGE_LINES
+            if PAGE_NUMBER.match(line) or TOC_LINE.match(line):
+                continue
+            if (in_edge and key in edge_lines) or key in body_lines:
+                continue
+            kept.append(line)
+        cleaned.append(kept)
+    return cleaned
+
+
+def split_sections(pages: List[List[str]]) -> List[Dict]:
+    """Splits cleaned pages on article/section headings, tracking the page range of each section."""
+    sections = []
+    current = {"title": "Preamble", "start_page": 1, "end_page": 1, "lines": []}
+    for page_number, lines in enumerate(pages, start=1):
+        for line in lines:
+            if SECTION_HEADING.match(line):
+                if current["lines"]:
+                    sections.append(current)
+                current = {"title": line.strip(), "start_page": page_number, "end_page": page_number, "lines": []}
+                continue
+            current["lines"].append(line)
+            current["end_page"] = page_number
+    if current["lines"]:
+        sections.append(current)
+    return sections
+
+
+def estimate_chunks(text: str, chunk_size: int, chunk_overlap: int) -> int:
+    """Approximates how many chunks the corpus chunker will produce for `text`."""
+    tokens = len(text) / CHARS_PER_TOKEN
+    if tokens <= 0:
+        return 0
+    stride = max(1, chunk_size - chunk_overlap)
+    return max(1, math.ceil(max(tokens - chunk_overlap, 1) / stride))
+
+
+def preprocess_pdf(pdf_path: str, out_dir: str, chunk_size: int = 1024, chunk_overlap: int = 200) -> Dict:
+    """
+    Writes `<out_dir>/<name>.txt` for one PDF and reports the size reduction.
+    `text_path` is None when no usable text could be extracted (e.g. scanned PDFs).
+    """
+    report = {
+        "source": pdf_path,
+        "text_path": None,
+        "sections": [],
+        "original_bytes": os.path.getsize(pdf_path),
+        "output_bytes": 0,
+        "chunks_before": 0,
+        "chunks_after": 0,
+    }
+    try:
+        pages = extract_pages(pdf_path)
+    except Exception as e:
+        report["error"] = f"{e.__class__.__name__}: {e}"
+        return report
+
+    raw_text = "\n".join(line for lines in pages for line in lines)
+    report["pages"] = len(pages)
+    report["chunks_before"] = estimate_chunks(raw_text, chunk_size, chunk_overlap)
+
+    sections = split_sections(clean_pages(pages))
+    blocks = []
+    for section in sections:
+        pages_label = (f"page {section['start_page']}" if section["start_page"] == section["end_page"]
+                       else f"pages {section['start_page']}-{section['end_page']}")
+        blocks.append(f"## {section['title']} ({pages_label})\n" + "\n".join(section["lines"]))
+    text = "\n\n".join(blocks)
+    if len(text) < MIN_TEXT_CHARS:
+        return report
+
+    os.makedirs(out_dir, exist_ok=True)
+    text_path = os.path.join(out_dir, os.path.splitext(os.path.basename(pdf_path))[0] + ".txt")
+    with open(text_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+    report.update({
+        "text_path": text_path,
+        "sections": [{k: s[k] for k in ("title", "start_page", "end_page")} for s in sections],
+        "output_bytes": os.path.getsize(text_path),
+        "chunks_after": estimate_chunks(text, chunk_size, chunk_overlap),
+    })
+    return report
+
+
+def preprocess_pdfs(pdf_paths: List[str], out_dir: str, workers: Optional[int] = None,
+                    chunk_size: int = 1024, chunk_overlap: int = 200) -> List[Dict]:
+    """
+    Pre-chunks PDFs in a process pool (extraction is CPU-bound). Reports come back in input order.
+    Uses 'spawn' so workers don't inherit the service's browser and client threads.
+    """
+    if not pdf_paths:
+        return []
+    workers = workers or min(len(pdf_paths), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        reports = list(executor.map(preprocess_pdf, pdf_paths, [out_dir] * len(pdf_paths),
+                                    [chunk_size] * len(pdf_paths), [chunk_overlap] * len(pdf_paths)))
+
+    for r in reports:
+        name = os.path.basename(r["source"])
+        if r["text_path"]:
+            saved = 1 - r["output_bytes"] / max(r["original_bytes"], 1)
+            print(f"  -> Pre-chunked {name}: {r['original_bytes']} -> {r['output_bytes']} bytes ({saved:.0%} smaller), "
+                  f"~{r['chunks_before']} -> ~{r['chunks_after']} chunks, {len(r['sections'])} sections")
+        else:
+            print(f"  -> No usable text in {name} ({r.get('error', 'too little text')}); uploading the PDF as-is")
+    return reports
@@ -0,0 +1,123 @@
+"""
+Retrieval prefetch for the clarification step.
+
+The UI asks for clarification questions and then waits for a person to answer them before
+generating test cases. POST /rag/prefetch starts enhancement and retrieval for the requirement
+in the background right away and returns a ticket; POST /generate-test-cases later claims the
+ticket, so retrieval latency is hidden behind the think time.
+
+A ticket is only honoured for the requirement it was issued for. Claiming one whose retrieval
+is still running joins it (retrieve_regulations coalesces identical in-flight calls); one still
+queued behind other prefetches is taken over: the claim retrieves and the queued run is dropped.
+An unknown, expired or failed ticket falls back to a normal retrieval, so a claim never does
+worse than not prefetching. Tickets are bound to the tenant that started them, whose request slots
+the prefetch holds while it runs (tenants.py). Clarification answers refine a claimed result with one extra retrieval,
+fused into the prefetched ranking.
+
+Counts `prefetch.started`, `.claimed_ready`, `.claimed_pending`, `.claimed_queued` and `.missed`
+in metrics.
+"""
+import contextvars
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import corpus_operations as co
+import metrics
+import tenants
+from resilience import TTLCache
+
+# --- PREFETCH CONFIGURATION ---
+PREFETCH_TTL_SECONDS = float(os.getenv("PREFETCH_TTL_SECONDS", "900"))   # How long a ticket can be claimed
+PREFETCH_MAX_TICKETS = int(os.getenv("PREFETCH_MAX_TICKETS", "1024"))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "8"))               # Prefetches retrieving at once
+
+_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+_tickets = TTLCache(PREFETCH_MAX_TICKETS, PREFETCH_TTL_SECONDS)
+_takeover_lock = threading.Lock()
+
+
+class Ticket:
+    def __init__(self, requirement: str, future: Future):
+        self.key = co.rag_request_key(requirement)
+        self.future = future
+        self.created = time.monotonic()
+
+    def status(self, ticket_id: str) -> Dict:
+        return {"ticket": ticket_id, "ready": self.future.done(),
+                "expires_in": max(0, round(self.created + PREFETCH_TTL_SECONDS - time.monotonic()))}
+
+
+def _prefetch(requirement: str) -> Tuple[List[Dict], List[str]]:
+    with tenants.current().request_slot():
+        return co.retrieve_regulations(requirement)
+
+
+def start(requirement: str) -> Dict:
+    """Starts retrieval for `requirement` in the background. Returns the ticket's status."""
+    ticket_id = secrets.token_urlsafe(16)
+    ticket = Ticket(requirement, _executor.submit(contextvars.copy_context().run, _prefetch, requirement))
+    _tickets.put(ticket_id, ticket)
+    metrics.incr("prefetch.started")
+    return ticket.status(ticket_id)
+
+
+def status(ticket_id: str) -> Optional[Dict]:
+    ticket = _tickets.get(ticket_id)
+    return ticket.status(ticket_id) if ticket else None
+
+
+def _take_over(ticket: Ticket, requirement: str) -> Optional[Tuple[List[Dict], List[str]]]:
+    """
+    Retrieves here if the ticket's prefetch has not started yet, in place of it. None if it has.
+    Later claims of the ticket see this retrieval as the prefetch in flight.
+    """
+    with _takeover_lock:
+        if not ticket.future.cancel():
+            return None
+        future = ticket.future = Future()
+        future.set_running_or_notify_cancel()
+    try:
+        result = co.retrieve_regulations(requirement)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    future.set_result(result)
+    return result
+
+
+def _claim(ticket_id: Optional[str], requirement: str) -> Tuple[List[Dict], List[str]]:
+    ticket = _tickets.get(ticket_id) if ticket_id else None
+    if ticket is None or ticket.key != co.rag_request_key(requirement):
+        metrics.incr("prefetch.missed")
+        return co.retrieve_regulations(requirement)
+    if not ticket.future.done():
+        result = _take_over(ticket, requirement)
+        if result is not None:
+            metrics.incr("prefetch.claimed_queued")
+            return result
+        # Joins the prefetch still in flight instead of starting another
+        metrics.incr("prefetch.claimed_pending")
+        return co.retrieve_regulations(requirement)
+    if ticket.future.exception() is not None:
+        metrics.incr("prefetch.missed")
+        return co.retrieve_regulations(requirement)
+    metrics.incr("prefetch.claimed_ready")
+    return ticket.future.result()
+
+
+def claim(ticket_id: Optional[str], requirement: str,
+          clarifications: Optional[str] = None) -> Tuple[List[Dict], List[str]]:
+    """
+    Retrieval results for `requirement`, from the ticket's prefetch when it can be used.
+    With `clarifications`, the answers are retrieved too and fused into the ranking.
+    Returns (results, degraded) like retrieve_regulations.
+    """
+    results, degraded = _claim(ticket_id, requirement)
+    if not clarifications:
+        return results, degraded
+    refined, flags = co.retrieve_query(clarifications)
+    return co.fuse_rankings([results, refined]), list(dict.fromkeys(degraded + flags))
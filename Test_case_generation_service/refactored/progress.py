@@ -0,0 +1,241 @@
+"""
+In-process progress pub/sub for corpus ingestion jobs.
+
+A job publishes into the channel named after its corpus: `begin` when it starts, `stage` on
+each stage transition, `update` / `advance` for counters, `finish` at the end. Every event is
+the channel's full state:
+
+    {"corpus", "task", "stage", "seq", "links_found", "files_downloaded", "bytes_downloaded",
+     "files_total", "files_uploaded", "bytes_uploaded", "elapsed_seconds", "eta_seconds", "error"}
+
+Subscribers (GET /corpus/<name>/events) get the current state at once and then every change,
+with no Firestore reads. The terminal state is sent as a "done" event, after which the stream
+ends; clients should close their EventSource on it rather than let it reconnect.
+
+Firestore is written only on stage transitions (the doc's "progress" field), so clients that
+still poll GET /corpus/<name> see the stage too.
+
+Channels live in this process only: a job running on another instance is not visible here. A
+channel is dropped once its job finishes (or goes PROGRESS_IDLE_SECONDS without an event, e.g. a
+job that lost its lease), so a later job elsewhere is read from Firestore rather than reported
+as this instance's old "done".
+
+Each open stream holds a worker thread under WSGI, so at most SSE_MAX_STREAMS are served at once;
+past that GET /corpus/<name>/events answers 503 and the client retries.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+from google.cloud import firestore
+
+import metrics
+
+TERMINAL_STAGES = ("done", "skipped", "failed", "cancelled")
+
+# --- SSE CONFIGURATION ---
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))   # Keep-alive comment when nothing changed
+SSE_MAX_SECONDS = float(os.getenv("SSE_MAX_SECONDS", "600"))              # Then the stream ends and the client reconnects
+SSE_REMOTE_RETRY_MS = int(os.getenv("SSE_REMOTE_RETRY_MS", "10000"))      # Reconnect delay for jobs on other instances
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", "4"))                  # Open streams per process (WSGI: each holds a thread)
+PROGRESS_IDLE_SECONDS = float(os.getenv("PROGRESS_IDLE_SECONDS", "1800"))  # Channel dropped after this long without an event
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+COUNTERS = ("links_found", "files_downloaded", "bytes_downloaded", "files_total", "files_uploaded", "bytes_uploaded")
+
+
+class Channel:
+    def __init__(self, corpus_name: str, task: str, doc_ref=None):
+        self.corpus_name = corpus_name
+        self.doc_ref = doc_ref
+        self.state: Dict = {"corpus": corpus_name, "task": task, "stage": "starting", "seq": 0,
+                            **{c: 0 for c in COUNTERS}, "elapsed_seconds": 0, "eta_seconds": None, "error": None}
+        self._started = time.monotonic()
+        self.published_at = self._started
+        self._stage_started = self._started
+        self._uploaded_at_stage_start = 0
+        self._changed = threading.Condition()
+
+    @property
+    def closed(self) -> bool:
+        return self.state["stage"] in TERMINAL_STAGES
+
+    def _eta(self) -> Optional[int]:
+        """Seconds left in the upload stage, from its rate so far."""
+        s = self.state
+        done = s["files_uploaded"] - self._uploaded_at_stage_start
+        if s["stage"] != "uploading" or done <= 0 or not s["files_total"]:
+            return None
+        rate = done / (time.monotonic() - self._stage_started)
+        return round((s["files_total"] - s["files_uploaded"]) / rate)
+
+    def publish(self, **changes) -> Dict:
+        with self._changed:
+            if "stage" in changes and changes["stage"] != self.state["stage"]:
+                self._stage_started = time.monotonic()
+                self._uploaded_at_stage_start = self.state["files_uploaded"]
+            self.state.update(changes)
+            self.state["seq"] += 1
+            self.state["elapsed_seconds"] = round(time.monotonic() - self._started)
+            self.state["eta_seconds"] = 0 if self.closed else self._eta()
+            self.published_at = time.monotonic()
+            self._changed.notify_all()
+            return dict(self.state)
+
+    def advance(self, **increments) -> Dict:
+        """Adds to counters and publishes, atomically with respect to other publishers."""
+        with self._changed:  # Condition's lock is reentrant, so publish takes it again
+            return self.publish(**{k: self.state[k] + v for k, v in increments.items()})
+
+    def snapshot(self) -> Dict:
+        with self._changed:
+            return dict(self.state)
+
+    def wait(self, after_seq: int, timeout: float) -> Optional[Dict]:
+        """The state once its seq passes `after_seq`, or None after `timeout` seconds."""
+        with self._changed:
+            if self._changed.wait_for(lambda: self.state["seq"] > after_seq, timeout):
+                return dict(self.state)
+            return None
+
+
+_channels: Dict[str, Channel] = {}
+_lock = threading.Lock()
+_streams = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+
+def channel(corpus_name: str) -> Optional[Channel]:
+    """The running job's channel; None if there is none or it went PROGRESS_IDLE_SECONDS silent."""
+    with _lock:
+        ch = _channels.get(corpus_name)
+        if ch is not None and time.monotonic() - ch.published_at > PROGRESS_IDLE_SECONDS:
+            del _channels[corpus_name]
+            return None
+        return ch
+
+
+def _evict(ch: Channel):
+    with _lock:
+        if _channels.get(ch.corpus_name) is ch:
+            del _channels[ch.corpus_name]
+
+
+def open_stream() -> bool:
+    """Takes one of the SSE_MAX_STREAMS stream slots. False if all are in use."""
+    if _streams.acquire(blocking=False):
+        return True
+    metrics.incr("sse.rejected")
+    return False
+
+
+def close_stream():
+    _streams.release()
+
+
+def begin(corpus_name: str, task: str, doc_ref=None) -> Channel:
+    """
+    Opens a channel for a job on `corpus_name`. A channel still open (an update handing over to
+    the creation it found unfinished) is carried on, so its subscribers keep receiving events.
+    """
+    with _lock:
+        ch = _channels.get(corpus_name)
+        if ch is None or ch.closed:
+            ch = _channels[corpus_name] = Channel(corpus_name, task, doc_ref)
+            return ch
+    ch.publish(task=task)
+    return ch
+
+
+def stage(corpus_name: str, stage_name: str, **counters):
+    """A stage transition: published, and written to the corpus document."""
+    ch = channel(corpus_name)
+    if ch is None:
+        return
+    state = ch.publish(stage=stage_name, **counters)
+    if ch.doc_ref is not None:
+        try:
+            ch.doc_ref.update({"progress": state, "updated_at": firestore.SERVER_TIMESTAMP})
+        except Exception as e:
+            print(f"Warning: could not record progress stage for {corpus_name}: {e}")
+
+
+def update(corpus_name: str, **counters):
+    """Sets counters. Published only."""
+    ch = channel(corpus_name)
+    if ch is not None:
+        ch.publish(**counters)
+
+
+def advance(corpus_name: str, **increments):
+    """Adds to counters, e.g. advance(name, files_uploaded=10). Published only."""
+    ch = channel(corpus_name)
+    if ch is not None:
+        ch.advance(**increments)
+
+
+def finish(corpus_name: str, stage_name: str = "done", error: Optional[str] = None) -> Optional[Dict]:
+    """
+    Publishes the terminal stage and returns the final state, for the caller to write with its
+    own final document update. The channel is dropped; its current subscribers still get "done".
+    """
+    ch = channel(corpus_name)
+    if ch is None:
+        return None
+    state = ch.publish(stage=stage_name, error=error)
+    _evict(ch)
+    return state
+
+
+def subscribe(corpus_name: str, heartbeat: float) -> Iterator[Optional[Dict]]:
+    """
+    Yields the current state, then each new one until the job finishes. Yields None every
+    `heartbeat` seconds without a change so the caller can keep the connection alive.
+    """
+    ch = channel(corpus_name)
+    if ch is None:
+        return
+    state = ch.snapshot()
+    yield state
+    while not ch.closed or ch.snapshot()["seq"] > state["seq"]:
+        new = ch.wait(state["seq"], heartbeat)
+        if new is not None:
+            state = new
+        yield new
+
+
+async def subscribe_async(corpus_name: str, heartbeat: float, poll: float = 0.5):
+    """subscribe for the event loop: checks the channel every `poll` seconds instead of blocking."""
+    ch = channel(corpus_name)
+    if ch is None:
+        return
+    state = ch.snapshot()
+    yield state
+    idle = 0.0
+    while not ch.closed or ch.snapshot()["seq"] > state["seq"]:
+        await asyncio.sleep(poll)
+        new = ch.snapshot()
+        if new["seq"] > state["seq"]:
+            state, idle = new, 0.0
+            yield new
+        else:
+            idle += poll
+            if idle >= heartbeat:
+                idle = 0.0
+                yield None
+
+
+def stored_state(corpus_data: Dict, corpus_name: str) -> Dict:
+    """The progress last written to a corpus document, for jobs this process is not running."""
+    return corpus_data.get("progress") or {
+        "corpus": corpus_name, "stage": "processing" if corpus_data.get("processing") else "done"}
+
+
+def format_sse(state: Optional[Dict], retry_ms: Optional[int] = None) -> str:
+    """One Server-Sent Event for `state`; a comment line (keep-alive) for None."""
+    if state is None:
+        return ": keepalive\n\n"
+    event = "done" if state.get("stage") in TERMINAL_STAGES else "progress"
+    retry = f"retry: {retry_ms}\n" if retry_ms else ""
+    return f"{retry}id: {state.get('seq', 0)}\nevent: {event}\ndata: {json.dumps(state, default=str)}\n\n"
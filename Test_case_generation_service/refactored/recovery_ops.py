@@ -0,0 +1,115 @@
+"""
+Adoption of jobs left behind by a dead worker.
+
+A worker that is recycled or killed mid-job (e.g. Chrome running out of memory) never
+reaches the code that clears `processing`, so its corpus document stays `processing: True`.
+Its lease (leases.py) stops being renewed, so once it expires (or, for a document without a
+lease, once its `updated_at` is STALE_JOB_SECONDS old) any instance may claim it. The service
+looks for such documents at boot and then every ADOPT_INTERVAL_SECONDS, claims each one's lease
+just before re-running its task, so only one instance adopts it. Corpus tasks resume from
+their checkpoint.
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+import corpus_operations as co
+import jobs
+import leases
+import source_code_ops
+import tenants
+from corpus_operations import FIRESTORE_COLLECTION, db
+from leases import STALE_JOB_SECONDS
+
+# --- RECOVERY CONFIGURATION ---
+ADOPT_STALE_JOBS = os.getenv("ADOPT_STALE_JOBS", "true").lower() == "true"
+ADOPT_INTERVAL_SECONDS = int(os.getenv("ADOPT_INTERVAL_SECONDS", "300"))   # 0: only at boot
+
+
+def find_stale_jobs(stale_after: int = STALE_JOB_SECONDS) -> List[str]:
+    """The ids of processing documents no live job holds."""
+    query = db.collection(FIRESTORE_COLLECTION).where(filter=FieldFilter("processing", "==", True))
+    return [snapshot.id for snapshot in query.stream()
+            if leases.available(snapshot.to_dict(), stale_after=stale_after)]
+
+
+def resume_job(doc_id: str, lease: leases.Lease):
+    """Re-runs the task a processing document was in the middle of, as the document's tenant."""
+    data = db.collection(FIRESTORE_COLLECTION).document(doc_id).get().to_dict() or {}
+    task = (data.get("checkpoint") or {}).get("task")
+    print(f"Adopting stale job {doc_id} ({data.get('type')}, checkpoint: {task or 'none'})")
+    with tenants.scope(tenants.of(data)):
+        _resume(doc_id, data, task, lease)
+
+
+def _resume(doc_id: str, data: Dict, task: Optional[str], lease: leases.Lease):
+    link = data.get("link")
+    if data.get("type") == 'source code':
+        if data.get("commit_sha"):
+            jobs.run_job(doc_id, "update source code", leases.run, lease,
+                         source_code_ops.update_source_code_embeddings, link)
+        else:
+            jobs.run_job(doc_id, "create source code", leases.run, lease,
+                         source_code_ops.create_source_code_embeddings,
+                         link, data.get("branch"), data.get("sparse_paths") or None)
+    elif task == "update" or (task is None and data.get("rag_file_ids")):
+        jobs.run_job(doc_id, "update corpus", leases.run, lease, co.update_corpus_async_task, doc_id, link)
+    else:
+        jobs.run_job(doc_id, "create corpus", leases.run, lease, co.create_corpus_async_task, doc_id, link)
+
+
+def adopt_stale_jobs(stale_after: int = STALE_JOB_SECONDS) -> List[str]:
+    """
+    Claims stale jobs and resumes them one after another (they share the Chrome driver).
+    Each lease is claimed only when its job is about to run, so the others stay free for other instances.
+    """
+    stale = find_stale_jobs(stale_after)
+    if stale:
+        print(f"Found {len(stale)} stale jobs: {stale}")
+    adopted = []
+    for doc_id in stale:
+        try:
+            lease = leases.acquire(db.collection(FIRESTORE_COLLECTION).document(doc_id),
+                                   {"adopted_at": firestore.SERVER_TIMESTAMP}, stale_after)
+        except Exception as e:
+            print(f"Could not claim stale job {doc_id}: {e}")
+            continue
+        if lease is None:
+            continue  # Finished, or adopted by another instance, since the query
+        adopted.append(doc_id)
+        try:
+            resume_job(doc_id, lease)
+        except Exception as e:
+            print(f"Resuming stale job {doc_id} failed: {e}")
+    return adopted
+
+
+def _adoption_loop():
+    while True:
+        try:
+            adopt_stale_jobs()
+        except Exception as e:
+            print(f"Stale job sweep failed: {e}")
+        if ADOPT_INTERVAL_SECONDS <= 0:
+            return
+        time.sleep(ADOPT_INTERVAL_SECONDS)
+
+
+def start_stale_job_adoption() -> Optional[threading.Thread]:
+    """
+    Runs adopt_stale_jobs in a daemon thread at boot, then every ADOPT_INTERVAL_SECONDS,
+    unless ADOPT_STALE_JOBS is off.
+    """
+    if not ADOPT_STALE_JOBS:
+        return None
+    thread = threading.Thread(target=_adoption_loop, daemon=True, name="stale-job-adoption")
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    adopt_stale_jobs()
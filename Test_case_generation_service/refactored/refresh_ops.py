@@ -0,0 +1,229 @@
+"""
+Scheduled refresh of all corpora.
+
+Each pass walks the corpus documents in Firestore and runs cheap change checks on their
+sources (conditional GET first, then a content hash; `git ls-remote` for source code).
+Only corpora whose sources changed are queued for the update task that PUT /corpus/<name>
+(or PUT /source-code) runs.
+
+Run one pass from cron / Cloud Scheduler:
+    python refresh_ops.py
+or let the service run passes itself by setting REFRESH_INTERVAL_SECONDS.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from bs4 import BeautifulSoup
+from git.cmd import Git
+from google.cloud import firestore
+
+import corpus_operations as co
+import jobs
+import leases
+import source_code_ops
+import tenants
+from corpus_operations import FIRESTORE_COLLECTION, db
+
+# --- REFRESH CONFIGURATION ---
+REFRESH_INTERVAL_SECONDS = int(os.getenv("REFRESH_INTERVAL_SECONDS", "0"))          # 0 disables the in-service scheduler
+REFRESH_MAX_CONCURRENCY = int(os.getenv("REFRESH_MAX_CONCURRENCY", "8"))            # Change checks in flight overall
+REFRESH_PER_HOST_CONCURRENCY = int(os.getenv("REFRESH_PER_HOST_CONCURRENCY", "2"))  # Checks/updates in flight per host
+REFRESH_MAX_UPDATES = int(os.getenv("REFRESH_MAX_UPDATES", "1"))                    # PDF updates share one Chrome driver
+REFRESH_JITTER_SECONDS = float(os.getenv("REFRESH_JITTER_SECONDS", "30"))
+REFRESH_REQUEST_TIMEOUT = float(os.getenv("REFRESH_REQUEST_TIMEOUT", "30"))
+
+REFRESHABLE_TYPES = ('pdf', 'webpage', 'source code')
+
+_host_semaphores: Dict[str, threading.Semaphore] = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def _host_semaphore(url: str) -> threading.Semaphore:
+    host = urlparse(url).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.Semaphore(REFRESH_PER_HOST_CONCURRENCY)
+        return _host_semaphores[host]
+
+
+def _content_hash(response: requests.Response) -> str:
+    """Hashes the visible text of HTML pages (ignores scripts/nonces) and the raw bytes of anything else."""
+    content_type = response.headers.get('Content-Type', '')
+    if 'html' in content_type:
+        soup = BeautifulSoup(response.content, 'lxml')
+        for tag in soup(['script', 'style', 'noscript']):
+            tag.decompose()
+        body = soup.get_text(separator='\n', strip=True).encode('utf-8')
+    else:
+        body = response.content
+    return hashlib.sha256(body).hexdigest()
+
+
+def check_source(url: str, previous: Optional[Dict]) -> Tuple[bool, Dict]:
+    """
+    Checks one source URL for changes against its previous signature.
+    Returns (changed, new_signature). A source seen for the first time only records a baseline.
+    """
+    previous = previous or {}
+    headers = {}
+    if previous.get('etag'):
+        headers['If-None-Match'] = previous['etag']
+    if previous.get('last_modified'):
+        headers['If-Modified-Since'] = previous['last_modified']
+
+    with _host_semaphore(url):
+        response = requests.get(url, headers=headers, timeout=REFRESH_REQUEST_TIMEOUT)
+
+    if response.status_code == 304:
+        return False, previous
+    response.raise_for_status()
+
+    signature = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'sha256': _content_hash(response),
+    }
+    changed = bool(previous.get('sha256')) and previous['sha256'] != signature['sha256']
+    return changed, signature
+
+
+def _sources_for(corpus: Dict) -> List[str]:
+    """The landing page plus every PDF it led to, so both new and revised documents are noticed."""
+    sources = [corpus['link']]
+    for pdf_link in corpus.get('pdf_links') or []:
+        if pdf_link not in sources:
+            sources.append(pdf_link)
+    return sources
+
+
+def check_repo(corpus: Dict) -> bool:
+    """True when the remote branch head moved past the last ingested commit."""
+    with _host_semaphore(corpus['link']):
+        output = Git().ls_remote(corpus['link'], corpus.get('branch') or 'HEAD')
+    head_sha = output.split()[0] if output else None
+    return bool(head_sha and corpus.get('commit_sha') and head_sha != corpus['commit_sha'])
+
+
+def check_corpus(corpus_name: str, corpus: Dict) -> bool:
+    """Runs the change checks for one corpus and records the timestamps. Returns True if it changed."""
+    time.sleep(random.uniform(0, REFRESH_JITTER_SECONDS))
+
+    update = {"last_checked_at": firestore.SERVER_TIMESTAMP}
+    if corpus.get('type') == 'source code':
+        changed = check_repo(corpus)
+    else:
+        signatures = dict(corpus.get('source_signatures') or {})
+        changed = False
+        for url in _sources_for(corpus):
+            try:
+                url_changed, signatures[url] = check_source(url, signatures.get(url))
+                changed = changed or url_changed
+            except Exception as e:
+                print(f"Refresh: could not check {url} for {corpus_name}: {e}")
+        update["source_signatures"] = signatures
+
+    if changed:
+        update["last_changed_at"] = firestore.SERVER_TIMESTAMP
+    db.collection(FIRESTORE_COLLECTION).document(corpus_name).update(update)
+    return changed
+
+
+def _run_update(corpus_name: str, link: str, corpus_type: str):
+    """
+    Claims the corpus's lease (as the PUT endpoints do) and runs the matching update task,
+    as the corpus's tenant.
+    """
+    doc_ref = db.collection(FIRESTORE_COLLECTION).document(corpus_name)
+    current_data = doc_ref.get().to_dict() or {}
+    with tenants.scope(tenants.of(current_data)):
+        _update(doc_ref, corpus_name, link, corpus_type)
+
+
+def _update(doc_ref, corpus_name: str, link: str, corpus_type: str):
+    with _host_semaphore(link):
+        # Claimed only once the update can start, so the lease is not waiting out its TTL here
+        if corpus_type == 'source code':
+            # Old shards stay searchable while only the diff is re-uploaded
+            kind, task, args = "refresh source code", source_code_ops.update_source_code_embeddings, (link,)
+            lease = leases.acquire(doc_ref, {"updated_at": firestore.SERVER_TIMESTAMP})
+        else:
+            kind, task, args = "refresh corpus", co.update_corpus_async_task, (corpus_name, link)
+            lease = leases.acquire(doc_ref, {"embeddings_available": False, "updated_at": firestore.SERVER_TIMESTAMP})
+        if lease is None:
+            print(f"Refresh: {corpus_name} is already being processed, skipping update.")
+            return
+        jobs.run_job(corpus_name, kind, leases.run, lease, task, *args)
+
+
+def run_refresh_pass(wait_for_updates: bool = False) -> Dict:
+    """
+    Checks every refreshable corpus and queues updates for the ones that changed.
+    Returns a summary of the pass.
+    """
+    start = time.perf_counter()
+    corpora = []
+    for doc in db.collection(FIRESTORE_COLLECTION).stream():
+        data = doc.to_dict()
+        if data.get('type') in REFRESHABLE_TYPES and data.get('link') and not data.get('processing'):
+            corpora.append((doc.id, data))
+
+    summary = {"checked": 0, "changed": 0, "errors": 0, "updated": []}
+    update_executor = ThreadPoolExecutor(max_workers=REFRESH_MAX_UPDATES, thread_name_prefix="refresh-update")
+    update_futures = []
+
+    with ThreadPoolExecutor(max_workers=REFRESH_MAX_CONCURRENCY, thread_name_prefix="refresh-check") as check_executor:
+        futures = {check_executor.submit(check_corpus, name, data): (name, data) for name, data in corpora}
+        for future in as_completed(futures):
+            name, data = futures[future]
+            try:
+                changed = future.result()
+            except Exception as e:
+                print(f"Refresh: check failed for {name}: {e}")
+                summary["errors"] += 1
+                continue
+            summary["checked"] += 1
+            if changed:
+                print(f"Refresh: sources changed for {name}, queueing update.")
+                summary["changed"] += 1
+                summary["updated"].append(name)
+                update_futures.append(update_executor.submit(_run_update, name, data['link'], data['type']))
+
+    if wait_for_updates:
+        wait(update_futures)
+    update_executor.shutdown(wait=wait_for_updates)
+
+    summary["seconds"] = round(time.perf_counter() - start, 1)
+    print(f"Refresh pass complete: {summary}")
+    return summary
+
+
+def _scheduler_loop(interval: int):
+    while True:
+        # Jitter the period too, so several instances don't line up their passes.
+        time.sleep(interval + random.uniform(0, REFRESH_JITTER_SECONDS))
+        try:
+            run_refresh_pass()
+        except Exception as e:
+            print(f"Refresh pass failed: {e}")
+
+
+def start_refresh_scheduler(interval: int = REFRESH_INTERVAL_SECONDS) -> Optional[threading.Thread]:
+    """Starts the in-service refresh loop in a daemon thread when an interval is configured."""
+    if interval <= 0:
+        return None
+    thread = threading.Thread(target=_scheduler_loop, args=(interval,), daemon=True, name="corpus-refresh")
+    thread.start()
+    print(f"Corpus refresh scheduler started (every {interval}s).")
+    return thread
+
+
+if __name__ == '__main__':
+    print(json.dumps(run_refresh_pass(wait_for_updates=True), indent=2))
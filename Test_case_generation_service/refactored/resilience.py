@@ -0,0 +1,187 @@
+"""
+Circuit breakers and fallback caches for the Gemini and Vertex RAG calls on the /rag path.
+
+A breaker watches the last BREAKER_WINDOW calls to its upstream. When at least
+BREAKER_MIN_CALLS have been seen and the share of errors (or of calls slower than
+BREAKER_SLOW_CALL_SECONDS) reaches its threshold, the breaker opens: calls fail at once with
+CircuitOpen instead of waiting for the client timeout, and callers serve a fallback. After
+BREAKER_OPEN_SECONDS one probe call is let through (half-open); if it succeeds the breaker
+closes, otherwise it stays open for another period.
+
+Each breaker counts `breaker.<name>.opened` and `.rejected` in metrics.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import metrics
+from admission import AdmissionRejected
+from jobs import JobCancelled
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# --- BREAKER CONFIGURATION ---
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))                          # Recent calls considered
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))                    # Before the breaker may open
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "10"))
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.8"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))           # Before a half-open probe
+
+# --- FALLBACK CACHE CONFIGURATION ---
+FALLBACK_CACHE_SIZE = int(os.getenv("FALLBACK_CACHE_SIZE", "2048"))              # Entries per cache
+FALLBACK_CACHE_TTL = float(os.getenv("FALLBACK_CACHE_TTL", "86400"))             # Oldest entry still served, seconds
+
+# Our own refusals say nothing about the upstream's health
+NOT_UPSTREAM_FAILURES = (AdmissionRejected, JobCancelled)
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} circuit is open (next probe in {retry_in:.0f}s)")
+        self.name = name
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 error_rate: float = BREAKER_ERROR_RATE, slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS,
+                 slow_rate: float = BREAKER_SLOW_RATE, open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._outcomes: deque = deque(maxlen=window)  # (failed, slow) per call
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _admit(self) -> bool:
+        """Whether this call is the half-open probe. Raises CircuitOpen while the breaker is open."""
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            retry_in = self._opened_at + self.open_seconds - time.monotonic()
+            if self.state == OPEN and retry_in <= 0:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+        metrics.incr(f"breaker.{self.name}.rejected")
+        raise CircuitOpen(self.name, max(0.0, retry_in))
+
+    def _trip(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        metrics.incr(f"breaker.{self.name}.opened")
+        print(f"Circuit breaker '{self.name}' opened")
+
+    def _record(self, probe: bool, failed: bool, seconds: float):
+        slow = seconds >= self.slow_call_seconds
+        with self._lock:
+            if probe:
+                self._probing = False
+                if failed or slow:
+                    self._trip()
+                else:
+                    self.state = CLOSED
+                    print(f"Circuit breaker '{self.name}' closed")
+                return
+            if self.state != CLOSED:
+                return
+            self._outcomes.append((failed, slow))
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for f, _ in self._outcomes if f)
+            slow_calls = sum(1 for _, s in self._outcomes if s)
+            if failures / calls >= self.error_rate or slow_calls / calls >= self.slow_rate:
+                self._trip()
+
+    def _release_probe(self):
+        with self._lock:
+            self._probing = False
+
+    @contextmanager
+    def guard(self):
+        """
+        Wraps one upstream call; raises CircuitOpen on entry while the breaker is open.
+        Usable around awaits as well: a cancelled call only counts if it was already slow.
+        """
+        probe = self._admit()
+        started = time.monotonic()
+        try:
+            yield
+        except NOT_UPSTREAM_FAILURES:
+            if probe:
+                self._release_probe()
+            raise
+        except asyncio.CancelledError:
+            elapsed = time.monotonic() - started
+            if elapsed >= self.slow_call_seconds:
+                self._record(probe, False, elapsed)
+            elif probe:
+                self._release_probe()
+            raise
+        except Exception:
+            self._record(probe, True, time.monotonic() - started)
+            raise
+        self._record(probe, False, time.monotonic() - started)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            outcomes = list(self._outcomes)
+            return {
+                "state": self.state,
+                "recent_calls": len(outcomes),
+                "recent_failures": sum(1 for f, _ in outcomes if f),
+                "recent_slow": sum(1 for _, s in outcomes if s),
+            }
+
+
+class TTLCache:
+    """Thread-safe LRU map whose entries expire after `ttl` seconds."""
+
+    def __init__(self, max_size: int = FALLBACK_CACHE_SIZE, ttl: float = FALLBACK_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+breakers: Dict[str, CircuitBreaker] = {name: CircuitBreaker(name) for name in ("gemini", "rag")}
+gemini = breakers["gemini"]
+rag = breakers["rag"]
+
+
+def snapshot() -> Dict:
+    return {name: b.snapshot() for name, b in breakers.items()}
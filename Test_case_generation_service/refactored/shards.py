@@ -0,0 +1,96 @@
+"""
+Multi-corpus sharding.
+
+Everything used to go into MASTER_RAG_CORPUS, so every import and query paid for the whole
+collection and one bad import held up everyone. Files can now live in several backing Vertex
+RAG corpora (shards), listed in the RAG_SHARDS_COLLECTION routing table in Firestore, one
+document per shard:
+
+    {"rag_corpus": "projects/.../ragCorpora/123",      (or the corpus display name)
+     "tenants": ["acme"], "regulators": ["HIPAA"], "types": ["pdf", "webpage"], "default": false}
+
+Writes: a corpus is routed when it is ingested, to the first shard listing its tenant, else its
+name among `regulators`, else its type, else the `default` shard, else MASTER_RAG_CORPUS. The
+choice is kept in the corpus document's "rag_corpus" field, so later updates stay in the same
+shard until that field is changed.
+
+Reads: RAG file resource names include their corpus, so each lane (lanes.py) knows which shards
+hold its files. /rag queries every (lane, shard) pair concurrently. With more than one shard in
+a lane, the shards are merged on a "normalized_score" (higher is better) computed over all of
+them together, so a weak shard's best hit does not outrank a strong shard's:
+
+  same embedding model   the raw scores compare as they are (cosine similarity for distances)
+  different models       each shard's scores become z-scores over its own ranking, mapped back
+                         onto the mean and spread of all the lane's scores
+
+With no routing table this is a single MASTER_RAG_CORPUS shard, as before.
+"""
+import os
+import re
+import statistics
+from typing import Dict, List, Optional
+
+# --- SHARD CONFIGURATION ---
+RAG_SHARDS_COLLECTION = os.getenv("RAG_SHARDS_COLLECTION", "rag_shards")
+SHARD_TABLE_TTL_SECONDS = float(os.getenv("SHARD_TABLE_TTL_SECONDS", "60"))      # Then re-read from Firestore
+CORPUS_HANDLES_TTL_SECONDS = float(os.getenv("CORPUS_HANDLES_TTL_SECONDS", "600"))
+
+_CORPUS_OF_FILE = re.compile(r'^(.*/ragCorpora/[^/]+)/ragFiles/[^/]+$')
+
+
+def corpus_of(rag_file_name: str) -> Optional[str]:
+    """The corpus resource name a RAG file belongs to, or None for a bare file id."""
+    match = _CORPUS_OF_FILE.match(rag_file_name)
+    return match.group(1) if match else None
+
+
+def route(corpus_data: Dict, table: List[Dict], fallback: str) -> str:
+    """The backing corpus for a corpus document (see above for the order of precedence)."""
+    if corpus_data.get("rag_corpus"):
+        return corpus_data["rag_corpus"]
+    keys = (("tenants", corpus_data.get("tenant")), ("regulators", corpus_data.get("name")),
+            ("types", corpus_data.get("type")))
+    for field, value in keys:
+        if value is None:
+            continue
+        for shard in table:
+            if value in (shard.get(field) or []):
+                return shard["rag_corpus"]
+    default = next((shard for shard in table if shard.get("default")), None)
+    return default["rag_corpus"] if default else fallback
+
+
+def embedding_model(corpus) -> Optional[str]:
+    """The embedding model of a RAG corpus handle ("publishers/google/models/..."), or None if unknown."""
+    config = getattr(getattr(corpus, "backend_config", None), "rag_embedding_model_config", None)
+    endpoint = getattr(config, "vertex_prediction_endpoint", None)
+    model = getattr(endpoint, "publisher_model", None) or getattr(endpoint, "endpoint", None)
+    if not isinstance(model, str) or not model:
+        return None
+    return model[model.index("publishers/"):] if "publishers/" in model else model
+
+
+def normalize(rankings: List[List[Dict]], is_distance: bool, same_model: bool) -> List[List[Dict]]:
+    """Adds "normalized_score" to the rankings of one lane's shards, comparable across all of them."""
+    relevance = [[(1 - s if is_distance else s) for s in (r.get("score") or 0.0 for r in ranking)]
+                 for ranking in rankings]
+    pooled = [v for values in relevance for v in values]
+    if not same_model and len(pooled) > 1:
+        mean, spread = statistics.fmean(pooled), statistics.pstdev(pooled)
+        for i, values in enumerate(relevance):
+            if not values:
+                continue
+            shard_mean, shard_spread = statistics.fmean(values), statistics.pstdev(values)
+            relevance[i] = [mean + ((v - shard_mean) / shard_spread if shard_spread else 0.0) * spread
+                            for v in values]
+    for ranking, values in zip(rankings, relevance):
+        for r, value in zip(ranking, values):
+            r["normalized_score"] = round(value, 4)
+    return rankings
+
+
+def gather(rankings: List[List[Dict]], limit: int) -> List[Dict]:
+    """One ranking from the normalized rankings of a lane's shards, best first."""
+    merged = [r for ranking in rankings for r in ranking]
+    merged.sort(key=lambda r: r.get("normalized_score", 0.0), reverse=True)
+    return merged[:limit]
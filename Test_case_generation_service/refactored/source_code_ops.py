@@ -0,0 +1,541 @@
+"""
+Source code ingestion engine for POST /source-code.
+
+Each job shallow-clones the repository (single branch, optionally sparse) into its own
+workspace, lists the files git tracks minus anything .gitignore excludes, drops vendored,
+minified, binary and oversized files, reads the rest in parallel and writes them into
+size-bounded shards that are uploaded to the master corpus. Files are split on top-level
+symbols by code_chunker, so each chunk in a shard names its path, symbol and line range.
+The shard manifest (which files went into which shard / RAG file) and the symbol index
+(symbol -> file:line) are stored in GCS; the symbol index is also cached locally.
+
+Updates (PUT /source-code) fetch only the trees of the last ingested commit and the new head,
+diff them, check out just the paths they need and rebuild only the shards the diff touches.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+from typing import Dict, List, Optional, Tuple
+
+from git import Repo
+from google.cloud import firestore
+
+import corpus_operations as co
+import leases
+from code_chunker import SymbolIndex, chunk_source, format_chunk_entry
+from corpus_operations import BUCKET_NAME, FIRESTORE_COLLECTION, db, storage_client
+from jobs import JobAbandoned, JobCancelled, check_cancelled
+
+# --- SOURCE CODE CONFIGURATION ---
+SOURCE_EXTENSIONS = ['.py', '.js', '.ts', '.html', '.css', '.c', '.cpp', '.java', '.go', '.rs', '.swift', '.rb', '.php', '.md']
+EXCLUDE_DIRS = {'.git', '__pycache__', 'node_modules', '.idea', '.vscode', 'venv', '.venv', 'env', '.env', 'site-packages',
+                # Vendored / generated code
+                'vendor', 'third_party', 'thirdparty', 'bower_components', 'dist', 'build', 'target', 'out', 'coverage'}
+MINIFIED_SUFFIXES = ('.min.js', '.min.css', '-min.js', '.bundle.js')
+MINIFIED_AVG_LINE_LENGTH = 300          # Files with longer average lines are treated as generated
+MAX_FILE_BYTES = int(os.getenv("SOURCE_MAX_FILE_BYTES", str(512 * 1024)))
+SHARD_MAX_BYTES = int(os.getenv("SOURCE_SHARD_MAX_BYTES", str(2 * 1024 * 1024)))
+READ_WORKERS = int(os.getenv("SOURCE_READ_WORKERS", "16"))
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT", os.path.join(os.path.abspath('.'), "workspaces"))
+SYMBOL_CACHE_DIR = os.path.join(WORKSPACE_ROOT, "symbol-index")
+
+_symbol_indexes: Dict[str, Tuple[str, SymbolIndex]] = {}   # doc_id -> (commit_sha, index)
+
+
+def source_doc_id(repo_link: str) -> str:
+    return hashlib.sha256(repo_link.encode('utf-8')).hexdigest()
+
+
+def create_workspace(prefix: str) -> str:
+    """A fresh directory per job, so concurrent jobs never share files."""
+    os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+    return tempfile.mkdtemp(prefix=prefix, dir=WORKSPACE_ROOT)
+
+
+def shallow_clone(repo_link: str, dest: str, branch: Optional[str] = None, sparse_paths: Optional[List[str]] = None) -> Repo:
+    """Depth-1, single-branch clone. With sparse_paths only those directories are checked out."""
+    kwargs = {"depth": 1, "single_branch": True}
+    if branch:
+        kwargs["branch"] = branch
+    multi_options = []
+    if sparse_paths:
+        multi_options += ['--filter=blob:none', '--sparse']
+    repo = Repo.clone_from(repo_link, dest, multi_options=multi_options or None, **kwargs)
+    if sparse_paths:
+        repo.git.sparse_checkout('set', *sparse_paths)
+    return repo
+
+
+def _split_z(output: str) -> List[str]:
+    return [p for p in output.split('\0') if p]
+
+
+def list_repo_files(repo: Repo) -> List[str]:
+    """Checked-out tracked files, minus any that .gitignore says should be excluded."""
+    tracked = _split_z(repo.git.ls_files('-z'))
+    ignored = set(_split_z(repo.git.ls_files('-z', '--cached', '--ignored', '--exclude-standard')))
+    root = repo.working_tree_dir
+    # Sparse checkouts list paths that are not on disk
+    return [p for p in tracked if p not in ignored and os.path.isfile(os.path.join(root, p))]
+
+
+def skip_reason(rel_path: str, size: int) -> Optional[str]:
+    """Why a file is left out based on its path and size alone, or None to read it."""
+    path = PurePosixPath(rel_path)
+    if any(part in EXCLUDE_DIRS for part in path.parts[:-1]):
+        return "excluded_dir"
+    if path.suffix.lower() not in SOURCE_EXTENSIONS:
+        return "extension"
+    if path.name.lower().endswith(MINIFIED_SUFFIXES):
+        return "minified"
+    if size > MAX_FILE_BYTES:
+        return "too_large"
+    return None
+
+
+def read_source_file(root: str, rel_path: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """Returns (rel_path, text, skip reason). Text is None when the file is skipped."""
+    full_path = os.path.join(root, rel_path)
+    try:
+        with open(full_path, 'rb') as f:
+            raw = f.read()
+    except OSError:
+        return rel_path, None, "unreadable"
+    if b'\0' in raw[:8192]:
+        return rel_path, None, "binary"
+    try:
+        text = raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return rel_path, None, "binary"
+    lines = text.count('\n') + 1
+    if len(text) / lines > MINIFIED_AVG_LINE_LENGTH:
+        return rel_path, None, "minified"
+    # Only trailing whitespace is stripped so chunk line numbers match the file
+    return rel_path, text.rstrip(), None
+
+
+def write_shards(entries: List[Tuple[str, str]], out_dir: str, shard_max_bytes: int = SHARD_MAX_BYTES,
+                 start_index: int = 0) -> List[Dict]:
+    """
+    Packs (path, formatted text) entries into shard files of at most shard_max_bytes
+    (a single bigger entry gets a shard of its own). Returns the shard descriptions.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    shards = []
+    current: List[Tuple[str, str]] = []
+    current_bytes = 0
+
+    def flush():
+        if not current:
+            return
+        name = f"source_code_{start_index + len(shards):04d}.txt"
+        body = "".join(text for _, text in current).encode('utf-8')
+        with open(os.path.join(out_dir, name), 'wb') as f:
+            f.write(body)
+        shards.append({
+            "name": name,
+            "path": os.path.join(out_dir, name),
+            "files": sorted({p for p, _ in current}),
+            "bytes": len(body),
+            "sha256": hashlib.sha256(body).hexdigest(),
+        })
+
+    for rel_path, text in entries:
+        size = len(text.encode('utf-8'))
+        if current and current_bytes + size > shard_max_bytes:
+            flush()
+            current, current_bytes = [], 0
+        current.append((rel_path, text))
+        current_bytes += size
+    flush()
+    return shards
+
+
+def collect_sources(repo: Repo, stats: Dict) -> List[Tuple[str, str]]:
+    """Lists, filters and reads the checked-out repository files in parallel. Returns (path, text) in path order."""
+    root = repo.working_tree_dir
+
+    start = time.perf_counter()
+    candidates = []
+    for rel_path in sorted(list_repo_files(repo)):
+        reason = skip_reason(rel_path, os.path.getsize(os.path.join(root, rel_path)))
+        if reason:
+            stats["skipped"][reason] = stats["skipped"].get(reason, 0) + 1
+        else:
+            candidates.append(rel_path)
+    stats["files_seen"] += len(candidates) + sum(stats["skipped"].values())
+    stats["timings"]["walk"] = round(time.perf_counter() - start, 2)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        results = list(executor.map(lambda p: read_source_file(root, p), candidates))
+    sources = []
+    for rel_path, text, reason in results:
+        if reason:
+            stats["skipped"][reason] = stats["skipped"].get(reason, 0) + 1
+        elif text:
+            sources.append((rel_path, text))
+            stats["files_ingested"] += 1
+            stats["bytes_ingested"] += len(text.encode('utf-8'))
+    stats["timings"]["read"] = round(time.perf_counter() - start, 2)
+    return sources
+
+
+def load_manifest(manifest_uri: str) -> Dict:
+    blob_name = manifest_uri.replace(f"gs://{BUCKET_NAME}/", "", 1)
+    return json.loads(storage_client.bucket(BUCKET_NAME).blob(blob_name).download_as_text())
+
+
+def save_manifest(doc_id: str, manifest: Dict) -> str:
+    """Stores the shard manifest in GCS (it can outgrow a Firestore document). Returns its gs:// URI."""
+    blob_name = f"source-code/{doc_id}/manifest.json"
+    storage_client.bucket(BUCKET_NAME).blob(blob_name).upload_from_string(
+        json.dumps(manifest), content_type="application/json"
+    )
+    return f"gs://{BUCKET_NAME}/{blob_name}"
+
+
+def save_symbol_index(doc_id: str, commit_sha: str, index: SymbolIndex) -> str:
+    """Stores the symbol index in GCS and the local cache. Returns its gs:// URI."""
+    data = {"commit_sha": commit_sha, **index.to_json()}
+    blob_name = f"source-code/{doc_id}/symbols.json"
+    storage_client.bucket(BUCKET_NAME).blob(blob_name).upload_from_string(
+        json.dumps(data), content_type="application/json"
+    )
+    _cache_symbol_index(doc_id, commit_sha, index, data)
+    return f"gs://{BUCKET_NAME}/{blob_name}"
+
+
+def _cache_symbol_index(doc_id: str, commit_sha: str, index: SymbolIndex, data: Optional[Dict] = None):
+    _symbol_indexes[doc_id] = (commit_sha, index)
+    try:
+        os.makedirs(SYMBOL_CACHE_DIR, exist_ok=True)
+        with open(os.path.join(SYMBOL_CACHE_DIR, f"{doc_id}.json"), 'w', encoding='utf-8') as f:
+            json.dump(data or {"commit_sha": commit_sha, **index.to_json()}, f)
+    except OSError as e:
+        print(f"Warning: Could not cache symbol index {doc_id} locally. Error: {e}")
+
+
+def load_symbol_index(repo_link: str) -> Optional[SymbolIndex]:
+    """
+    The symbol index for the commit currently recorded for repo_link: from memory, then the
+    local cache, then GCS. None if the repository has no index (e.g. ingested before chunking).
+    """
+    doc_id = source_doc_id(repo_link)
+    doc = db.collection(FIRESTORE_COLLECTION).document(doc_id).get().to_dict() or {}
+    commit_sha, symbols_uri = doc.get("commit_sha"), doc.get("symbols_uri")
+    if not symbols_uri:
+        return None
+
+    cached = _symbol_indexes.get(doc_id)
+    if cached and cached[0] == commit_sha:
+        return cached[1]
+
+    local_path = os.path.join(SYMBOL_CACHE_DIR, f"{doc_id}.json")
+    if os.path.exists(local_path):
+        with open(local_path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("commit_sha") == commit_sha:
+            index = SymbolIndex.from_json(data)
+            _symbol_indexes[doc_id] = (commit_sha, index)
+            return index
+
+    data = load_manifest(symbols_uri)
+    index = SymbolIndex.from_json(data)
+    _cache_symbol_index(doc_id, data.get("commit_sha"), index, data)
+    return index
+
+
+def drop_symbol_index(repo_link: str):
+    """Forgets the locally cached symbol index (the GCS copy goes with the source-code/<doc_id> prefix)."""
+    doc_id = source_doc_id(repo_link)
+    _symbol_indexes.pop(doc_id, None)
+    try:
+        os.remove(os.path.join(SYMBOL_CACHE_DIR, f"{doc_id}.json"))
+    except OSError:
+        pass
+
+
+def new_stats() -> Dict:
+    return {"files_seen": 0, "files_ingested": 0, "bytes_ingested": 0, "skipped": {}, "timings": {}}
+
+
+def _build_and_upload_shards(sources: List[Tuple[str, str]], workspace: str, display_name: str, chunking: Dict,
+                             stats: Dict, start_index: int = 0,
+                             rag_corpus: Optional[str] = None) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Chunks (path, text) sources on symbols, writes the chunks into shards and uploads them to `rag_corpus`.
+    Returns (shards, symbol entries). Each shard carries its rag_file_id, each entry its shard name.
+    """
+    start = time.perf_counter()
+    entries, symbols = [], []
+    for rel_path, text in sources:
+        chunks = chunk_source(rel_path, text)
+        entries.append((rel_path, "".join(format_chunk_entry(c) for c in chunks)))
+        symbols += [{k: c[k] for k in ("path", "symbol", "start_line", "end_line")} for c in chunks]
+    stats["chunks"] = stats.get("chunks", 0) + len(symbols)
+    stats["timings"]["chunk"] = round(time.perf_counter() - start, 2)
+
+    start = time.perf_counter()
+    shards = write_shards(entries, os.path.join(workspace, "shards"), start_index=start_index)
+    shard_of = {f: s["name"] for s in shards for f in s["files"]}
+    for entry in symbols:
+        entry["shard"] = shard_of[entry["path"]]
+    stats["timings"]["shard"] = round(time.perf_counter() - start, 2)
+
+    start = time.perf_counter()
+    uploaded = co.upload_files_by_path([s["path"] for s in shards], display_name, chunking=chunking,
+                                       rag_corpus=rag_corpus)
+    stats["timings"]["upload"] = round(time.perf_counter() - start, 2)
+    for shard in shards:
+        shard["rag_file_id"] = uploaded.get(shard.pop("path"))
+    return shards, symbols
+
+
+def _next_shard_index(shards: List[Dict]) -> int:
+    return max((int(s["name"].rsplit('_', 1)[-1].split('.')[0]) for s in shards), default=-1) + 1
+
+
+def create_source_code_embeddings(repo_link: str, branch: Optional[str] = None, sparse_paths: Optional[List[str]] = None):
+    """
+    The long-running task behind POST /source-code: clone, filter, read, shard and upload.
+    This runs in a background thread.
+    """
+    repo_name = repo_link.split('/')[-1]
+    doc_id = source_doc_id(repo_link)
+    doc_ref = leases.document(db.collection(FIRESTORE_COLLECTION).document(doc_id))
+    workspace = create_workspace("source-")
+    stats = new_stats()
+    print(f"--- STARTING ASYNC CREATION for source code {repo_link} ---")
+
+    try:
+        current = doc_ref.get().to_dict() or {}
+        chunking = co.chunking_for(current)
+        rag_corpus = co.route_corpus({"name": repo_name, **current})
+
+        # 1. Shallow clone into this job's workspace
+        start = time.perf_counter()
+        repo = shallow_clone(repo_link, os.path.join(workspace, "repo"), branch, sparse_paths)
+        commit_sha = repo.head.commit.hexsha
+        stats["timings"]["clone"] = round(time.perf_counter() - start, 2)
+        check_cancelled()
+
+        # 2. Filter and read files in parallel, then pack them into shards and upload
+        sources = collect_sources(repo, stats)
+        check_cancelled()
+        shards, symbols = _build_and_upload_shards(sources, workspace, repo_name, chunking, stats,
+                                                   rag_corpus=rag_corpus)
+        rag_file_ids = [s["rag_file_id"] for s in shards if s["rag_file_id"]]
+
+        manifest_uri = save_manifest(doc_id, {"commit_sha": commit_sha, "shards": shards})
+        symbols_uri = save_symbol_index(doc_id, commit_sha, SymbolIndex(symbols))
+        stats["shards"] = len(shards)
+
+        # 3. Update DB with collected information
+        doc_ref.update({
+            "rag_file_ids": rag_file_ids,
+            "commit_sha": commit_sha,
+            "branch": branch or repo.active_branch.name,
+            "sparse_paths": sparse_paths or [],
+            "rag_corpus": rag_corpus,
+            "manifest_uri": manifest_uri,
+            "symbols_uri": symbols_uri,
+            "ingest_stats": stats,
+            "chunking_applied": chunking,
+            "processing": False,
+            "embeddings_available": True if len(rag_file_ids) else False
+        })
+        print(f"--- ASYNC CREATION COMPLETE for {repo_link}: {stats} ---")
+
+    except JobCancelled:
+        # Partial uploads are deleted by the uploader; the workspace goes in `finally`
+        _mark_cancelled(doc_ref)
+    except Exception as e:
+        print(f"Fatal error during async creation of {repo_link}: {e}")
+        doc_ref.update({
+            "processing": False,
+            "embeddings_available": False,
+            "error": str(e)
+        })
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+# --- INCREMENTAL UPDATES ---
+
+def fetch_commit_trees(repo_link: str, dest: str, old_sha: str, branch: str) -> Tuple[Repo, str]:
+    """
+    Fetches only the commit/tree objects of `old_sha` and the tip of `branch` (no file contents,
+    no history). Blobs are fetched lazily later, for the paths that are checked out.
+    Returns (repo, new_sha).
+    """
+    repo = Repo.init(dest)
+    repo.create_remote('origin', repo_link)
+    # Mark origin as a partial-clone promisor so missing blobs are fetched on demand
+    repo.git.config('core.repositoryformatversion', '1')
+    repo.git.config('extensions.partialClone', 'origin')
+    repo.git.config('remote.origin.promisor', 'true')
+    repo.git.config('remote.origin.partialclonefilter', 'blob:none')
+    repo.git.config('core.sparseCheckout', 'true')
+    repo.git.fetch('--depth=1', '--filter=blob:none', '--no-tags', 'origin', old_sha)
+    repo.git.fetch('--depth=1', '--filter=blob:none', '--no-tags', 'origin', branch)
+    return repo, repo.git.rev_parse('FETCH_HEAD')
+
+
+def diff_paths(repo: Repo, old_sha: str, new_sha: str, sparse_paths: Optional[List[str]] = None) -> Tuple[List[str], List[str]]:
+    """Returns (added or modified paths, deleted paths) between two commits, limited to sparse_paths if set."""
+    args = ['--name-status', '--no-renames', '-z', old_sha, new_sha]
+    if sparse_paths:
+        args += ['--', *sparse_paths]
+    fields = _split_z(repo.git.diff(*args))
+    changed, deleted = [], []
+    for status, path in zip(fields[0::2], fields[1::2]):
+        (deleted if status.startswith('D') else changed).append(path)
+    return changed, deleted
+
+
+def checkout_paths(repo: Repo, sha: str, paths: List[str]):
+    """Checks out only `paths` (plus .gitignore files, so ignore rules still apply) at `sha`."""
+    patterns = ['.gitignore'] + ['/' + p for p in paths]
+    os.makedirs(os.path.join(repo.git_dir, 'info'), exist_ok=True)
+    with open(os.path.join(repo.git_dir, 'info', 'sparse-checkout'), 'w', encoding='utf-8') as f:
+        f.write("\n".join(patterns) + "\n")
+    repo.git.checkout('--detach', sha)
+
+
+def update_source_code_embeddings(repo_link: str):
+    """
+    The long-running task behind PUT /source-code. Re-uploads only the shards that contain
+    changed or deleted files (plus new shards for added files) and deletes the stale RAG files.
+    Falls back to a full re-ingest if the previous commit can no longer be fetched.
+    This runs in a background thread.
+    """
+    repo_name = repo_link.split('/')[-1]
+    doc_id = source_doc_id(repo_link)
+    doc_ref = leases.document(db.collection(FIRESTORE_COLLECTION).document(doc_id))
+    workspace = create_workspace("source-update-")
+    stats = new_stats()
+    print(f"--- STARTING ASYNC UPDATE for source code {repo_link} ---")
+
+    try:
+        current = doc_ref.get().to_dict() or {}
+        old_sha, branch = current.get("commit_sha"), current.get("branch")
+        sparse_paths = current.get("sparse_paths") or None
+        chunking = co.chunking_for(current)
+        rag_corpus = co.route_corpus({"name": repo_name, **current})
+
+        start = time.perf_counter()
+        try:
+            if not (old_sha and branch and current.get("manifest_uri")):
+                raise ValueError("no previous commit recorded")
+            repo, new_sha = fetch_commit_trees(repo_link, os.path.join(workspace, "repo"), old_sha, branch)
+        except Exception as e:
+            print(f"Incremental fetch not possible for {repo_link} ({e}); re-ingesting everything.")
+            _replace_everything(repo_link, current)
+            return
+        stats["timings"]["fetch"] = round(time.perf_counter() - start, 2)
+        check_cancelled()
+
+        if new_sha == old_sha and chunking == current.get("chunking_applied", chunking):
+            print(f"--- ASYNC UPDATE SKIPPED for {repo_link}: already at {new_sha} ---")
+            doc_ref.update({"processing": False, "embeddings_available": bool(current.get("rag_file_ids"))})
+            return
+
+        manifest = load_manifest(current["manifest_uri"])
+        shards = manifest["shards"]
+        if chunking != current.get("chunking_applied", chunking):
+            # New chunk settings apply to every shard
+            changed, deleted = [f for s in shards for f in s["files"]], []
+        else:
+            changed, deleted = diff_paths(repo, old_sha, new_sha, sparse_paths)
+        stats["changed_paths"], stats["deleted_paths"] = len(changed), len(deleted)
+
+        # 1. Shards holding a changed or deleted file are rebuilt; the rest are kept as-is
+        touched = set(changed) | set(deleted)
+        affected = [s for s in shards if touched.intersection(s["files"])]
+        kept = [s for s in shards if s not in affected]
+        needed = (set(changed) | {f for s in affected for f in s["files"]}) - set(deleted)
+
+        # 2. Check out and read only those paths at the new commit
+        start = time.perf_counter()
+        checkout_paths(repo, new_sha, sorted(needed))
+        stats["timings"]["checkout"] = round(time.perf_counter() - start, 2)
+        sources = collect_sources(repo, stats)
+        check_cancelled()
+
+        # 3. Upload replacement shards before deleting the stale ones
+        new_shards, new_symbols = _build_and_upload_shards(sources, workspace, repo_name, chunking, stats,
+                                                           start_index=_next_shard_index(shards),
+                                                           rag_corpus=rag_corpus)
+        if any(not s["rag_file_id"] for s in new_shards):
+            raise RuntimeError("some shards failed to upload; keeping the previous version")
+        try:
+            check_cancelled()
+        except (JobCancelled, JobAbandoned):
+            # Last point to back out: the previous shards are still in place (and once abandoned,
+            # nothing would record these)
+            co.delete_rag_files([s["rag_file_id"] for s in new_shards])
+            raise
+        co.delete_rag_files([shard["rag_file_id"] for shard in affected if shard.get("rag_file_id")])
+
+        shards = kept + new_shards
+        rag_file_ids = [s["rag_file_id"] for s in shards if s["rag_file_id"]]
+        manifest_uri = save_manifest(doc_id, {"commit_sha": new_sha, "shards": shards})
+        # Symbols of every re-read or deleted file are replaced; the rest carry over
+        symbol_index = (load_symbol_index(repo_link) or SymbolIndex()).drop_paths(touched | needed)
+        for entry in new_symbols:
+            symbol_index.add(entry)
+        symbols_uri = save_symbol_index(doc_id, new_sha, symbol_index)
+        stats.update({"shards": len(shards), "shards_rebuilt": len(affected), "shards_added": len(new_shards)})
+
+        doc_ref.update({
+            "rag_file_ids": rag_file_ids,
+            "commit_sha": new_sha,
+            "rag_corpus": rag_corpus,
+            "manifest_uri": manifest_uri,
+            "symbols_uri": symbols_uri,
+            "ingest_stats": stats,
+            "chunking_applied": chunking,
+            "processing": False,
+            "embeddings_available": True if len(rag_file_ids) else False
+        })
+        print(f"--- ASYNC UPDATE COMPLETE for {repo_link} ({old_sha[:8]} -> {new_sha[:8]}): {stats} ---")
+
+    except JobCancelled:
+        _mark_cancelled(doc_ref)
+    except Exception as e:
+        print(f"Fatal error during async update of {repo_link}: {e}")
+        doc_ref.update({
+            "processing": False,
+            "embeddings_available": bool((doc_ref.get().to_dict() or {}).get("rag_file_ids")),
+            "error": str(e)
+        })
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def _mark_cancelled(doc_ref):
+    """Ends a cancelled job. Whatever RAG files the document still lists remain searchable."""
+    doc_ref.update({
+        "processing": False,
+        "embeddings_available": bool((doc_ref.get().to_dict() or {}).get("rag_file_ids")),
+        "error": "Cancelled",
+        "cancelled_at": firestore.SERVER_TIMESTAMP,
+    })
+    print(f"--- JOB CANCELLED for {doc_ref.id} ---")
+
+
+def _replace_everything(repo_link: str, current: Dict):
+    """Full re-ingest: build everything from a fresh clone, then drop the previous RAG files."""
+    old_ids = set(current.get("rag_file_ids") or [])
+    create_source_code_embeddings(repo_link, current.get("branch"), current.get("sparse_paths") or None)
+    new_ids = set((db.collection(FIRESTORE_COLLECTION).document(source_doc_id(repo_link)).get().to_dict() or {})
+                  .get("rag_file_ids") or [])
+    if not new_ids:
+        return
+    co.delete_rag_files(sorted(old_ids - new_ids))
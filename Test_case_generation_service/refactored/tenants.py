@@ -0,0 +1,254 @@
+"""
+Tenants: several product teams sharing one deployment.
+
+A request's tenant comes from its API key (X-API-Key) or, behind a gateway that authenticates
+callers itself, from the X-Tenant header (TENANT_TRUST_HEADER=true). Requests with neither
+belong to the `default` tenant unless TENANT_REQUIRED=true, the default once TENANTS is set; an
+unknown key or tenant gets 401. Tenants are configured in TENANTS (JSON); every limit is optional:
+
+    {"payments": {"api_keys": ["..."], "max_concurrency": 8, "max_queue": 16, "max_wait": 5,
+                  "tokens_per_minute": 200000},
+     "claims":   {"api_keys": ["..."]}}
+
+The tenant is kept in a context variable for the request, like the deadline (deadline.py), and
+jobs started by the request run as the same tenant. It scopes:
+
+  corpora    documents a tenant creates carry its name in "tenant"; other tenants cannot see,
+             update or delete them. Documents without one (the default tenant's, and everything
+             created before tenants) are shared: every tenant can read them, only the default
+             tenant can change them. Corpus names stay unique across tenants.
+  retrieval  lanes search only the files of the tenant's corpora and the shared ones, and
+             shards can be routed by tenant (shards.py)
+  caches     request keys (so coalescing, cached enhancements and results), the local fallback
+             index and the /chunks cache are namespaced per tenant
+  quota      at most max_concurrency retrieval/generation requests per tenant run at once and
+             max_queue more wait up to max_wait seconds; Gemini tokens are paced to
+             tokens_per_minute. Over either, a request gets 429 with Retry-After; background
+             jobs wait for their tenant's budget instead.
+  admin      GET /jobs lists only the jobs of the tenant's corpora. POST /refresh and the
+             process-wide GET /metrics are for the ADMIN_TENANT (`default`, so give it an API key
+             in TENANTS); other tenants get 403 and their own block of /metrics.
+
+Counts `tenant.<name>.requests`, `.rejected`, `.latency_ms` (summed) and `.gemini_tokens` in
+metrics; GET /metrics adds each tenant's in-flight requests, mean latency and budget left.
+"""
+import asyncio
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+import jobs
+import metrics
+from admission import POLL_SECONDS, AdmissionRejected, Lane, TokenBucket
+
+DEFAULT_TENANT = "default"
+API_KEY_HEADER = "X-API-Key"
+TENANT_HEADER = "X-Tenant"
+
+# --- TENANT CONFIGURATION ---
+TENANTS = json.loads(os.getenv("TENANTS") or "{}")
+TENANT_REQUIRED = os.getenv("TENANT_REQUIRED", "true" if TENANTS else "false").lower() == "true"  # Reject requests without a tenant
+ADMIN_TENANT = os.getenv("ADMIN_TENANT", DEFAULT_TENANT)                           # May refresh and read all metrics
+TENANT_TRUST_HEADER = os.getenv("TENANT_TRUST_HEADER", "false").lower() == "true"  # Accept X-Tenant without a key
+TENANT_MAX_CONCURRENCY = int(os.getenv("TENANT_MAX_CONCURRENCY", "16"))             # Defaults for each tenant
+TENANT_MAX_QUEUE = int(os.getenv("TENANT_MAX_QUEUE", "32"))
+TENANT_MAX_WAIT = float(os.getenv("TENANT_MAX_WAIT", "10"))
+TENANT_TOKENS_PER_MINUTE = int(os.getenv("TENANT_TOKENS_PER_MINUTE", "0"))          # 0: no token budget
+
+
+class UnknownTenant(Exception):
+    """The request's API key or tenant is not configured (or it has none and one is required)."""
+
+
+class Tenant:
+    def __init__(self, name: str, api_keys=(), max_concurrency: int = TENANT_MAX_CONCURRENCY,
+                 max_queue: int = TENANT_MAX_QUEUE, max_wait: float = TENANT_MAX_WAIT,
+                 tokens_per_minute: int = TENANT_TOKENS_PER_MINUTE):
+        self.name = name
+        self.api_keys = set(api_keys)
+        self.requests = Lane(max_concurrency, max_queue, max_wait)
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def tag(self) -> Optional[str]:
+        """The "tenant" field of the corpora this tenant creates (None: shared)."""
+        return None if self.name == DEFAULT_TENANT else self.name
+
+    def namespace(self, key: str) -> str:
+        """`key` in this tenant's cache namespace (the default tenant's keys are unchanged)."""
+        return key if self.tag is None else f"{self.name}:{key}"
+
+    def sees(self, corpus_data: Optional[Dict]) -> bool:
+        return (corpus_data or {}).get("tenant") in (None, self.tag)
+
+    def owns(self, corpus_data: Optional[Dict]) -> bool:
+        return (corpus_data or {}).get("tenant") == self.tag
+
+    @property
+    def is_admin(self) -> bool:
+        return self.name == ADMIN_TENANT
+
+    def _rejected(self, reason: str, retry_after: int) -> AdmissionRejected:
+        metrics.incr(f"tenant.{self.name}.rejected")
+        return AdmissionRejected(f"tenant {self.name} {reason}", retry_after)
+
+    def _enter(self):
+        if not self.requests.enter_queue():
+            raise self._rejected("has too many requests queued", max(1, math.ceil(self.requests.max_wait)))
+
+    def _admitted(self) -> float:
+        with self._lock:
+            self.in_flight += 1
+        metrics.incr(f"tenant.{self.name}.requests")
+        return time.monotonic()
+
+    def release(self, started: float):
+        """Ends a request admitted with `admit()`."""
+        with self._lock:
+            self.in_flight -= 1
+        self.requests.slots.release()
+        metrics.incr(f"tenant.{self.name}.latency_ms", round((time.monotonic() - started) * 1000))
+
+    def admit(self) -> float:
+        """Waits for one of the tenant's request slots. Returns the start time to pass to `release()`."""
+        self._enter()
+        try:
+            acquired = self.requests.slots.acquire(timeout=self.requests.max_wait)
+        finally:
+            self.requests.leave_queue()
+        if not acquired:
+            raise self._rejected(f"had no free request slot within {self.requests.max_wait:g}s", 1)
+        return self._admitted()
+
+    @contextmanager
+    def request_slot(self):
+        started = self.admit()
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    async def admit_async(self) -> float:
+        """`admit()` for the event loop: polls for the slot instead of blocking."""
+        self._enter()
+        try:
+            deadline = time.monotonic() + self.requests.max_wait
+            while not self.requests.slots.acquire(blocking=False):
+                if time.monotonic() >= deadline:
+                    raise self._rejected(f"had no free request slot within {self.requests.max_wait:g}s", 1)
+                await asyncio.sleep(POLL_SECONDS)
+        finally:
+            self.requests.leave_queue()
+        return self._admitted()
+
+    @asynccontextmanager
+    async def request_slot_async(self):
+        started = await self.admit_async()
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    def check_budget(self):
+        """Before a Gemini call: 429 if the tenant has spent its tokens; a background job waits instead."""
+        if self.tokens is None:
+            return
+        wait = self.tokens.debt_seconds()
+        while wait and jobs.in_job():
+            if jobs.current_token().wait(wait):
+                jobs.check_cancelled()
+            wait = self.tokens.debt_seconds()
+        if wait:
+            raise self._rejected("is over its Gemini token budget", max(1, math.ceil(wait)))
+
+    def charge(self, response):
+        """Spends the tokens a Gemini response (or the last chunk of a stream) reports."""
+        usage = getattr(response, "usage_metadata", None)
+        used = getattr(usage, "total_token_count", None) or 0
+        if not used:
+            return
+        metrics.incr(f"tenant.{self.name}.gemini_tokens", used)
+        if self.tokens is not None:
+            self.tokens.spend(used)
+
+    def snapshot(self) -> Dict:
+        requests = metrics.get(f"tenant.{self.name}.requests")
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.requests.waiting,
+            "requests": requests,
+            "rejected": metrics.get(f"tenant.{self.name}.rejected"),
+            "mean_latency_ms": round(metrics.get(f"tenant.{self.name}.latency_ms") / requests) if requests else 0,
+            "gemini_tokens": metrics.get(f"tenant.{self.name}.gemini_tokens"),
+            "token_budget_left": round(self.tokens.level) if self.tokens is not None else None,
+        }
+
+
+tenants: Dict[str, Tenant] = {DEFAULT_TENANT: Tenant(DEFAULT_TENANT, **TENANTS.get(DEFAULT_TENANT, {}))}
+tenants.update({name: Tenant(name, **spec) for name, spec in TENANTS.items() if name != DEFAULT_TENANT})
+default = tenants[DEFAULT_TENANT]
+_by_key = {key: tenant for tenant in tenants.values() for key in tenant.api_keys}
+_tenants_lock = threading.Lock()
+
+_tenant: contextvars.ContextVar[Tenant] = contextvars.ContextVar("tenant", default=default)
+
+
+def resolve(headers) -> Tenant:
+    """The tenant a request's headers identify, else UnknownTenant."""
+    key = headers.get(API_KEY_HEADER)
+    if key:
+        if key not in _by_key:
+            raise UnknownTenant("Unknown API key.")
+        return _by_key[key]
+    name = headers.get(TENANT_HEADER) if TENANT_TRUST_HEADER else None
+    if name:
+        if name not in tenants:
+            raise UnknownTenant(f"Unknown tenant '{name}'.")
+        return tenants[name]
+    if TENANT_REQUIRED:
+        raise UnknownTenant(f"Missing {API_KEY_HEADER} header.")
+    return default
+
+
+def of(corpus_data: Optional[Dict]) -> Tenant:
+    """The tenant a corpus document belongs to; one no longer configured gets the default limits."""
+    name = (corpus_data or {}).get("tenant") or DEFAULT_TENANT
+    with _tenants_lock:
+        if name not in tenants:
+            tenants[name] = Tenant(name)
+        return tenants[name]
+
+
+def current() -> Tenant:
+    return _tenant.get()
+
+
+def enter(tenant: Tenant) -> contextvars.Token:
+    """Makes `tenant` current until `leave(token)`; for request hooks that cannot use `scope`."""
+    return _tenant.set(tenant)
+
+
+def leave(token: contextvars.Token):
+    _tenant.reset(token)
+
+
+@contextmanager
+def scope(tenant: Tenant):
+    token = enter(tenant)
+    try:
+        yield
+    finally:
+        leave(token)
+
+
+def snapshot() -> Dict:
+    with _tenants_lock:
+        configured = list(tenants.values())
+    return {tenant.name: tenant.snapshot() for tenant in configured}
@@ -0,0 +1,184 @@
+"""
+Server-side test case generation (POST /generate-test-cases).
+
+Retrieval and the structured Gemini call both run here, so the browser makes one request
+instead of calling /rag and then re-uploading the retrieved context to Gemini. The response is
+streamed as newline-delimited JSON; each test case is sent as soon as its object is complete
+in Gemini's streamed output:
+
+    {"event": "context", "sources": [...], "degraded": [...]}    retrieval done
+    {"event": "test_case", "test_case": {...}}                   one per test case
+    {"event": "feature_gaps", "feature_gaps": [...]}
+    {"event": "error", "message": ...}                           generation failed part-way
+    {"event": "done", "test_cases": n, "elapsed_ms": ...}        always last
+
+The schema is the one the browser used to send to Gemini, and matches `TestCase` in types.ts.
+"""
+import json
+import time
+from typing import Dict, Iterator, List, Literal, Optional
+
+from google.genai.types import GenerateContentConfig
+from pydantic import BaseModel, Field, ValidationError
+
+import admission
+import tenants
+from corpus_operations import client
+
+GENERATION_MODEL = "gemini-2.5-flash"
+
+
+class TestCase(BaseModel):
+    id: str = Field(description="A unique identifier for the test case, e.g., 'DUS-3-TC01'.")
+    title: str = Field(description="A short, descriptive title for the test case.")
+    description: str = Field(description="A clear explanation of what the test verifies.")
+    type: Literal['Positive', 'Negative', 'Neutral'] = Field(description="The type of test case.")
+    priority: Literal['High', 'Medium', 'Low'] = Field(description="The priority of the test case.")
+    status: Literal['Pass', 'Fail', 'Blocked', 'Draft'] = Field(description="The status of the test case.")
+    preconditions: List[str] = Field(description="Necessary states before the test can run.")
+    steps: List[str] = Field(description="A numbered list of actions to perform.")
+    expectedResults: List[str] = Field(description="The anticipated outcome of each step or the overall test.")
+    traceability: List[str] = Field(default_factory=list, description="Links to the specific sections or documents in the compliance documentation.")
+
+
+class TestCaseGeneration(BaseModel):
+    # testCases comes first so Gemini emits (and we stream) them before the gap analysis
+    testCases: List[TestCase] = Field(description="An array of generated test cases.")
+    featureGaps: List[str] = Field(description="A list of strings identifying any remaining ambiguities, missing details, or unclear aspects in the original requirements.")
+
+
+class StreamedArrayParser:
+    """
+    Pulls complete elements out of the JSON array under `key` while the document is still
+    arriving, e.g. {"testCases": [{...}, {...  yields the first object before the second ends.
+    """
+
+    def __init__(self, key: str):
+        self.marker = f'"{key}"'
+        self.text = ""
+        self.pos = 0          # Next character to scan
+        self.in_array = False
+        self.finished = False
+        self.depth = 0        # Nesting inside the current element
+        self.start = None     # Where the current element began
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk: str) -> List[Dict]:
+        self.text += chunk
+        items = []
+        if not self.in_array:
+            found = self.text.find(self.marker)
+            bracket = self.text.find("[", found) if found >= 0 else -1
+            if bracket < 0:
+                return items
+            self.in_array, self.pos = True, bracket + 1
+        while not self.finished and self.pos < len(self.text):
+            ch = self.text[self.pos]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                if self.depth == 0:
+                    self.start = self.pos
+                self.depth += 1
+            elif ch in "}]":
+                if self.depth == 0:  # The array itself closed
+                    self.finished = True
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        items.append(json.loads(self.text[self.start:self.pos + 1]))
+            self.pos += 1
+        return items
+
+
+def build_prompt(requirements: str, context: str, open_api_schema: Optional[str] = None,
+                 clarifications: Optional[str] = None) -> str:
+    """The generation prompt the browser used to send, with the retrieved context filled in server-side."""
+    open_api = f"**OpenAPI Schema (Optional):**\n---\n{open_api_schema}\n---" if open_api_schema else ""
+    clarified = f"**Additional Clarifications from User:**\n---\n{clarifications}\n---" if clarifications else ""
+    return f"""
+You are an expert QA engineer specializing in generating detailed, structured test cases from software requirements.
+Your primary task is to generate a comprehensive set of test cases based on the provided requirements, any additional clarifications, and the retrieved context below.
+
+**Instructions:**
+1.  Analyze the user requirements below.
+2.  If an OpenAPI schema is provided, use it to understand API endpoints, request/response structures, and constraints for more detailed and accurate test cases.
+3.  If additional clarifications are provided by the user, take them into account to resolve ambiguities.
+4.  Use the following retrieved context from compliance documentation and source code as additional information:
+---
+{context}
+---
+For each test case, you **MUST** generate the following fields:
+    -   **Test Case ID**: A unique identifier (e.g., 'TC-LOGIN-01').
+    -   **Title**: A short, descriptive title.
+    -   **Description**: A clear explanation of what the test verifies.
+    -   **Test Steps**: A clear, sequential list of actions to perform.
+    -   **Expected Results**: The specific, verifiable outcome expected after executing the steps.
+    -   **Priority**: Assign a priority of 'High', 'Medium', or 'Low'.
+    -   **Traceability**: Add the relevant source_uri(s) from the context above for each test case. If multiple apply, join with commas. If none, use 'N/A'.Examples : [HIPAA,GDPR]  use the source_uri(s) that are most relevant to the test case.
+5.  Also, for each test case, provide:
+    -   A category: 'Positive', 'Negative', or 'Neutral'.
+    -   An initial status of 'Draft'.
+    -   A list of preconditions.
+6.  After generating test cases, identify any remaining ambiguities or gaps in the requirements and list them in a 'Feature Gap Analysis'.
+7.  Return the entire response as a single JSON object matching the provided schema.
+
+**User Requirements:**
+---
+{requirements}
+---
+
+{open_api}
+
+{clarified}
+"""
+
+
+def generate_test_cases_stream(requirements: str, retrieved: List[Dict], degraded: List[str],
+                               open_api_schema: Optional[str] = None,
+                               clarifications: Optional[str] = None) -> Iterator[Dict]:
+    """
+    Streams the events described above for chunks already retrieved for `requirements`.
+    Test cases without traceability get the retrieved source URIs (or 'N/A'), as the client used to do.
+    """
+    started = time.monotonic()
+    sources = list(dict.fromkeys(r["source_uri"] for r in retrieved if r.get("source_uri")))
+    yield {"event": "context", "sources": sources, "degraded": degraded}
+
+    prompt = build_prompt(requirements, "\n\n".join(r["text"] for r in retrieved), open_api_schema, clarifications)
+    config = GenerateContentConfig(response_mime_type="application/json", response_schema=TestCaseGeneration)
+    parser = StreamedArrayParser("testCases")
+    count = 0
+    tenant, chunk = tenants.current(), None
+    try:
+        tenant.check_budget()
+        with admission.gemini.slot():
+            for chunk in client.models.generate_content_stream(model=GENERATION_MODEL, contents=[prompt], config=config):
+                for item in parser.feed(chunk.text or ""):
+                    try:
+                        test_case = TestCase.model_validate(item).model_dump()
+                    except ValidationError as e:
+                        print(f"Skipping malformed test case from the model: {e}")
+                        continue
+                    test_case["traceability"] = test_case["traceability"] or sources or ["N/A"]
+                    count += 1
+                    yield {"event": "test_case", "test_case": test_case}
+        tenant.charge(chunk)  # The last chunk reports the usage of the whole stream
+        try:
+            feature_gaps = json.loads(parser.text).get("featureGaps", [])
+        except ValueError:
+            print("Generated output was not complete JSON; no feature gaps to report.")
+            feature_gaps = []
+        yield {"event": "feature_gaps", "feature_gaps": feature_gaps}
+    except Exception as e:
+        print(f"An error occurred during test case generation: {e}")
+        yield {"event": "error", "message": str(e)}
+    yield {"event": "done", "test_cases": count, "elapsed_ms": round((time.monotonic() - started) * 1000)}
@@ -1,5 +1,6 @@
 import React, { useState } from 'react';
 import { Plus, X, Loader2, CheckCircle, AlertCircle } from 'lucide-react';
+import { ragServiceHeaders } from '../services/geminiService';
 
 export default function CorpusManager() {
   // Source code corpus state
@@ -16,7 +17,7 @@ export default function CorpusManager() {
     try {
       const response = await fetch(`${baseUrl}/source-code`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: ragServiceHeaders(),
         body: JSON.stringify({ link: sourceCodeUrl.trim() })
       });
       if (response.status === 202) {
@@ -33,7 +34,7 @@ export default function CorpusManager() {
     try {
       const response = await fetch(`${baseUrl}/source-code`, {
         method: 'DELETE',
-        headers: { 'Content-Type': 'application/json' },
+        headers: ragServiceHeaders(),
         body: JSON.stringify({ link })
       });
       if (response.ok) {
@@ -59,6 +60,7 @@ export default function CorpusManager() {
     try {
       const response = await fetch(`${baseUrl}/corpus/${encodeURIComponent(name)}`, {
         method: 'DELETE',
+        headers: ragServiceHeaders({}),
       });
       if (response.ok) {
         setCorpusList((prev) => prev.filter((n) => n !== name));
@@ -75,7 +77,7 @@ export default function CorpusManager() {
     const fetchCorpus = async () => {
       setCorpusLoading(true);
       try {
-        const response = await fetch(`${baseUrl}/corpus`);
+        const response = await fetch(`${baseUrl}/corpus`, { headers: ragServiceHeaders({}) });
         if (response.ok) {
           const data = await response.json();
           if (Array.isArray(data)) {
@@ -120,9 +122,7 @@ export default function CorpusManager() {
     try {
       const response = await fetch(`${baseUrl}/corpus`, {
         method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
+        headers: ragServiceHeaders(),
         body: JSON.stringify({
           corpus_name: corpusName.trim(),
           link: sourceUrl.trim(),
@@ -1,5 +1,13 @@
 import { GoogleGenAI, Type } from "@google/genai";
-import { TestCase } from '../types';
+import { RagResult, RagStreamEvent, TestCase, TestCaseStreamEvent } from '../types';
+
+// Backend service; override with RAG_SERVICE_URL in .env.local (see vite.config.ts)
+const RAG_SERVICE_URL = process.env.RAG_SERVICE_URL || 'https://tc-gen-ai-550827394009.us-east4.run.app';
+
+/** Headers for backend calls; RAG_SERVICE_API_KEY selects the tenant (see tenants.py in the backend). */
+export function ragServiceHeaders(headers: Record<string, string> = { 'Content-Type': 'application/json' }): Record<string, string> {
+    return process.env.RAG_SERVICE_API_KEY ? { ...headers, 'X-API-Key': process.env.RAG_SERVICE_API_KEY } : headers;
+}
 
 let aiInstance: GoogleGenAI;
 
@@ -19,38 +27,6 @@ const clarificationQuestionsSchema = {
     items: { type: Type.STRING }
 };
 
-const testCaseGenerationSchema = {
-    type: Type.OBJECT,
-    properties: {
-        featureGaps: {
-            type: Type.ARRAY,
-            description: "A list of strings identifying any remaining ambiguities, missing details, or unclear aspects in the original requirements.",
-            items: { type: Type.STRING }
-        },
-        testCases: {
-            type: Type.ARRAY,
-            description: "An array of generated test cases.",
-            items: {
-                type: Type.OBJECT,
-                properties: {
-                    id: { type: Type.STRING, description: "A unique identifier for the test case, e.g., 'DUS-3-TC01'." },
-                    title: { type: Type.STRING, description: "A short, descriptive title for the test case." },
-                    description: { type: Type.STRING, description: "A clear explanation of what the test verifies." },
-                    type: { type: Type.STRING, enum: ['Positive', 'Negative', 'Neutral'], description: "The type of test case." },
-                    priority: { type: Type.STRING, enum: ['High', 'Medium', 'Low'], description: "The priority of the test case." },
-                    status: { type: Type.STRING, enum: ['Pass', 'Fail', 'Blocked', 'Draft'], description: "The status of the test case." },
-                    preconditions: { type: Type.ARRAY, items: { type: Type.STRING }, description: "Necessary states before the test can run." },
-                    steps: { type: Type.ARRAY, items: { type: Type.STRING }, description: "A numbered list of actions to perform." },
-                    expectedResults: { type: Type.ARRAY, items: { type: Type.STRING }, description: "The anticipated outcome of each step or the overall test." },
-                    traceability: { type: Type.ARRAY, items: { type: Type.STRING }, description: "Links to the specific sections or documents in the compliance documentation." }
-                },
-                required: ["id", "title", "description", "type", "priority", "status", "preconditions", "steps", "expectedResults"]
-            }
-        }
-    },
-    required: ["featureGaps", "testCases"]
-};
-
 export async function getClarificationQuestions(requirements: string, openApiSchema?: string): Promise<string[]> {
     const ai = getAiClient();
     const prompt = `
@@ -89,85 +65,113 @@ export async function getClarificationQuestions(requirements: string, openApiSch
 }
 
 
-export async function generateTestCases(requirements: string, openApiSchema?: string, clarifications?: string): Promise<{ testCases: TestCase[]; featureGaps: string[] }> {
-    // Step 1: Call /rag endpoint to get context and traceability
-    const ragResponse = await fetch('https://tc-gen-ai-550827394009.us-east4.run.app/rag', {
+/** Feeds each line of a newline-delimited JSON response body to `onEvent` as it arrives. */
+async function readNdjson<T>(response: Response, onEvent: (event: T) => void): Promise<void> {
+    if (!response.body) {
+        throw new Error('Response has no body to stream');
+    }
+    const handle = (line: string) => {
+        if (line.trim()) onEvent(JSON.parse(line) as T);
+    };
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop() ?? '';
+        lines.forEach(handle);
+    }
+    handle(buffered + decoder.decode());
+}
+
+/**
+ * Calls POST /rag/stream and hands each event to `onEvent` as soon as its line arrives
+ * (raw-query chunks, sub-queries, each sub-query's chunks, fused ranking, done).
+ * Resolves with the fused ranking, or the raw-query chunks if the stream ended early.
+ */
+export async function streamRag(
+    requirement: string,
+    onEvent: (event: RagStreamEvent) => void = () => {},
+    signal?: AbortSignal,
+): Promise<RagResult[]> {
+    const response = await fetch(`${RAG_SERVICE_URL}/rag/stream`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ requirement: requirements })
+        headers: ragServiceHeaders(),
+        body: JSON.stringify({ requirement }),
+        signal,
     });
-    let ragResults: Array<{ score: number; source_uri: string; text: string }> = [];
-    if (ragResponse.ok) {
-        const ragJson = await ragResponse.json();
-        if (ragJson && ragJson.results && Array.isArray(ragJson.results)) {
-            ragResults = ragJson.results;
-        }
+    if (!response.ok) {
+        throw new Error(`/rag/stream failed with status ${response.status}`);
     }
-    // Gather all context text and source_uris
-    const additionalContext = ragResults.map(r => r.text).join('\n\n');
-    const traceabilityUris = ragResults.map(r => r.source_uri);
-
-    // Step 2: Generate test cases with context and traceability
-    const ai = getAiClient();
-    const prompt = `
-        You are an expert QA engineer specializing in generating detailed, structured test cases from software requirements.
-        Your primary task is to generate a comprehensive set of test cases based on the provided requirements, any additional clarifications, and the retrieved context below.
-
-        **Instructions:**
-        1.  Analyze the user requirements below.
-        2.  If an OpenAPI schema is provided, use it to understand API endpoints, request/response structures, and constraints for more detailed and accurate test cases.
-        3.  If additional clarifications are provided by the user, take them into account to resolve ambiguities.
-        4.  Use the following retrieved context from compliance documentation and source code as additional information:
-        ---
-        ${additionalContext}
-        ---
-        For each test case, you **MUST** generate the following fields:
-            -   **Test Case ID**: A unique identifier (e.g., 'TC-LOGIN-01').
-            -   **Title**: A short, descriptive title.
-            -   **Description**: A clear explanation of what the test verifies.
-            -   **Test Steps**: A clear, sequential list of actions to perform.
-            -   **Expected Results**: The specific, verifiable outcome expected after executing the steps.
-            -   **Priority**: Assign a priority of 'High', 'Medium', or 'Low'.
-            -   **Traceability**: Add the relevant source_uri(s) from the context above for each test case. If multiple apply, join with commas. If none, use 'N/A'.Examples : [HIPAA,GDPR]  use the source_uri(s) that are most relevant to the test case.
-        5.  Also, for each test case, provide:
-            -   A category: 'Positive', 'Negative', or 'Neutral'.
-            -   An initial status of 'Draft'.
-            -   A list of preconditions.
-        6.  After generating test cases, identify any remaining ambiguities or gaps in the requirements and list them in a 'Feature Gap Analysis'.
-        7.  Return the entire response as a single JSON object matching the provided schema.
-
-        **User Requirements:**
-        ---
-        ${requirements}
-        ---
-
-        ${openApiSchema ? `**OpenAPI Schema (Optional):**\n---\n${openApiSchema}\n---` : ''}
-        
-        ${clarifications ? `**Additional Clarifications from User:**\n---\n${clarifications}\n---` : ''}
-    `;
 
-    const response = await ai.models.generateContent({
-        model: "gemini-2.5-flash",
-        contents: prompt,
-        config: {
-            responseMimeType: "application/json",
-            responseSchema: testCaseGenerationSchema,
-        },
+    let best: RagResult[] = [];
+    await readNdjson(response, (event: RagStreamEvent) => {
+        if (event.event === 'raw' || event.event === 'fused') best = event.results;
+        onEvent(event);
     });
+    return best;
+}
 
-    const jsonText = response.text.trim();
-    const parsedResponse = JSON.parse(jsonText);
+/**
+ * Starts retrieval for `requirements` on the backend (POST /rag/prefetch) so it runs while the
+ * user answers the clarification questions. Resolves with a ticket for generateTestCases, or
+ * undefined if the prefetch could not be started (generation then retrieves as usual).
+ */
+export async function prefetchRetrieval(requirements: string): Promise<string | undefined> {
+    try {
+        const response = await fetch(`${RAG_SERVICE_URL}/rag/prefetch`, {
+            method: 'POST',
+            headers: ragServiceHeaders(),
+            body: JSON.stringify({ requirement: requirements }),
+        });
+        if (!response.ok) return undefined;
+        return (await response.json()).ticket;
+    } catch (error) {
+        console.warn("Retrieval prefetch failed:", error);
+        return undefined;
+    }
+}
 
-    // Ensure traceability field is set as an array from source_uri(s)
-    const testCases = (parsedResponse.testCases || []).map(tc => ({
-        ...tc,
-        traceability: tc.traceability || (traceabilityUris.length ? traceabilityUris : ['N/A'])
-    }));
+/**
+ * Runs retrieval and test case generation on the backend (POST /generate-test-cases) and
+ * reads the NDJSON stream it returns. `onTestCase` sees each test case as soon as it is produced;
+ * `ticket` (from prefetchRetrieval) reuses retrieval already started for these requirements.
+ */
+export async function generateTestCases(
+    requirements: string,
+    openApiSchema?: string,
+    clarifications?: string,
+    { onTestCase = () => {}, ticket }: { onTestCase?: (testCase: TestCase) => void; ticket?: string } = {},
+): Promise<{ testCases: TestCase[]; featureGaps: string[] }> {
+    const response = await fetch(`${RAG_SERVICE_URL}/generate-test-cases`, {
+        method: 'POST',
+        headers: ragServiceHeaders(),
+        body: JSON.stringify({ requirements, open_api_schema: openApiSchema, clarifications, ticket }),
+    });
+    if (!response.ok) {
+        throw new Error(`/generate-test-cases failed with status ${response.status}`);
+    }
 
-    return {
-        testCases,
-        featureGaps: parsedResponse.featureGaps || []
-    };
+    const testCases: TestCase[] = [];
+    let featureGaps: string[] = [];
+    let error: string | undefined;
+    await readNdjson(response, (event: TestCaseStreamEvent) => {
+        if (event.event === 'test_case') {
+            testCases.push(event.test_case);
+            onTestCase(event.test_case);
+        } else if (event.event === 'feature_gaps') {
+            featureGaps = event.feature_gaps;
+        } else if (event.event === 'error') {
+            error = event.message;
+        }
+    });
+    if (error && !testCases.length) {
+        throw new Error(`Test case generation failed: ${error}`);
+    }
+    return { testCases, featureGaps };
 }
 
 
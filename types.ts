@@ -34,3 +34,50 @@ export interface User {
   id: string;
   email: string;
 }
+
+export interface RagResult {
+  text: string;
+  score: number;
+  source_uri: string;
+  // Retrieval lane the chunk came from, e.g. 'regulations' or 'source_code'
+  lane?: string;
+  // Source-code chunks: the file/line ranges they cover
+  locations?: { path: string; start_line: number; end_line: number; symbol: string }[];
+  // Present on results of the "fused" stream event
+  fused_score?: number;
+  matched_queries?: number;
+}
+
+// Events of POST /rag/stream, one JSON object per line, in this order (see README.md)
+export type RagStreamEvent =
+  | { event: 'raw'; query: string; results: RagResult[] }
+  | { event: 'queries'; queries: string[] }
+  | { event: 'subquery'; index: number; query: string; results: RagResult[] }
+  | { event: 'fused'; results: RagResult[] }
+  | { event: 'error'; message: string; retry_after: number }
+  | { event: 'done'; degraded: string[]; elapsed_ms: number };
+
+// POST /rag with "compact": true; full texts come from GET /chunks?ids=...
+export interface CompactRagResponse {
+  sources: string[];
+  results: {
+    id: string;
+    score: number;
+    source: number;  // Index into `sources`
+    snippet: string;
+    locations?: RagResult['locations'];
+  }[];
+}
+
+export interface ChunksResponse {
+  chunks: Record<string, Omit<RagResult, 'score'>>;
+  missing: string[];
+}
+
+// Events of POST /generate-test-cases, one JSON object per line, in this order
+export type TestCaseStreamEvent =
+  | { event: 'context'; sources: string[]; degraded: string[] }
+  | { event: 'test_case'; test_case: TestCase }
+  | { event: 'feature_gaps'; feature_gaps: string[] }
+  | { event: 'error'; message: string }
+  | { event: 'done'; test_cases: number; elapsed_ms: number };
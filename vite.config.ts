@@ -8,7 +8,9 @@ export default defineConfig(({ mode }) => {
       plugins: [react()],
       define: {
         'process.env.API_KEY': JSON.stringify(env.GEMINI_API_KEY),
-        'process.env.GEMINI_API_KEY': JSON.stringify(env.GEMINI_API_KEY)
+        'process.env.GEMINI_API_KEY': JSON.stringify(env.GEMINI_API_KEY),
+        'process.env.RAG_SERVICE_URL': JSON.stringify(env.RAG_SERVICE_URL || ''),
+        'process.env.RAG_SERVICE_API_KEY': JSON.stringify(env.RAG_SERVICE_API_KEY || '')
       },
       resolve: {
         alias: {